@@ -1,16 +1,18 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_caching import Cache
+from sqlalchemy import event
 import os
 
 # 初始化扩展
 db = SQLAlchemy()
-migrate = Migrate()
+# 数据库迁移只在flask命令行中初始化，见 _init_migrate
+migrate = None
 cache = Cache()
 
 
-def create_app():
+def create_app(config_overrides=None):
+    """创建应用，config_overrides用于覆盖配置（如压测时使用临时数据库和本地模拟服务）"""
     app = Flask(__name__, instance_relative_config=True)
 
     # 获取项目根目录
@@ -37,10 +39,18 @@ def create_app():
                                                app.config.get('OCR_API_URL', 'https://api.ocr.space/parse/image'))
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', app.config.get('SECRET_KEY', '8080'))
 
+    if config_overrides:
+        app.config.update(config_overrides)
+
+    # 日志（队列异步输出、密钥脱敏），需在导入其他模块前配置
+    from . import log
+    log.init_app(app)
+
     # 确保上传文件夹存在
     upload_folder = app.config.get('UPLOAD_FOLDER', os.path.join(base_dir, 'app/static/uploads'))
     os.makedirs(upload_folder, exist_ok=True)
     app.config['UPLOAD_FOLDER'] = upload_folder
+    app.config.setdefault('THUMBNAIL_FOLDER', os.path.join(base_dir, 'app/static/thumbs'))
 
     # 确保实例文件夹存在
     try:
@@ -50,26 +60,76 @@ def create_app():
 
     # 初始化扩展
     db.init_app(app)
-    migrate.init_app(app, db)
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        _init_migrate(app)
     cache.init_app(app)
 
+    # SQLite启用WAL，多线程/多进程部署时读写互不阻塞
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _set_sqlite_pragma)
+
+    # 补齐旧数据库缺少的表、列和索引
+    if app.config.get('AUTO_UPGRADE_SCHEMA', True):
+        from . import schema
+        with app.app_context():
+            schema.upgrade()
+
+    # 后台任务队列（OCR识别、分析报告）
+    from . import tasks
+    tasks.init_app(app)
+    # OCR.space配额限速与优先级调度
+    from . import scheduler
+    scheduler.init_app(app)
+    # DeepSeek熔断器
+    from . import breaker
+    breaker.init_app(app)
+
+    # 请求耗时统计和按需的cProfile性能分析
+    from . import metrics
+    metrics.init_app(app)
+
     # 注册蓝图
     from . import main
     app.register_blueprint(main.bp)
 
+    # 当前学生（导航栏切换）
+    from . import students
+    students.init_app(app)
+
+    # 模板中生成带内容哈希的图片地址
+    from .media import media_url
+    app.add_template_global(media_url)
+    # 模板中生成打包后的前端资源地址
+    from .assets import asset_url
+    app.add_template_global(asset_url)
+
     # 添加CSRF保护
     @app.context_processor
     def inject_csrf_token():
         return dict(csrf_token=lambda: generate_csrf())
 
-    # 打印配置信息，用于调试
-    with app.app_context():
-        print(f"DEEPSEEK_API_KEY: {app.config.get('DEEPSEEK_API_KEY')}")
-        print(f"DEEPSEEK_API_URL: {app.config.get('DEEPSEEK_API_URL')}")
+    app.logger.debug("DEEPSEEK_API_URL: %s", app.config.get('DEEPSEEK_API_URL'))
 
     return app
 
 
+def _init_migrate(app):
+    """初始化Flask-Migrate（alembic较重，Web工作进程不加载）"""
+    global migrate
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
+
+
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """为每个SQLite连接开启WAL日志和忙等待"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA busy_timeout=15000')
+    cursor.close()
+
+
 def generate_csrf():
     """生成CSRF令牌"""
     import secrets
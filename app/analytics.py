@@ -0,0 +1,103 @@
+import logging
+import os
+
+from . import metrics
+from .selection import SUBJECT_COLUMNS
+from .snapshot import (EXAM_SCORES, QUESTION_REASONS, QUESTION_TAGS, STATE_FILE, SnapshotError, dataset_schemas,
+                       require_pyarrow, snapshot_folder)
+
+logger = logging.getLogger(__name__)
+
+# 可以分组的维度（school_year、grade是分区列，按它们筛选时只读取对应目录）
+GROUP_KEYS = ('school_year', 'grade', 'term', 'student_id', 'exam_type', 'subject', 'month')
+
+
+def _dataset(name):
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    folder = snapshot_folder()
+    if not os.path.exists(os.path.join(folder, STATE_FILE)):
+        raise SnapshotError('还没有分析快照，请先执行 flask --app run.py analytics-snapshot')
+    path = os.path.join(folder, name)
+    if not os.path.isdir(path):
+        # 快照中还没有这类数据（如错题都没有知识点标签）
+        return ds.dataset(pa.Table.from_pylist([], schema=dataset_schemas()[name]))
+    return ds.dataset(path, format='parquet', partitioning='hive')
+
+
+def _filter(school_years=None, grades=None, student_id=None, subject=None):
+    import pyarrow.compute as pc
+
+    expression = None
+    for column, values in (('school_year', school_years), ('grade', grades)):
+        if values:
+            condition = pc.field(column).isin(list(values))
+            expression = condition if expression is None else expression & condition
+    for column, value in (('student_id', student_id), ('subject', subject)):
+        if value:
+            condition = pc.field(column) == value
+            expression = condition if expression is None else expression & condition
+    return expression
+
+
+def scan(name, columns, school_years=None, grades=None, student_id=None, subject=None):
+    """只读取需要的列，按分区列筛选时跳过其他目录，其他条件下推到Parquet文件的行组统计，返回pyarrow Table"""
+    require_pyarrow()
+    with metrics.span('analytics.scan'):
+        return _dataset(name).to_table(columns=list(columns),
+                                       filter=_filter(school_years, grades, student_id, subject))
+
+
+def _rows(table, sort_keys):
+    rows = table.to_pylist()
+    rows.sort(key=lambda row: tuple((row[key] is None, row[key]) for key in sort_keys))
+    return rows
+
+
+def score_averages(subject, by=('grade', 'school_year'), school_years=None, grades=None, student_id=None):
+    """
+    某科的平均分、最高分、最低分和考试人次，按by中的维度分组，例如“三年来各年级的数学平均分”
+    返回 [{维度..., 'average', 'max', 'min', 'exams'}]
+    """
+    column = SUBJECT_COLUMNS.get(subject, subject)
+    if column not in SUBJECT_COLUMNS.values():
+        raise ValueError(f'不支持的科目: {subject}')
+    by = [key for key in by if key in GROUP_KEYS and key not in ('subject', 'month')]
+    table = scan(EXAM_SCORES, [*by, column], school_years, grades, student_id)
+    result = table.filter(table[column].is_valid()).group_by(by).aggregate(
+        [(column, 'mean'), (column, 'max'), (column, 'min'), (column, 'count')])
+    result = result.rename_columns([{f'{column}_mean': 'average', f'{column}_max': 'max',
+                                     f'{column}_min': 'min', f'{column}_count': 'exams'}.get(name, name)
+                                    for name in result.column_names])
+    return _rows(result, by)
+
+
+def _count(name, key, by, school_years, grades, student_id, subject, limit):
+    by = [item for item in by if item in GROUP_KEYS and item != 'exam_type']
+    table = scan(name, [*by, key, 'questions'], school_years, grades, student_id, subject)
+    result = table.group_by([*by, key]).aggregate([('questions', 'sum')])
+    result = result.rename_columns(['questions' if name == 'questions_sum' else name for name in result.column_names])
+    rows = result.to_pylist()
+    rows.sort(key=lambda row: (tuple((row[item] is None, row[item]) for item in by), -row['questions']))
+    if limit:
+        # 每组只保留错题数最多的limit项
+        kept, seen = [], {}
+        for row in rows:
+            group = tuple(row[item] for item in by)
+            seen[group] = seen.get(group, 0) + 1
+            if seen[group] <= limit:
+                kept.append(row)
+        rows = kept
+    return rows
+
+
+def reason_counts(by=('school_year',), school_years=None, grades=None, student_id=None, subject=None, limit=None):
+    """各错误原因的错题数，按by中的维度分组"""
+    return _count(QUESTION_REASONS, 'reason', by, school_years, grades, student_id, subject, limit)
+
+
+def knowledge_point_counts(by=('school_year',), school_years=None, grades=None, student_id=None, subject=None,
+                           limit=10):
+    """各知识点的错题数，每组返回错题数最多的limit个"""
+    return _count(QUESTION_TAGS, 'knowledge_point', by, school_years, grades, student_id, subject, limit)
@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import subprocess
+
+from flask import current_app, abort, request, send_file, url_for
+from werkzeug.utils import safe_join
+
+# Tailwind源文件和预编译的样式表（相对static目录），样式表提交到仓库，由 flask build-tailwind 重新生成
+TAILWIND_SOURCE = 'css/tailwind.src.css'
+TAILWIND_OUTPUT = 'vendor/tailwind/tailwind.min.css'
+
+# 需要打包的前端资源（相对static目录），输出文件名带内容哈希
+BUNDLES = [
+    TAILWIND_OUTPUT,
+    'js/main.js',
+    'css/main.css',
+    'vendor/chart.js/chart.umd.min.js',
+    'vendor/font-awesome/css/font-awesome.min.css',
+]
+
+# 原样复制的资源（CSS中按相对路径引用的字体），URL中已带版本号
+PASSTHROUGH = [
+    'vendor/font-awesome/fonts/fontawesome-webfont.woff2',
+    'vendor/font-awesome/fonts/fontawesome-webfont.woff',
+    'vendor/font-awesome/fonts/fontawesome-webfont.ttf',
+]
+
+# 需要生成gzip/brotli预压缩版本的文件类型
+COMPRESSIBLE = ('.js', '.css', '.svg', '.ttf')
+
+MANIFEST_NAME = 'manifest.json'
+MAX_AGE = 365 * 24 * 3600
+
+_manifest = None
+_manifest_mtime = None
+
+
+def _dist_folder(app=None):
+    app = app or current_app
+    return os.path.join(app.static_folder, 'dist')
+
+
+def _minify(path, text):
+    """压缩JS/CSS，已压缩的第三方文件保持原样"""
+    if '.min.' in os.path.basename(path):
+        return text
+    if path.endswith('.js'):
+        try:
+            from rjsmin import jsmin
+        except ImportError:
+            # 保守处理：只去掉整行注释、缩进和空行
+            lines = (line.strip() for line in text.splitlines())
+            return '\n'.join(line for line in lines if line and not line.startswith('//'))
+        return jsmin(text)
+    if path.endswith('.css'):
+        try:
+            from rcssmin import cssmin
+        except ImportError:
+            text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+            text = re.sub(r'\s+', ' ', text)
+            return re.sub(r'\s*([{};,])\s*', r'\1', text).strip()
+        return cssmin(text)
+    return text
+
+
+def _write_variants(target, data):
+    """写入文件及其gzip/brotli预压缩版本"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+    if not target.endswith(COMPRESSIBLE):
+        return
+
+    # mtime固定为0，内容不变时压缩结果也不变
+    with open(target + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(target + '.br', 'wb') as f:
+        f.write(brotli.compress(data, quality=11))
+
+
+def build(app):
+    """压缩、加哈希并预压缩所有前端资源，返回清单 {原路径: 输出路径}"""
+    static = app.static_folder
+    dist = _dist_folder(app)
+    shutil.rmtree(dist, ignore_errors=True)
+
+    manifest = {}
+    for name in BUNDLES:
+        with open(os.path.join(static, name), encoding='utf-8') as f:
+            data = _minify(name, f.read()).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()[:10]
+        stem, ext = os.path.splitext(name)
+        output = f"{stem}.{digest}{ext}"
+        _write_variants(os.path.join(dist, output), data)
+        manifest[name] = output
+
+    for name in PASSTHROUGH:
+        with open(os.path.join(static, name), 'rb') as f:
+            _write_variants(os.path.join(dist, name), f.read())
+        manifest[name] = name
+
+    with open(os.path.join(dist, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def build_tailwind(app, executable):
+    """用Tailwind独立CLI编译样式表（扫描templates和static/js中用到的class），返回输出文件路径"""
+    source = os.path.join(app.static_folder, TAILWIND_SOURCE)
+    output = os.path.join(app.static_folder, TAILWIND_OUTPUT)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    subprocess.run([executable, '--input', source, '--output', output, '--minify'],
+                   cwd=os.path.dirname(source), check=True)
+    return output
+
+
+def load_manifest():
+    """读取打包清单（文件变化时自动重新加载），未打包时返回空字典"""
+    global _manifest, _manifest_mtime
+    path = os.path.join(_dist_folder(), MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    if _manifest is None or mtime != _manifest_mtime:
+        with open(path, encoding='utf-8') as f:
+            _manifest = json.load(f)
+        _manifest_mtime = mtime
+    return _manifest
+
+
+def asset_url(name):
+    """模板中使用的资源地址：已打包时返回带哈希的地址，否则返回static下的原文件"""
+    output = load_manifest().get(name)
+    if output is None:
+        return url_for('static', filename=name)
+    return url_for('main.asset', filename=output)
+
+
+def send_asset(filename):
+    """按Accept-Encoding发送预压缩版本，并设置长期缓存"""
+    path = safe_join(_dist_folder(), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accept = request.headers.get('Accept-Encoding', '')
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in accept and os.path.isfile(path + suffix):
+            path, encoding = path + suffix, candidate
+            break
+
+    response = send_file(path, mimetype=mimetype, conditional=True, max_age=MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import or_
+
+from . import media
+from .models import ErrorQuestion
+from .ocr import OCR_FAILED_CONTENT
+from .scheduler import BULK, ocr_scheduler
+from .tasks import ocr_queue
+
+logger = logging.getLogger(__name__)
+
+def select_questions(state='all', student_id=None, subject=None, grade=None, since=None, ids=None, min_age=10):
+    """
+    查询需要重新OCR的错题
+    state: failed（识别失败）、empty（内容为空，如PDF）、all（两者）
+    since: 本地时间（命令行 --since），upload_time 按UTC保存，比较前先转换
+    min_age: 只处理上传超过min_age分钟的记录，避免和刚上传、仍在识别中的记录重复
+    """
+    query = ErrorQuestion.query
+    failed = ErrorQuestion.content == OCR_FAILED_CONTENT
+    empty = or_(ErrorQuestion.content.is_(None), ErrorQuestion.content == '')
+    if state == 'failed':
+        query = query.filter(failed)
+    elif state == 'empty':
+        query = query.filter(empty)
+    else:
+        query = query.filter(or_(failed, empty))
+
+    if student_id:
+        query = query.filter(ErrorQuestion.student_id == student_id)
+    if subject:
+        query = query.filter(ErrorQuestion.subject == subject)
+    if grade:
+        query = query.filter(ErrorQuestion.grade == grade)
+    if since:
+        query = query.filter(ErrorQuestion.upload_time >= _local_to_utc(since))
+    if ids:
+        query = query.filter(ErrorQuestion.id.in_(ids))
+    if min_age:
+        query = query.filter(ErrorQuestion.upload_time <= datetime.utcnow() - timedelta(minutes=min_age))
+    return query.order_by(ErrorQuestion.id).all()
+
+
+def _local_to_utc(value):
+    """本地时间（naive）转换为与upload_time一致的UTC时间（naive）"""
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+class Checkpoint:
+    """
+    记录已处理的错题ID，中断后再次运行时跳过识别成功的记录
+    识别失败的ID只用于统计，下次运行时重新识别
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self.failed = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.done = set(data.get('done', []))
+            self.failed = set(data.get('failed', []))
+
+    def __contains__(self, question_id):
+        return question_id in self.done
+
+    def mark(self, question_id, ok):
+        with self._lock:
+            if ok:
+                self.done.add(question_id)
+                self.failed.discard(question_id)
+            else:
+                self.failed.add(question_id)
+            self._dirty = True
+
+    def save(self):
+        """原子写入，进程中途被杀也不会留下损坏的文件"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {'done': sorted(self.done), 'failed': sorted(self.failed),
+                    'updated': datetime.now().isoformat(timespec='seconds')}
+            self._dirty = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+
+class Progress:
+    """统计完成数、吞吐量和预计剩余时间"""
+
+    def __init__(self, total):
+        self.total = total
+        self.succeeded = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.succeeded + self.failed
+
+    def record(self, ok):
+        with self._cond:
+            if ok:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            self._cond.notify_all()
+
+    def wait(self, timeout):
+        """等待新的完成记录或超时，全部完成时返回True"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.finished >= self.total, timeout=timeout)
+            return self.finished >= self.total
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.finished / elapsed if elapsed else 0.0
+        remaining = self.total - self.finished
+        eta = _format_seconds(remaining / rate) if rate else '--:--'
+        return (f"已处理 {self.finished}/{self.total}（成功 {self.succeeded}，失败 {self.failed}），"
+                f"{rate * 60:.1f} 条/分钟，已用 {_format_seconds(elapsed)}，预计剩余 {eta}")
+
+
+def _format_seconds(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes:02d}:{seconds:02d}'
+
+
+def run_backfill(app, questions, concurrency=2, checkpoint_path=None, report_every=5.0, echo=print):
+    """
+    通过OCR调度器的批量通道重新识别questions，受OCR配额限速，配额用完时自动等待
+    每完成一条写入检查点；返回Progress
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    pending = [q for q in questions if q.id not in checkpoint]
+    skipped = len(questions) - len(pending)
+    if skipped:
+        echo(f"检查点中已有 {skipped} 条记录识别成功，跳过")
+    retried = sum(1 for q in pending if q.id in checkpoint.failed)
+    if retried:
+        echo(f"上次识别失败的 {retried} 条记录将重新识别")
+
+    # 命令行进程中没有交互任务，批量通道可以使用全部工作线程；
+    # 当日额度与Web服务共用，仍为单张上传保留 OCR_BULK_RESERVE_PER_DAY 次
+    ocr_queue.configure(concurrency)
+    ocr_scheduler.configure(bulk_reserve=0, reserve_worker=False,
+                            bulk_daily_reserve=app.config.get('OCR_BULK_RESERVE_PER_DAY', 0))
+
+    progress = Progress(len(pending))
+
+    def on_done(question_id, ok):
+        checkpoint.mark(question_id, ok)
+        progress.record(ok)
+
+    for question in pending:
+        file_path = media.original_path(question)
+        if not os.path.exists(file_path):
+            logger.warning("文件不存在，跳过: question_id=%s %s", question.id, file_path)
+            on_done(question.id, False)
+            continue
+        ocr_scheduler.submit(app, question.id, file_path, question.filename, lane=BULK,
+                             callback=on_done, file_type=question.file_type)
+
+    try:
+        while not progress.wait(timeout=report_every):
+            checkpoint.save()
+            echo(progress.summary())
+    except KeyboardInterrupt:
+        # 停止调度新任务，等正在识别的任务写入检查点后再退出
+        echo("已中断，等待进行中的识别完成...")
+        ocr_queue.drain(timeout=app.config.get('SHUTDOWN_TIMEOUT', 30))
+        echo("再次运行相同命令即可从检查点继续")
+    finally:
+        checkpoint.save()
+    echo(progress.summary())
+    return progress
@@ -0,0 +1,133 @@
+import json
+import logging
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+from sqlalchemy.orm import load_only
+
+from . import local_analysis, metrics, reports
+from .models import db, AnalysisResult, ReportBatch, Student
+from .tasks import batch_queue
+
+logger = logging.getLogger(__name__)
+
+# 已结束的报告状态（DeepSeek生成、本地报告作为最终报告、失败）
+FINISHED = (reports.DONE, reports.LOCAL, reports.FAILED)
+
+
+def select_students(grade=None, student_ids=None):
+    """批量生成的学生：指定的学生，或某个年级的全部学生"""
+    query = Student.query
+    if student_ids:
+        query = query.filter(Student.id.in_(student_ids))
+    elif grade:
+        query = query.filter(Student.grade == grade)
+    else:
+        raise ValueError('请选择年级或学生')
+    return query.order_by(Student.name).all()
+
+
+def create_batch(app, selection, grade=None, student_ids=None):
+    """
+    为一个年级（或指定的学生）批量生成分析报告，所有学生使用相同的选择条件
+    - 整批学生的统计只计算一次，保存在批次中，每份报告的草稿和DeepSeek提示词共用
+    - 先为每名学生保存本地草稿（没有符合条件数据的学生跳过），再提交到批量报告队列，
+      同时调用DeepSeek的数量受 BATCH_REPORT_CONCURRENCY 限制，每份报告完成后单独提交
+    没有可生成的报告时抛出ValueError
+    """
+    students = select_students(grade, student_ids)
+    if not students:
+        raise ValueError('没有符合条件的学生')
+
+    with metrics.span('batch.cohort'):
+        cohort = local_analysis.cohort_aggregate([student.id for student in students], selection)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M')
+    batch = ReportBatch(title=f"{grade or f'{len(students)} 名学生'} 批量报告 ({now})", grade=grade,
+                        selection=json.dumps(selection, ensure_ascii=False),
+                        cohort=json.dumps(cohort, ensure_ascii=False))
+    db.session.add(batch)
+    db.session.flush()
+
+    analyses = []
+    with metrics.span('batch.drafts'):
+        for student in students:
+            aggregates = local_analysis.aggregate(student.id, selection)
+            if local_analysis.is_empty(aggregates):
+                continue
+            draft = local_analysis.render_report(aggregates, cohort)
+            analyses.append(reports.create_draft(student.id, draft, selection, aggregates,
+                                                 title=f"{student.name} 学习分析报告 ({now})", batch_id=batch.id))
+    if not analyses:
+        db.session.rollback()
+        raise ValueError('所选学生都没有符合条件的考试或错题')
+    batch.total = len(analyses)
+    db.session.commit()
+
+    for analysis in analyses:
+        reports.submit(app, analysis, queue=batch_queue)
+    logger.info("批量报告已创建: batch_id=%s，%d 名学生，%d 份报告", batch.id, len(students), batch.total)
+    return batch
+
+
+def resume(app, batch):
+    """重新提交批次中仍在等待的报告（生成过程中进程重启时使用），返回提交的数量"""
+    pending = AnalysisResult.query.options(load_only(AnalysisResult.id, AnalysisResult.title, AnalysisResult.status)) \
+        .filter(AnalysisResult.batch_id == batch.id, AnalysisResult.status == reports.PENDING).all()
+    for analysis in pending:
+        reports.submit(app, analysis, queue=batch_queue)
+    return len(pending)
+
+
+def recover_stale(batch):
+    """整批创建后超过 reports.stale_after 仍为pending的报告改为本地报告（任务已丢失），返回修改的数量"""
+    if datetime.utcnow() - batch.create_time < reports.stale_after(batch):
+        return 0
+    pending = AnalysisResult.query.filter(AnalysisResult.batch_id == batch.id,
+                                          AnalysisResult.status == reports.PENDING).all()
+    return sum(reports.recover_stale(analysis) for analysis in pending)
+
+
+def progress(batch):
+    """批次进度，从数据库统计（任何进程都能查询），包含已用时间和预计剩余时间（秒）"""
+    counts = dict(db.session.query(AnalysisResult.status, func.count())
+                  .filter(AnalysisResult.batch_id == batch.id).group_by(AnalysisResult.status).all())
+    finished = sum(counts.get(status, 0) for status in FINISHED)
+    elapsed = (datetime.utcnow() - batch.create_time).total_seconds()
+    remaining = batch.total - finished
+    return {
+        'total': batch.total,
+        'finished': finished,
+        'counts': counts,
+        'elapsed': round(elapsed),
+        'eta': round(elapsed / finished * remaining) if finished and remaining else None,
+    }
+
+
+def items(batch):
+    """批次中的报告（不加载报告内容）和学生姓名"""
+    return db.session.query(AnalysisResult, Student.name) \
+        .options(load_only(AnalysisResult.id, AnalysisResult.title, AnalysisResult.status,
+                           AnalysisResult.status_message)) \
+        .join(Student, Student.id == AnalysisResult.student_id) \
+        .filter(AnalysisResult.batch_id == batch.id).order_by(Student.name).all()
+
+
+def wait(batch, interval=5.0, echo=print):
+    """命令行等待批次完成并输出进度，返回最终进度"""
+    while True:
+        idle = batch_queue.depth == 0
+        db.session.rollback()  # 结束当前读事务，读取其他线程提交的结果
+        state = progress(batch)
+        echo(summary(state))
+        if idle or state['finished'] >= state['total']:
+            return state
+        time.sleep(interval)
+
+
+def summary(state):
+    counts = state['counts']
+    eta = f"，预计剩余 {state['eta']} 秒" if state['eta'] is not None else ''
+    return (f"已完成 {state['finished']}/{state['total']}（DeepSeek {counts.get(reports.DONE, 0)}，"
+            f"本地 {counts.get(reports.LOCAL, 0)}，失败 {counts.get(reports.FAILED, 0)}），"
+            f"已用 {state['elapsed']} 秒{eta}")
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATES = (CLOSED, OPEN, HALF_OPEN)
+
+
+class CircuitBreaker:
+    """
+    上游服务熔断器
+    - 关闭：正常调用，记录最近window秒内每次调用的成败和耗时
+    - 打开：最近的错误率或慢调用比例超过阈值时打开，open_seconds秒内直接拒绝调用
+    - 半开：打开时间到后放行一个探测请求，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, name, window=60, min_requests=5, error_rate=0.5, slow_seconds=30, slow_rate=0.5,
+                 open_seconds=30, clock=time.monotonic):
+        self.name = name
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._calls = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started = None
+        self.configure(window, min_requests, error_rate, slow_seconds, slow_rate, open_seconds)
+
+    def configure(self, window=60, min_requests=5, error_rate=0.5, slow_seconds=30, slow_rate=0.5, open_seconds=30):
+        with self._lock:
+            self.window = window
+            self.min_requests = min_requests
+            self.error_rate = error_rate
+            self.slow_seconds = slow_seconds
+            self.slow_rate = slow_rate
+            self.open_seconds = open_seconds
+
+    @property
+    def state(self):
+        with self._lock:
+            self._advance(self._clock())
+            return self._state
+
+    def allow(self):
+        """是否允许调用上游；半开状态下同一时间只放行一个探测请求"""
+        with self._lock:
+            now = self._clock()
+            self._advance(now)
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probe_started is None:
+                self._probe_started = now
+                return True
+            REJECTIONS.inc(name=self.name)
+            return False
+
+    def record(self, success, duration=0.0):
+        """记录一次调用的结果"""
+        with self._lock:
+            now = self._clock()
+            slow = bool(self.slow_seconds) and duration >= self.slow_seconds
+            if self._state == HALF_OPEN:
+                self._probe_started = None
+                if success and not slow:
+                    self._calls.clear()
+                    self._transition(CLOSED, now)
+                else:
+                    self._transition(OPEN, now)
+                return
+            if self._state == OPEN:
+                # 打开前已经发出的请求，结果不再影响状态
+                return
+
+            self._calls.append((now, success, slow))
+            self._trim(now)
+            total = len(self._calls)
+            if total < self.min_requests:
+                return
+            errors = sum(1 for _, ok, _ in self._calls if not ok)
+            slows = sum(1 for _, _, is_slow in self._calls if is_slow)
+            if errors / total >= self.error_rate or (self.slow_rate and slows / total >= self.slow_rate):
+                logger.warning("熔断器 %s 打开：最近 %d 次调用中失败 %d 次、慢调用 %d 次", self.name, total, errors, slows)
+                self._transition(OPEN, now)
+
+    def _trim(self, now):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _advance(self, now):
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN, now)
+        elif self._state == HALF_OPEN and self._probe_started is not None \
+                and now - self._probe_started >= self.open_seconds:
+            # 探测请求长时间没有结果（例如进程内异常未记录），允许再次探测
+            self._probe_started = None
+
+    def _transition(self, state, now):
+        if state == self._state:
+            return
+        logger.info("熔断器 %s: %s -> %s", self.name, self._state, state)
+        TRANSITIONS.inc(name=self.name, from_state=self._state, to_state=state)
+        self._state = state
+        if state == OPEN:
+            self._opened_at = now
+            self._calls.clear()
+        self._probe_started = None
+
+
+TRANSITIONS = metrics.Counter('circuit_breaker_transitions_total', '熔断器状态变化次数')
+REJECTIONS = metrics.Counter('circuit_breaker_rejections_total', '熔断器打开时被直接拒绝的调用次数')
+
+# DeepSeek分析接口的熔断器
+deepseek_breaker = CircuitBreaker('deepseek')
+
+metrics.Gauge('circuit_breaker_state', '熔断器当前状态（当前状态为1）',
+              lambda: {(('name', b.name), ('state', s)): int(b.state == s)
+                       for b in [deepseek_breaker] for s in STATES})
+
+
+def init_app(app):
+    """根据配置设置熔断阈值"""
+    deepseek_breaker.configure(
+        window=app.config.get('DEEPSEEK_BREAKER_WINDOW', 60),
+        min_requests=app.config.get('DEEPSEEK_BREAKER_MIN_REQUESTS', 5),
+        error_rate=app.config.get('DEEPSEEK_BREAKER_ERROR_RATE', 0.5),
+        slow_seconds=app.config.get('DEEPSEEK_BREAKER_SLOW_SECONDS', 30),
+        slow_rate=app.config.get('DEEPSEEK_BREAKER_SLOW_RATE', 0.5),
+        open_seconds=app.config.get('DEEPSEEK_BREAKER_OPEN_SECONDS', 30),
+    )
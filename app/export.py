@@ -0,0 +1,321 @@
+import csv
+import html
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+
+from . import media, metrics
+from .models import db, AnalysisResult, ErrorQuestion, QuestionTag
+from .selection import describe_selection, question_query
+
+logger = logging.getLogger(__name__)
+
+# 每次读取文件、输出数据的块大小
+CHUNK_SIZE = 64 * 1024
+# 每批从数据库读取的错题数
+BATCH_SIZE = 200
+
+# 图片：original为原图，sm/md为缩略图（见 media.VARIANTS），none不导出文件
+IMAGE_CHOICES = ('original', *media.VARIANTS, 'none')
+MANIFEST_CHOICES = ('csv', 'json')
+# 导出的筛选条件（与分析范围的筛选条件相同）
+EXPORT_FILTERS = ('subject', 'grade', 'date_from', 'date_to', 'reason')
+
+MANIFEST_COLUMNS = [('id', 'ID'), ('subject', '科目'), ('grade', '年级'), ('exam', '考试'), ('reason', '收录原因'),
+                    ('upload_time', '上传时间'), ('filename', '原始文件名'), ('file', '文件'),
+                    ('knowledge_points', '知识点'), ('content', '识别内容'), ('note', '备注')]
+
+EXPORT_BYTES = metrics.Counter('export_bytes_total', '导出的zip压缩包字节数')
+
+# 已经压缩过的文件不再压缩
+_STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.pdf'}
+
+
+class _ZipStream:
+    """zipfile的输出对象：只追加、不能seek，zipfile会为每个文件写数据描述符；写入的数据由生成器取走后清空"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _zip_info(name, when=None, stored=False):
+    when = when or datetime.now()
+    info = zipfile.ZipInfo(name, date_time=max(when, datetime(1980, 1, 1)).timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+    return info
+
+
+def _safe_name(value, default):
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', value or '').strip('_') or default
+
+
+def _questions(student_id, filters):
+    """按ID分批读取符合条件的错题，每批读取后从会话中移除，内存占用与错题总数无关"""
+    query = question_query(student_id, {'filters': filters}).order_by(None).order_by(ErrorQuestion.id)
+    last_id = 0
+    while True:
+        batch = query.filter(ErrorQuestion.id > last_id).limit(BATCH_SIZE).all()
+        if not batch:
+            return
+        ids = [question.id for question in batch]
+        tags = {}
+        for question_id, point in db.session.execute(
+                select(QuestionTag.question_id, QuestionTag.knowledge_point)
+                .where(QuestionTag.question_id.in_(ids)).order_by(QuestionTag.hits.desc())):
+            tags.setdefault(question_id, []).append(point)
+        yield [(question, tags.get(question.id, [])) for question in batch]
+        last_id = ids[-1]
+        db.session.expunge_all()
+
+
+def _reports(student_id, filters):
+    """符合条件的分析报告：按生成日期筛选，报告的分析范围中指定了其他科目或年级的跳过"""
+    query = AnalysisResult.query.filter(AnalysisResult.student_id == student_id)
+    if 'date_from' in filters:
+        query = query.filter(AnalysisResult.create_time >= datetime.fromisoformat(filters['date_from']))
+    if 'date_to' in filters:
+        query = query.filter(AnalysisResult.create_time < datetime.fromisoformat(filters['date_to']) + timedelta(days=1))
+    last_id = 0
+    while True:
+        batch = query.filter(AnalysisResult.id > last_id).order_by(AnalysisResult.id).limit(BATCH_SIZE // 10).all()
+        if not batch:
+            return
+        for analysis in batch:
+            scope = analysis.selection_filters.get('filters', {})
+            if any(key in filters and key in scope and scope[key] != filters[key] for key in ('subject', 'grade')):
+                continue
+            yield analysis
+        last_id = batch[-1].id
+        db.session.expunge_all()
+
+
+def _question_file(question, images):
+    """导出的文件路径和压缩包中的扩展名，文件不存在时返回 (None, None)"""
+    path = media.original_path(question)
+    if not os.path.exists(path):
+        return None, None
+    if images in media.VARIANTS:
+        try:
+            thumbnail = media.thumbnail_path(question, images, 'jpg')
+        except Exception as e:
+            logger.warning("生成缩略图失败，导出原图: question_id=%s %s", question.id, e)
+            thumbnail = None
+        if thumbnail:
+            return thumbnail, '.jpg'
+    return path, _original_extension(question)
+
+
+def _original_extension(question):
+    """原文件的扩展名，早期记录的文件名没有扩展名时按file_type补上"""
+    return os.path.splitext(question.file_path)[1].lower() or ('.pdf' if question.file_type == 'pdf' else '')
+
+
+def _manifest_row(question, tags, archive_name):
+    return {
+        'id': question.id,
+        'subject': question.subject or '',
+        'grade': question.grade or '',
+        'exam': question.exam or '',
+        'reason': question.reason or '',
+        'upload_time': question.upload_time.strftime('%Y-%m-%d %H:%M:%S') if question.upload_time else '',
+        'filename': question.filename,
+        'file': archive_name or '',
+        'knowledge_points': '、'.join(tags),
+        'content': question.content or '',
+        'note': question.note or '',
+    }
+
+
+def _archive_name(question, extension):
+    return f"questions/{_safe_name(question.subject, '未分类')}/{question.id}{extension}"
+
+
+def render_markdown(text):
+    """把报告的Markdown转换为HTML（标题、粗体、列表、表格、代码块、段落），与报告页面的显示一致"""
+    text = re.sub(r'\n#+ *结构化数据[\s\S]*$', '', text)
+    blocks = []
+    list_tag = None
+    paragraph = []
+
+    def close():
+        nonlocal list_tag
+        if paragraph:
+            blocks.append('<p>' + '<br>'.join(paragraph) + '</p>')
+            paragraph.clear()
+        if list_tag:
+            blocks.append(f'</{list_tag}>')
+            list_tag = None
+
+    def inline(value):
+        value = html.escape(value)
+        value = re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', value)
+        value = re.sub(r'\*(.+?)\*', r'<em>\1</em>', value)
+        value = re.sub(r'`([^`]+)`', r'<code>\1</code>', value)
+        return re.sub(r'\[([^\]]+)\]\(([^)\s]+)\)', link, value)
+
+    def link(match):
+        # 只保留http(s)和相对链接，javascript:等其他协议显示为纯文本
+        label, href = match.groups()
+        scheme = re.match(r'([^:/?#]*):', href)
+        if scheme and scheme.group(1).lower() not in ('http', 'https'):
+            return label
+        return f'<a href="{href}">{label}</a>'
+
+    lines = iter(text.splitlines())
+    for line in lines:
+        stripped = line.strip()
+        heading = re.match(r'(#{1,4}) +(.*)', stripped)
+        bullet = re.match(r'[-*] +(.*)', stripped)
+        numbered = re.match(r'\d+(?:\. +|、)(.*)', stripped)
+        table = len(stripped) > 1 and stripped.startswith('|') and stripped.endswith('|')
+        if stripped.startswith('```'):
+            close()
+            code = []
+            for code_line in lines:
+                if code_line.strip().startswith('```'):
+                    break
+                code.append(html.escape(code_line))
+            blocks.append('<pre><code>' + '\n'.join(code) + '</code></pre>')
+        elif heading:
+            close()
+            level = len(heading.group(1))
+            blocks.append(f'<h{level}>{inline(heading.group(2))}</h{level}>')
+        elif bullet or numbered or table:
+            tag = 'ul' if bullet else 'ol' if numbered else 'table'
+            if paragraph or list_tag != tag:
+                close()
+                blocks.append(f'<{tag}>')
+                list_tag = tag
+            if table:
+                # 跳过表头分隔行 |---|---|
+                if not re.fullmatch(r'[|:\-\s]+', stripped):
+                    cells = ''.join(f'<td>{inline(cell.strip())}</td>' for cell in stripped.strip('|').split('|'))
+                    blocks.append(f'<tr>{cells}</tr>')
+            else:
+                blocks.append(f'<li>{inline((bullet or numbered).group(1))}</li>')
+        elif not stripped:
+            close()
+        else:
+            if list_tag:
+                close()
+            paragraph.append(inline(stripped))
+    close()
+    return '\n'.join(blocks)
+
+
+def stream_archive(student_id, filters, images='original', manifest='csv', include_reports=True):
+    """
+    生成zip压缩包的数据块（生成器）：错题文件、错题清单（CSV或JSON）、分析报告（Markdown和HTML）
+    边读边写：文件按CHUNK_SIZE分块读取，错题按BATCH_SIZE分批查询，每写完一块就输出，
+    内存占用与导出的数量和大小无关；图片和PDF不再压缩（ZIP_STORED），文本使用deflate
+    清单在写文件的同时写入临时文件，最后加入压缩包
+    需要在应用上下文中迭代（Web请求中使用 stream_with_context）
+    """
+    stream = _ZipStream()
+    total = 0
+
+    def take():
+        nonlocal total
+        data = stream.take()
+        total += len(data)
+        EXPORT_BYTES.inc(len(data))
+        return data
+
+    with metrics.span('export.archive'), zipfile.ZipFile(stream, 'w', allowZip64=True) as archive:
+        exported = 0
+        # 1. 错题文件：每道题只确定一次导出的文件（缩略图生成失败时为原图）和压缩包中的文件名，
+        #    清单行同时写入临时文件，保证清单中的路径与压缩包中的文件一致
+        with tempfile.TemporaryFile() as spool:
+            text = io.TextIOWrapper(spool, encoding='utf-8-sig' if manifest == 'csv' else 'utf-8', newline='')
+            if manifest == 'csv':
+                writer = csv.writer(text)
+                writer.writerow([title for _, title in MANIFEST_COLUMNS])
+            else:
+                text.write('[')
+            for batch in _questions(student_id, filters):
+                for question, tags in batch:
+                    archive_name = None
+                    if images != 'none':
+                        path, extension = _question_file(question, images)
+                        if path is None:
+                            logger.warning("导出时文件不存在，跳过: question_id=%s %s", question.id, question.file_path)
+                        else:
+                            archive_name = _archive_name(question, extension)
+                            info = _zip_info(archive_name, question.upload_time, stored=extension in _STORED_EXTENSIONS)
+                            info.file_size = os.path.getsize(path)
+                            with open(path, 'rb') as source, archive.open(info, 'w') as entry:
+                                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                                    entry.write(chunk)
+                                    yield take()
+                            yield take()
+                    row = _manifest_row(question, tags, archive_name)
+                    if manifest == 'csv':
+                        writer.writerow([row[key] for key, _ in MANIFEST_COLUMNS])
+                    else:
+                        text.write((',\n' if exported else '\n') + json.dumps(row, ensure_ascii=False))
+                    exported += 1
+                yield take()
+            if manifest == 'json':
+                text.write('\n]\n')
+            text.flush()
+            text.detach()
+
+            # 2. 清单：从临时文件分块复制
+            spool.seek(0)
+            with archive.open(_zip_info(f'manifest.{manifest}'), 'w') as entry:
+                for chunk in iter(lambda: spool.read(CHUNK_SIZE), b''):
+                    entry.write(chunk)
+                    yield take()
+        yield take()
+
+        # 3. 分析报告
+        reports = 0
+        if include_reports:
+            template = current_app.jinja_env.get_template('export_report.html')
+            for analysis in _reports(student_id, filters):
+                name = f"reports/{analysis.id}_{analysis.create_time:%Y%m%d}"
+                archive.writestr(_zip_info(f'{name}.md', analysis.create_time), analysis.content)
+                # 独立页面，不使用上下文处理器（命令行导出时没有请求）
+                page = template.render(analysis=analysis, scope=describe_selection(analysis.selection_filters),
+                                       body=render_markdown(analysis.content))
+                archive.writestr(_zip_info(f'{name}.html', analysis.create_time), page)
+                reports += 1
+                yield take()
+
+        archive.writestr(_zip_info('README.txt'), _readme(filters, images, manifest, exported, reports))
+    yield take()
+    logger.info("导出完成: 学生 %s，%d 道错题，%d 份报告，%.1f MB", student_id, exported, reports, total / 1024 / 1024)
+
+
+def _readme(filters, images, manifest, questions, reports):
+    scope = describe_selection({'filters': filters})
+    image_text = {'original': '原图', 'none': '不包含'}.get(images, f'缩略图（{images}）')
+    return (f"学析优导出 {date.today()}\r\n"
+            f"范围：{scope}\r\n"
+            f"错题：{questions} 道，清单见 manifest.{manifest}，文件在 questions/科目/ 目录（{image_text}）\r\n"
+            f"分析报告：{reports} 份，在 reports/ 目录（.md为原文，.html可直接用浏览器打开）\r\n")
+
+
+def export_filename(filters):
+    parts = [filters[key] for key in ('grade', 'subject') if key in filters]
+    return '学析优导出_' + '_'.join(parts + [date.today().strftime('%Y%m%d')]) + '.zip'
@@ -0,0 +1,161 @@
+import logging
+import re
+
+from . import metrics
+from .models import AnalysisResult, ErrorQuestion, ExamScore
+from .selection import exam_query, question_query
+
+logger = logging.getLogger(__name__)
+
+# 章节标题关键词与章节依赖的数据，没有匹配的章节（学习建议、学习计划等）依赖全部数据
+SECTION_DEPENDENCIES = [
+    (('成绩趋势', '学科'), {'exams'}),
+    (('错题', '错误', '知识点'), {'questions'}),
+]
+
+# 新增数据超过全部数据的这个比例时，重新生成整份报告
+MAX_DELTA_RATIO = 0.5
+
+SECTIONS = metrics.Counter('analysis_sections_total', '增量分析中重新生成（regenerated）和沿用（reused）的报告章节数')
+PROMPT_CHARS = metrics.Histogram('analysis_prompt_chars', '发送给DeepSeek的提示词长度（字符）',
+                                 buckets=(500, 1000, 2000, 5000, 10000, 20000, 50000, 100000))
+
+# 报告中的图表数据块（DeepSeek返回的或本地统计的），拆分章节时去掉，合并后重新追加
+_STRUCTURED = re.compile(r'\n#+ *结构化数据[\s\S]*$')
+_CHART_BLOCK = re.compile(r'```[^\n]*\n\s*(成绩趋势数据|学科对比数据|错题类型数据)[：:][\s\S]*?```\n?')
+_NUMBERING = re.compile(r'^[\d一二三四五六七八九十]+[.、．)）]\s*')
+
+
+def find_predecessor(analysis):
+    """
+    同一学生、相同选择条件的上一份DeepSeek报告（旧报告没有记录最大记录ID，不能沿用）
+    批量报告包含“年级对比”章节，不作为单份报告的上一份报告
+    """
+    return AnalysisResult.query.filter(
+        AnalysisResult.student_id == analysis.student_id,
+        AnalysisResult.batch_id.is_(None),
+        AnalysisResult.selection == analysis.selection,
+        AnalysisResult.status == 'done',
+        AnalysisResult.id != analysis.id,
+        AnalysisResult.create_time <= analysis.create_time,
+        AnalysisResult.exam_count.isnot(None),
+        AnalysisResult.question_count.isnot(None),
+    ).order_by(AnalysisResult.create_time.desc()).first()
+
+
+def compute_delta(previous, analysis, max_questions=200):
+    """
+    计算上一份报告之后新增的考试和错题（ID在两份报告的最大ID之间）
+    旧数据被删除或修改后不再符合条件（数量对不上），或新增数据太多时返回None，需要重新生成整份报告
+    """
+    selection = analysis.selection_filters
+    exams = exam_query(analysis.student_id, selection).filter(
+        ExamScore.id > (previous.max_exam_id or 0), ExamScore.id <= (analysis.max_exam_id or 0)).all()
+    questions = question_query(analysis.student_id, selection).filter(
+        ErrorQuestion.id > (previous.max_question_id or 0), ErrorQuestion.id <= (analysis.max_question_id or 0))
+    question_count = questions.order_by(None).count()
+
+    if analysis.exam_total - len(exams) != previous.exam_total or \
+            analysis.question_total - question_count != previous.question_total:
+        logger.info("上一份报告之后有数据被删除或修改，重新生成整份报告: analysis_id=%s", analysis.id)
+        return None
+    total = analysis.exam_total + analysis.question_total
+    if total and (len(exams) + question_count) / total > MAX_DELTA_RATIO:
+        logger.info("新增数据较多，重新生成整份报告: analysis_id=%s", analysis.id)
+        return None
+    return {'exams': exams, 'questions': questions.limit(max_questions).all(), 'question_count': question_count}
+
+
+def split_sections(content):
+    """按二级标题拆分Markdown报告，返回 (标题前的内容, [(标题, 章节内容)])，图表数据块会被去掉"""
+    content = _CHART_BLOCK.sub('', _STRUCTURED.sub('', content))
+    parts = re.split(r'(?m)^(?=## )', content)
+    preamble = '' if parts[0].startswith('## ') else parts[0]
+    sections = []
+    for part in parts:
+        if part.startswith('## '):
+            title = part.split('\n', 1)[0][3:].strip()
+            sections.append((title, part.rstrip() + '\n\n'))
+    return preamble, sections
+
+
+def extract_chart_block(content):
+    """从报告中取出末尾的图表数据块（由 local_analysis.chart_block 按本地统计生成）"""
+    match = _STRUCTURED.search(content)
+    return match.group(0).lstrip('\n') if match else ''
+
+
+def _normalize(title):
+    return _NUMBERING.sub('', title).replace(' ', '')
+
+
+def affected_sections(sections, delta):
+    """受新增数据影响、需要重新生成的章节标题"""
+    changed = set()
+    if delta['exams']:
+        changed.add('exams')
+    if delta['question_count']:
+        changed.add('questions')
+    affected = []
+    for title, _ in sections:
+        dependencies = next((deps for keywords, deps in SECTION_DEPENDENCIES
+                             if any(keyword in title for keyword in keywords)), {'exams', 'questions'})
+        if dependencies & changed:
+            affected.append(title)
+    return affected
+
+
+def _summarize(aggregates):
+    """整体统计摘要，代替完整的历史数据放入提示词"""
+    content = ""
+    exams = aggregates['exams']
+    if exams:
+        content += f"- 共 {len(exams)} 次考试，各科平均分: "
+        content += "、".join(f"{name} {score:.1f}" for name, score in aggregates['averages'].items()) + "\n"
+        content += "- 最近几次考试总分: " + "、".join(f"{exam['label']} {exam['total']:.0f}" for exam in exams[-5:]) + "\n"
+    if aggregates['question_total']:
+        content += f"- 共 {aggregates['question_total']} 道错题，错误原因: "
+        content += "、".join(f"{reason} {count} 道" for reason, count in aggregates['reasons'].items()) + "\n"
+        content += "- 错题科目: " + "、".join(f"{subject} {count} 道" for subject, count in aggregates['question_subjects'].items()) + "\n"
+    if aggregates['knowledge_points']:
+        content += "- 错题最多的知识点: " + "、".join(f"{point}（{subject}）{count} 道"
+                                               for subject, point, count in aggregates['knowledge_points']) + "\n"
+    return content
+
+
+def build_prompt(aggregates, delta, sections):
+    """增量分析的提示词：整体统计摘要、新增数据和需要更新的章节原文，不包含完整的历史数据"""
+    from .reports import format_exams, format_questions
+
+    content = "以下是一份学习分析报告中需要更新的章节，以及上一次分析之后新增的数据。请结合整体统计和新增数据更新这些章节。\n\n"
+    content += "整体统计（包含新增数据）：\n" + _summarize(aggregates)
+
+    if delta['exams']:
+        content += "\n新增考试成绩：\n" + format_exams(delta['exams'])
+    if delta['questions']:
+        content += "\n新增错题：\n"
+        if delta['question_count'] > len(delta['questions']):
+            content += f"（共 {delta['question_count']} 道，以下为最近的 {len(delta['questions'])} 道）\n"
+        content += format_questions(delta['questions'])
+
+    content += "\n需要更新的章节（上一次的内容）：\n\n"
+    content += "".join(text for _, text in sections)
+    content += "请只返回更新后的以上章节，使用Markdown格式，每个章节以原来的“## 标题”开头，不要返回其他章节和结构化数据块。\n"
+    return content
+
+
+def merge(preamble, sections, affected, response):
+    """用DeepSeek返回的章节替换受影响的章节，其余章节沿用，返回 (报告内容, 重新生成的章节数)"""
+    _, updated = split_sections(response)
+    updated = {_normalize(title): text for title, text in updated}
+    content = preamble
+    regenerated = 0
+    for title, text in sections:
+        if title in affected and _normalize(title) in updated:
+            content += updated[_normalize(title)]
+            regenerated += 1
+        else:
+            if title in affected:
+                logger.warning("DeepSeek没有返回章节“%s”，沿用上一份报告的内容", title)
+            content += text
+    return content, regenerated
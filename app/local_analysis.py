@@ -0,0 +1,231 @@
+from sqlalchemy import func
+
+from . import tagging
+from .models import ErrorQuestion, ExamScore
+from .selection import SUBJECT_COLUMNS, exam_query, question_query
+
+# 计入总分的科目（体育不计入）
+SCORE_SUBJECTS = [(name, column) for name, column in SUBJECT_COLUMNS.items() if column != 'sports']
+
+# 最常见的错误原因对应的建议
+REASON_ADVICE = {
+    '概念不清': '建议加强对基础概念的理解，可以通过阅读教材、观看相关视频课程或请教老师同学来澄清概念。',
+    '计算错误': '建议加强计算练习，提高计算的准确性和速度。可以每天安排一定时间进行专项计算训练。',
+    '审题失误': '建议在答题前仔细阅读题目，标记关键词，确保完全理解题意后再开始作答。',
+    '方法不当': '建议学习更多的解题方法和技巧，可以通过做典型例题、总结解题思路来提高。',
+    '知识点盲区': '建议系统复习相关知识点，找出自己的知识盲区，有针对性地进行补充学习。',
+}
+DEFAULT_ADVICE = '建议分析错题的具体原因，有针对性地进行改进。'
+
+
+def aggregate(student_id, selection):
+    """
+    计算本地报告需要的统计数据：考试只取成绩列，错题只做GROUP BY计数，不加载错题内容
+    查询都在当前学生的 (student_id, date)、(student_id, upload_time) 索引范围内
+    """
+    columns = [getattr(ExamScore, column) for _, column in SCORE_SUBJECTS]
+    rows = exam_query(student_id, selection).with_entities(ExamScore.exam_type, ExamScore.date, *columns).all()
+    exams = []
+    for row in rows:
+        scores = {name: row[i + 2] for i, (name, _) in enumerate(SCORE_SUBJECTS) if row[i + 2] is not None}
+        exams.append({'label': f'{row.exam_type}({row.date})', 'scores': scores, 'total': sum(scores.values())})
+
+    averages = {}
+    max_exam_id = None
+    if exams:
+        values = exam_query(student_id, selection).order_by(None) \
+            .with_entities(func.max(ExamScore.id), *[func.avg(column) for column in columns]).one()
+        max_exam_id = values[0]
+        averages = {name: value for (name, _), value in zip(SCORE_SUBJECTS, values[1:]) if value is not None}
+
+    questions = question_query(student_id, selection).order_by(None)
+    reasons = questions.with_entities(ErrorQuestion.reason, func.count()).group_by(ErrorQuestion.reason).all()
+    subjects = questions.with_entities(ErrorQuestion.subject, func.count()).group_by(ErrorQuestion.subject).all()
+    max_question_id = questions.with_entities(func.max(ErrorQuestion.id)).scalar()
+    reason_counts = {}
+    for reason, count in reasons:
+        reason = reason or '其他原因'
+        reason_counts[reason] = reason_counts.get(reason, 0) + count
+
+    return {
+        'student_id': student_id,
+        'exams': exams,
+        'averages': averages,
+        'reasons': dict(sorted(reason_counts.items(), key=lambda item: -item[1])),
+        'question_subjects': dict(sorted(((s or '未分类', c) for s, c in subjects), key=lambda item: -item[1])),
+        'question_total': sum(reason_counts.values()),
+        # 错题最多的知识点 [(科目, 知识点, 错题数)]
+        'knowledge_points': tagging.knowledge_point_counts(student_id, selection) if reason_counts else [],
+        # 本次报告包含的最大记录ID，下次增量分析时用于计算新增数据
+        'max_exam_id': max_exam_id,
+        'max_question_id': max_question_id,
+    }
+
+
+def cohort_aggregate(student_ids, selection):
+    """
+    整批学生（如一个年级）的统计数据，批量生成报告时只计算一次，每份报告都用它做对比
+    每项统计是一条覆盖全部学生的GROUP BY查询，返回可以保存为JSON的字典
+    """
+    columns = [getattr(ExamScore, column) for _, column in SCORE_SUBJECTS]
+    exams = exam_query(student_ids, selection).order_by(None)
+    averages = exams.with_entities(*[func.avg(column) for column in columns]).one()
+    total = sum(func.coalesce(column, 0) for column in columns)
+    totals = exams.with_entities(ExamScore.student_id, func.avg(total)).group_by(ExamScore.student_id).all()
+
+    questions = question_query(student_ids, selection).order_by(None)
+    reasons = {}
+    for reason, count in questions.with_entities(ErrorQuestion.reason, func.count()).group_by(ErrorQuestion.reason):
+        reason = reason or '其他原因'
+        reasons[reason] = reasons.get(reason, 0) + count
+
+    return {
+        'students': len(student_ids),
+        'averages': {name: value for (name, _), value in zip(SCORE_SUBJECTS, averages) if value is not None},
+        # 每名学生的平均总分，JSON的键是字符串
+        'totals': {str(student_id): value for student_id, value in totals},
+        'reasons': dict(sorted(reasons.items(), key=lambda item: -item[1])),
+        'question_total': sum(reasons.values()),
+        'knowledge_points': [list(row) for row in tagging.knowledge_point_counts(student_ids, selection, limit=5)]
+        if reasons else [],
+    }
+
+
+def student_rank(student_id, cohort):
+    """平均总分在整批学生中的排名，返回 (名次, 人数, 本人平均总分, 整体平均总分)，没有成绩时返回None"""
+    totals = cohort['totals']
+    own = totals.get(str(student_id))
+    if own is None:
+        return None
+    rank = 1 + sum(1 for value in totals.values() if value > own)
+    return rank, len(totals), own, sum(totals.values()) / len(totals)
+
+
+def cohort_section(aggregates, cohort):
+    """批量报告中的年级对比章节"""
+    report = "## 年级对比\n\n"
+    rank = student_rank(aggregates['student_id'], cohort)
+    if rank:
+        position, count, own, average = rank
+        report += f"本批 {count} 名有考试成绩的学生中，平均总分 {own:.1f} 分（整体平均 {average:.1f} 分），排名第 {position}。\n\n"
+    for name, value in aggregates['averages'].items():
+        if name in cohort['averages']:
+            overall = cohort['averages'][name]
+            report += f"- **{name}**：平均 {value:.1f} 分，整体平均 {overall:.1f} 分（{value - overall:+.1f}）\n"
+    if cohort['question_total']:
+        report += f"\n错题 {aggregates['question_total']} 道，整体人均 {cohort['question_total'] / cohort['students']:.1f} 道。"
+        if cohort['knowledge_points']:
+            own = {point for _, point, _ in aggregates['knowledge_points']}
+            report += "整体错题最多的知识点：" + "、".join(
+                f"{point}（本人也较多）" if point in own else point for _, point, _ in cohort['knowledge_points']) + "。"
+        report += "\n"
+    return report + "\n"
+
+
+def is_empty(aggregates):
+    return not aggregates['exams'] and not aggregates['question_total']
+
+
+def _percentages(counts):
+    total = sum(counts.values())
+    return {key: round(count * 100 / total) for key, count in counts.items()} if total else {}
+
+
+def chart_block(aggregates):
+    """图表数据块，格式与提示词要求DeepSeek返回的一致，报告页面据此绘制图表"""
+    exams = aggregates['exams']
+    block = "### 结构化数据\n\n"
+    block += "```\n成绩趋势数据：\n"
+    block += "".join(f"- {exam['label']}: {round(exam['total'])}\n" for exam in exams)
+    block += "```\n\n"
+    block += "```\n学科对比数据：\n"
+    if exams:
+        block += "".join(f"- {name}: {round(score)}\n" for name, score in exams[-1]['scores'].items())
+    block += "```\n\n"
+    block += "```\n错题类型数据：\n"
+    block += "".join(f"- {reason}: {percentage}%\n" for reason, percentage in _percentages(aggregates['reasons']).items())
+    block += "```\n"
+    return block
+
+
+def render_report(aggregates, cohort=None):
+    """根据统计数据生成完整的Markdown报告（本地分析，不调用DeepSeek），cohort为批量生成时整批学生的统计"""
+    exams = aggregates['exams']
+    averages = aggregates['averages']
+    report = "# 学习分析报告\n\n"
+
+    if exams:
+        report += "## 成绩趋势分析\n\n"
+        report += f"共 {len(exams)} 次考试，"
+        first, last = exams[0]['total'], exams[-1]['total']
+        if len(exams) >= 2:
+            change = last - first
+            trend = f"总分上升 {change:.1f} 分" if change > 0 else f"总分下降 {-change:.1f} 分" if change < 0 else "总分保持稳定"
+            report += f"从{exams[0]['label']}的 {first:.1f} 分到{exams[-1]['label']}的 {last:.1f} 分，{trend}。\n\n"
+        else:
+            report += f"总分 {last:.1f} 分。\n\n"
+        if averages:
+            best = max(averages, key=averages.get)
+            worst = min(averages, key=averages.get)
+            report += f"- **优势学科**：{best}（平均分：{averages[best]:.1f}）\n"
+            report += f"- **薄弱学科**：{worst}（平均分：{averages[worst]:.1f}）\n\n"
+            report += "建议继续保持优势学科的学习势头，同时加强薄弱学科的复习和练习。\n\n"
+
+        report += "## 学科能力对比\n\n"
+        for name, average in averages.items():
+            scores = [exam['scores'][name] for exam in exams if name in exam['scores']]
+            trend = ""
+            if len(scores) >= 2:
+                trend = "（上升）" if scores[-1] > scores[0] else "（下降）" if scores[-1] < scores[0] else "（稳定）"
+            report += f"- **{name}**{trend}：平均 {average:.1f} 分，最近一次 {scores[-1]:.1f} 分\n"
+        report += "\n"
+
+    reasons = aggregates['reasons']
+    if reasons:
+        report += "## 错题类型分析\n\n"
+        report += f"共 {aggregates['question_total']} 道错题，各类错误原因的比例如下：\n\n"
+        for reason, percentage in _percentages(reasons).items():
+            report += f"- {reason}: {percentage}%（{reasons[reason]} 道）\n"
+        report += "\n"
+        most_common = next(iter(reasons))
+        report += f"最常见的错误原因是：**{most_common}**。{REASON_ADVICE.get(most_common, DEFAULT_ADVICE)}\n\n"
+
+        subjects = aggregates['question_subjects']
+        report += "错题较多的科目：" + "、".join(f"{subject}（{count} 道）" for subject, count in list(subjects.items())[:3])
+        report += "\n\n"
+
+    knowledge_points = aggregates['knowledge_points']
+    if knowledge_points:
+        report += "## 知识点分析\n\n"
+        report += "错题涉及最多的知识点（按错题数）：\n\n"
+        for subject, point, count in knowledge_points:
+            report += f"- **{point}**（{subject}）：{count} 道\n"
+        report += "\n"
+        report += f"建议优先复习 **{knowledge_points[0][1]}** 相关的概念和典型题型，整理同类错题对比解题思路。\n\n"
+
+    if cohort:
+        report += cohort_section(aggregates, cohort)
+
+    report += "## 学习建议\n\n"
+    report += "1. **制定合理的学习计划**：根据自己的学习情况和目标，制定长期和短期的学习计划，合理安排时间。\n\n"
+    report += "2. **注重基础知识的掌握**：加强对基础概念、公式和定理的理解和记忆，这是提高学习成绩的基础。\n\n"
+    report += "3. **多做练习，及时总结**：通过大量的练习来巩固所学知识，同时及时总结解题方法和技巧。\n\n"
+    report += "4. **错题集的利用**：定期复习错题，分析错误原因，避免重复犯错。\n\n"
+    report += "5. **保持良好的学习习惯**：养成课前预习、课上认真听讲、课后及时复习的良好习惯。\n\n"
+
+    report += "## 阶段性学习计划\n\n"
+    report += "### 第一阶段（1-2周）\n"
+    report += "- 系统复习近期所学知识点，找出自己的薄弱环节\n"
+    report += "- 针对薄弱环节进行专项练习\n"
+    report += "- 整理错题集，分析错误原因\n\n"
+    report += "### 第二阶段（3-4周）\n"
+    report += "- 加强综合练习，提高解题能力\n"
+    report += "- 定期进行模拟测试，检验学习效果\n"
+    report += "- 根据测试结果调整学习重点\n\n"
+    report += "### 第三阶段（5-6周）\n"
+    report += "- 全面复习，查漏补缺\n"
+    report += "- 重点复习易错知识点和题型\n"
+    report += "- 调整心态，保持良好的学习状态\n\n"
+
+    report += chart_block(aggregates)
+    return report
@@ -0,0 +1,138 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import re
+
+# 默认脱敏规则：API密钥、Bearer令牌、表单中的apikey字段
+_SECRET_PATTERNS = [
+    re.compile(r'sk-[A-Za-z0-9]{8,}'),
+    re.compile(r'(Bearer\s+)[A-Za-z0-9._\-]+'),
+    re.compile(r"(['\"]?apikey['\"]?\s*[:=]\s*['\"]?)[A-Za-z0-9]+"),
+]
+
+# 需要按值脱敏的配置项
+_SECRET_CONFIG_KEYS = ['DEEPSEEK_API_KEY', 'OCR_API_KEY', 'SECRET_KEY']
+
+_listener = None
+
+
+class Truncated:
+    """
+    日志中的大段内容（API响应、提示词等）
+    只有日志真正输出时才会调用str()并截断，日志级别关闭时没有任何格式化开销
+    """
+
+    __slots__ = ('value', 'limit')
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self):
+        text = self.value if isinstance(self.value, str) else str(self.value)
+        limit = self.limit if self.limit is not None else RedactingFilter.payload_limit
+        if limit and len(text) > limit:
+            return f"{text[:limit]}...（共{len(text)}字符，已截断）"
+        return text
+
+
+def truncated(value, limit=None):
+    """包装需要截断输出的日志参数"""
+    return Truncated(value, limit)
+
+
+class RedactingFilter(logging.Filter):
+    """格式化日志消息并去掉其中的密钥"""
+
+    payload_limit = 500
+    secrets = []
+
+    def filter(self, record):
+        message = record.getMessage()
+        for secret in self.secrets:
+            message = message.replace(secret, '***')
+        for pattern in _SECRET_PATTERNS:
+            message = pattern.sub(lambda m: (m.group(1) if m.groups() else '') + '***', message)
+        record.msg = message
+        record.args = None
+        return True
+
+
+class PayloadSampler(logging.Filter):
+    """按比例采样带 payload=True 标记的日志（例如完整的API响应）"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'payload', False) and self.rate < 1.0:
+            return random.random() < self.rate
+        return True
+
+
+def init_app(app):
+    """
+    配置应用日志：调用线程只把日志记录放入队列，
+    由后台监听线程负责格式化以外的输出工作（写终端/文件）
+    """
+    global _listener
+
+    RedactingFilter.payload_limit = app.config.get('LOG_PAYLOAD_LIMIT', 500)
+    RedactingFilter.secrets = [app.config[key] for key in _SECRET_CONFIG_KEYS
+                               if app.config.get(key) and len(str(app.config[key])) >= 6]
+
+    level = getattr(logging, str(app.config.get('LOG_LEVEL', 'INFO')).upper(), logging.INFO)
+    logger = logging.getLogger(app.import_name)
+    logger.setLevel(level)
+    logger.propagate = False
+
+    if _listener is not None:
+        # 同一进程中重复创建应用时复用已有的队列
+        return logger
+
+    formatter = logging.Formatter('%(asctime)s %(levelname)s [%(name)s] %(message)s')
+    handlers = []
+    console = logging.StreamHandler()
+    console.setFormatter(formatter)
+    handlers.append(console)
+    if app.config.get('LOG_FILE'):
+        file_handler = logging.handlers.RotatingFileHandler(app.config['LOG_FILE'], maxBytes=10 * 1024 * 1024,
+                                                            backupCount=5, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=app.config.get('LOG_QUEUE_SIZE', 10000))
+    queue_handler = _NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(PayloadSampler(app.config.get('LOG_PAYLOAD_SAMPLE_RATE', 1.0)))
+    queue_handler.addFilter(RedactingFilter())
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+    return logger
+
+
+def shutdown():
+    """停止日志监听线程并输出队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志，而不是阻塞请求线程"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _NonBlockingQueueHandler.dropped += 1
@@ -0,0 +1,131 @@
+import hashlib
+import os
+import threading
+import uuid
+
+from flask import current_app, send_file, url_for
+
+# 缩略图尺寸（最长边像素）
+VARIANTS = {
+    'sm': 240,  # 列表页
+    'md': 960,  # 编辑页预览
+}
+
+# 缩略图输出格式: 扩展名 -> (Pillow格式, MIME类型, 保存参数)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 75, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+# 带内容哈希的URL可以永久缓存
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# 文件摘要缓存: 路径 -> (修改时间, 大小, 摘要)
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def original_path(question):
+    """错题原始文件的绝对路径，已移到冷存储（见 storage.move_to_cold）的返回冷存储中的路径"""
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], question.file_path)
+    if not os.path.exists(path):
+        cold = cold_path(question)
+        if os.path.exists(cold):
+            return cold
+    return path
+
+
+def cold_folder():
+    return current_app.config.get('COLD_STORAGE_FOLDER') or os.path.join(current_app.instance_path, 'cold_uploads')
+
+
+def cold_path(question):
+    """冷存储中的路径：按上传年份分目录，往年的目录不再变化，备份一次即可"""
+    year = str(question.upload_time.year) if question.upload_time else 'unknown'
+    return os.path.join(cold_folder(), year, question.file_path)
+
+
+def file_digest(path):
+    """文件内容摘要（按修改时间和大小缓存，文件不变时不重复计算）"""
+    stat = os.stat(path)
+    with _digest_lock:
+        cached = _digest_cache.get(path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha1.update(chunk)
+    digest = sha1.hexdigest()[:16]
+
+    with _digest_lock:
+        _digest_cache[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def _thumbnail_folder():
+    folder = current_app.config['THUMBNAIL_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def thumbnail_path(question, variant, fmt):
+    """
+    返回缩略图路径，不存在时生成并缓存到磁盘
+    非图片文件或未安装Pillow时返回None
+    """
+    if question.file_type != 'image' or variant not in VARIANTS or fmt not in FORMATS:
+        return None
+
+    source = original_path(question)
+    digest = file_digest(source)
+    target = os.path.join(_thumbnail_folder(), f"{digest}_{variant}.{fmt}")
+    if os.path.exists(target):
+        return target
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return None
+
+    pil_format, _, save_options = FORMATS[fmt]
+    size = VARIANTS[variant]
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((size, size), Image.LANCZOS)
+
+        # 先写临时文件再改名，避免并发请求读到半个文件
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        image.save(tmp, pil_format, **save_options)
+    os.replace(tmp, target)
+    return target
+
+
+def media_url(question, variant=None, fmt='jpg'):
+    """
+    模板中使用的带内容哈希的图片地址
+    variant为None时返回原图地址
+    """
+    try:
+        digest = file_digest(original_path(question))
+    except OSError:
+        digest = None
+
+    if variant is None:
+        return url_for('main.view_question', question_id=question.id, v=digest)
+    return url_for('main.question_media', question_id=question.id, variant=variant, fmt=fmt, v=digest)
+
+
+def send_media(path, mimetype, digest, immutable):
+    """发送文件，支持ETag/Last-Modified条件请求（304）和Range请求（206）"""
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=digest,
+                         max_age=IMMUTABLE_MAX_AGE if immutable else 0)
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        # 没有版本号的地址每次都需要向服务器确认
+        response.cache_control.no_cache = True
+    return response
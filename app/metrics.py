@@ -0,0 +1,358 @@
+import atexit
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+# 默认直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 各进程写入共享指标文件的间隔（秒），瞬时值超过3个间隔没有更新视为进程已退出
+FLUSH_INTERVAL = 5
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+    def collect(self):
+        return self.format(self.samples())
+
+
+class _Cumulative(_Metric):
+    """计数器和直方图：写入共享指标文件时只累加上次写入后的增量"""
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._flushed = {}
+
+    def pending(self):
+        """(增量, 当前值)，写入成功后用当前值调用 mark_flushed"""
+        samples = self.samples()
+        deltas = {key: value - self._flushed.get(key, 0) for key, value in samples.items()}
+        return {key: value for key, value in deltas.items() if value}, samples
+
+    def mark_flushed(self, samples):
+        self._flushed = samples
+
+
+class Counter(_Cumulative):
+    """单调递增计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        """{(后缀, 标签元组): 值}"""
+        with self._lock:
+            return {('', key): value for key, value in self._values.items()}
+
+    def format(self, samples):
+        return [f'{self.name}{_format_labels(key)} {value}' for (_, key), value in samples.items()]
+
+
+class Gauge(_Metric):
+    """瞬时值，由回调函数在采集时计算，返回 {标签元组: 值}"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def samples(self):
+        return {('', key): value for key, value in self.callback().items()}
+
+    def format(self, samples):
+        return [f'{self.name}{_format_labels(key)} {value}' for (_, key), value in samples.items()]
+
+
+class Histogram(_Cumulative):
+    """分桶直方图"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        samples = {}
+        with self._lock:
+            for key, (counts, total, count) in self._series.items():
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples['_bucket', key + (('le', bound),)] = bucket_count
+                samples['_sum', key] = total
+                samples['_count', key] = count
+        return samples
+
+    def format(self, samples):
+        lines = []
+        for suffix, key in samples:
+            if suffix != '_count':
+                continue
+            count = samples['_count', key]
+            for bound in self.buckets:
+                bucket_count = samples.get(('_bucket', key + (('le', bound),)), 0)
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", bound),))} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_format_labels(key + (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {samples.get(("_sum", key), 0)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+REGISTRY = []
+
+REQUEST_DURATION = Histogram('http_request_duration_seconds', '按路由统计的请求耗时')
+STAGE_DURATION = Histogram('stage_duration_seconds', '上传/OCR/导入/分析各阶段耗时')
+UPSTREAM_ERRORS = Counter('upstream_errors_total', '上游服务（OCR.space、DeepSeek）错误次数')
+
+
+def _queue_depths():
+    from .tasks import queues
+    return {(('queue', queue.name),): queue.depth for queue in queues()}
+
+
+QUEUE_DEPTH = Gauge('task_queue_depth', '后台队列中排队和执行中的任务数', _queue_depths)
+
+
+@contextmanager
+def span(stage):
+    """记录一个阶段的耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+
+
+def render():
+    """Prometheus文本格式：有共享指标文件时汇总所有进程，否则只有当前进程"""
+    shared = store.load()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.collect() if shared is None else metric.format(shared.get(metric.name, {})))
+    return '\n'.join(lines) + '\n'
+
+
+def _labels_json(key):
+    return json.dumps(key, ensure_ascii=False)
+
+
+def _labels_key(text):
+    return tuple(tuple(item) for item in json.loads(text))
+
+
+class _SharedStore:
+    """
+    多个工作进程（gunicorn）共用的指标文件（SQLite）：
+    计数器和直方图每隔FLUSH_INTERVAL秒把新增的值累加到同一行，/metrics 输出所有进程的合计；
+    瞬时值（队列长度、熔断器状态）各进程分别保存，输出时加pid标签，进程退出后不再输出
+    文件不可用时只输出当前进程的指标
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._thread = None
+
+    def configure(self, path):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            if path:
+                self._conn = _open_metrics_db(path)
+        if self._conn is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self._exit)
+
+    def _run(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            self.flush()
+
+    def _exit(self):
+        """进程退出：写入最后的增量，删除本进程的瞬时值"""
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                try:
+                    self._conn.execute('DELETE FROM gauges WHERE pid = ?', (os.getpid(),))
+                except sqlite3.Error as e:
+                    logger.warning("删除本进程的瞬时值失败: %s", e)
+
+    def flush(self):
+        """把当前进程的增量和瞬时值写入共享文件"""
+        with self._lock:
+            conn = self._conn
+            if conn is None:
+                return
+            pid, now = os.getpid(), time.time()
+            gauges, deltas, written = [], [], []
+            for metric in REGISTRY:
+                if isinstance(metric, Gauge):
+                    gauges.extend((metric.name, _labels_json(key), pid, value, now)
+                                  for (_, key), value in metric.samples().items())
+                else:
+                    pending, samples = metric.pending()
+                    deltas.extend((metric.name, suffix, _labels_json(key), value)
+                                  for (suffix, key), value in pending.items())
+                    written.append((metric, samples))
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('DELETE FROM gauges WHERE pid = ? OR updated < ?', (pid, now - 3 * FLUSH_INTERVAL))
+                conn.executemany('INSERT INTO gauges (name, labels, pid, value, updated) VALUES (?, ?, ?, ?, ?)', gauges)
+                conn.executemany('INSERT INTO samples (name, suffix, labels, value) VALUES (?, ?, ?, ?) '
+                                 'ON CONFLICT (name, suffix, labels) DO UPDATE SET value = value + excluded.value',
+                                 deltas)
+                conn.execute('COMMIT')
+            except sqlite3.Error as e:
+                logger.warning("写入共享指标文件失败: %s", e)
+                _rollback(conn)
+                return
+            for metric, samples in written:
+                metric.mark_flushed(samples)
+
+    def load(self):
+        """所有进程的指标 {指标名: {(后缀, 标签元组): 值}}，文件不可用时返回None"""
+        self.flush()
+        with self._lock:
+            if self._conn is None:
+                return None
+            try:
+                samples = self._conn.execute('SELECT name, suffix, labels, value FROM samples').fetchall()
+                gauges = self._conn.execute('SELECT name, labels, pid, value FROM gauges ORDER BY pid').fetchall()
+            except sqlite3.Error as e:
+                logger.warning("读取共享指标文件失败，只输出当前进程的指标: %s", e)
+                return None
+        result = {}
+        for name, suffix, labels, value in samples:
+            result.setdefault(name, {})[suffix, _labels_key(labels)] = value
+        for name, labels, pid, value in gauges:
+            result.setdefault(name, {})['', _labels_key(labels) + (('pid', pid),)] = value
+        return result
+
+
+def _open_metrics_db(path):
+    """打开（必要时创建）共享指标文件，失败时返回None"""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 自行控制事务；所有访问都在_SharedStore._lock内，可以跨线程共用一个连接
+        conn = sqlite3.connect(path, timeout=15, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        # NUMERIC：整数计数保持为整数输出
+        conn.execute('CREATE TABLE IF NOT EXISTS samples (name TEXT NOT NULL, suffix TEXT NOT NULL, '
+                     'labels TEXT NOT NULL, value NUMERIC NOT NULL, PRIMARY KEY (name, suffix, labels))')
+        conn.execute('CREATE TABLE IF NOT EXISTS gauges (name TEXT NOT NULL, labels TEXT NOT NULL, '
+                     'pid INTEGER NOT NULL, value NUMERIC NOT NULL, updated REAL NOT NULL)')
+        return conn
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("无法打开共享指标文件 %s，/metrics 只输出当前进程的指标: %s", path, e)
+        return None
+
+
+def _rollback(conn):
+    try:
+        conn.execute('ROLLBACK')
+    except sqlite3.Error:
+        pass
+
+
+store = _SharedStore()
+
+
+def init_app(app):
+    """
+    记录每个请求的耗时，指标写入 METRICS_FILE（默认 instance/metrics.db），所有进程共用；
+    开启PROFILE_REQUESTS后，带 ?_profile=1 的请求会输出cProfile结果
+    """
+    store.configure(app.config.get('METRICS_FILE') or os.path.join(app.instance_path, 'metrics.db'))
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+        if app.config.get('PROFILE_REQUESTS') and request.args.get('_profile') == '1':
+            g._profiler = cProfile.Profile()
+            g._profiler.enable()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_DURATION.observe(time.perf_counter() - start, route=route, method=request.method,
+                                     status=response.status_code)
+
+        profiler = g.pop('_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _dump_profile(app, profiler)
+        return response
+
+
+def _dump_profile(app, profiler):
+    """把cProfile结果保存为.prof文件（可用snakeviz等工具查看），并输出耗时最多的函数"""
+    folder = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+    os.makedirs(folder, exist_ok=True)
+    endpoint = (request.endpoint or 'unknown').replace('.', '_')
+    path = os.path.join(folder, f"{time.strftime('%Y%m%d_%H%M%S')}_{endpoint}_{os.getpid()}.prof")
+    profiler.dump_stats(path)
+
+    with open(path + '.txt', 'w', encoding='utf-8') as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats('cumulative').print_stats(40)
+    logger.info("请求性能分析已保存: %s", path)
@@ -1,9 +1,25 @@
+import json
 from datetime import datetime
 from . import db
 
+class Student(db.Model):
+    """学生模型"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)  # 姓名
+    grade = db.Column(db.String(20))  # 年级
+    note = db.Column(db.Text)  # 备注
+    create_time = db.Column(db.DateTime, default=datetime.utcnow)  # 创建时间
+
+    def __repr__(self):
+        return f'<Student {self.name}>'
+
 class ErrorQuestion(db.Model):
     """错题模型"""
+    # 按学生查询错题列表时走 (student_id, upload_time) 索引范围扫描
+    __table_args__ = (db.Index('ix_error_question_student_upload_time', 'student_id', 'upload_time'),)
+
     id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'))  # 所属学生
     filename = db.Column(db.String(255), nullable=False)  # 原始文件名
     file_path = db.Column(db.String(255), nullable=False)  # 存储路径
     file_type = db.Column(db.String(10), nullable=False)  # 文件类型：image或pdf
@@ -18,9 +34,26 @@ class ErrorQuestion(db.Model):
     def __repr__(self):
         return f'<ErrorQuestion {self.filename}>'
 
+class QuestionTag(db.Model):
+    """错题的知识点标签（按知识点词典匹配识别内容生成，见 tagging.py）"""
+    # 按学生统计知识点时走 (student_id, knowledge_point, subject) 索引，GROUP BY不需要临时排序
+    __table_args__ = (db.Index('ix_question_tag_student_point', 'student_id', 'knowledge_point', 'subject'),)
+
+    question_id = db.Column(db.Integer, db.ForeignKey('error_question.id'), primary_key=True)
+    knowledge_point = db.Column(db.String(50), primary_key=True)  # 知识点
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'))  # 所属学生（与错题相同）
+    subject = db.Column(db.String(50))  # 知识点所属科目
+    hits = db.Column(db.Integer, default=1)  # 匹配到的关键词次数
+
+    def __repr__(self):
+        return f'<QuestionTag {self.question_id} {self.knowledge_point}>'
+
 class ExamScore(db.Model):
     """考试成绩模型"""
+    __table_args__ = (db.Index('ix_exam_score_student_date', 'student_id', 'date'),)
+
     id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'))  # 所属学生
     grade = db.Column(db.String(20), nullable=False)  # 年级
     exam_type = db.Column(db.String(50), nullable=False)  # 考试类型
     date = db.Column(db.Date, nullable=False)  # 考试日期
@@ -40,14 +73,65 @@ class ExamScore(db.Model):
     def __repr__(self):
         return f'<ExamScore {self.grade} {self.exam_type} {self.date}>'
 
+class ReportBatch(db.Model):
+    """批量生成的一组分析报告（整个年级或多名学生，见 batch.py）"""
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(255), nullable=False)  # 名称，如“初二 批量报告”
+    grade = db.Column(db.String(20))  # 年级（按学生列表生成时为空）
+    selection = db.Column(db.Text)  # 所有学生共用的选择条件（JSON）
+    cohort = db.Column(db.Text)  # 整批学生的统计数据（JSON），生成每份报告时共用
+    total = db.Column(db.Integer, default=0)  # 报告数
+    create_time = db.Column(db.DateTime, default=datetime.utcnow)  # 创建时间
+
+    @property
+    def cohort_data(self):
+        return json.loads(self.cohort) if self.cohort else None
+
+    def __repr__(self):
+        return f'<ReportBatch {self.title}>'
+
 class AnalysisResult(db.Model):
     """分析结果模型"""
+    __table_args__ = (db.Index('ix_analysis_result_student_create_time', 'student_id', 'create_time'),
+                      db.Index('ix_analysis_result_batch', 'batch_id'))
+
     id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'))  # 所属学生
     title = db.Column(db.String(255), nullable=False)  # 报告标题
     content = db.Column(db.Text, nullable=False)  # 分析内容
-    related_exams = db.Column(db.String(500))  # 关联的考试ID，用逗号分隔
-    related_questions = db.Column(db.String(500))  # 关联的错题ID，用逗号分隔
+    related_exams = db.Column(db.String(500))  # 关联的考试ID，用逗号分隔（旧报告）
+    related_questions = db.Column(db.String(500))  # 关联的错题ID，用逗号分隔（旧报告）
+    selection = db.Column(db.Text)  # 选择条件（JSON），见 selection.parse_selection
+    exam_count = db.Column(db.Integer)  # 符合条件的考试数
+    question_count = db.Column(db.Integer)  # 符合条件的错题数
+    max_exam_id = db.Column(db.Integer)  # 报告包含的最大考试ID（增量分析计算新增数据）
+    max_question_id = db.Column(db.Integer)  # 报告包含的最大错题ID
+    parent_id = db.Column(db.Integer, db.ForeignKey('analysis_result.id'))  # 增量分析时沿用章节的上一份报告
+    batch_id = db.Column(db.Integer, db.ForeignKey('report_batch.id'))  # 批量生成时所属的批次
+    status = db.Column(db.String(20), server_default='done')  # pending/done/local/failed，见 reports.py
+    status_message = db.Column(db.String(255))  # DeepSeek报告生成失败的原因
     create_time = db.Column(db.DateTime, default=datetime.utcnow)  # 创建时间
     
+    @property
+    def selection_filters(self):
+        """解析后的选择条件，旧报告返回手动选择的ID"""
+        if self.selection:
+            return json.loads(self.selection)
+        return {'filters': {},
+                'exam_ids': [int(i) for i in (self.related_exams or '').split(',') if i],
+                'question_ids': [int(i) for i in (self.related_questions or '').split(',') if i]}
+
+    @property
+    def exam_total(self):
+        if self.exam_count is not None:
+            return self.exam_count
+        return len(self.selection_filters['exam_ids'])
+
+    @property
+    def question_total(self):
+        if self.question_count is not None:
+            return self.question_count
+        return len(self.selection_filters['question_ids'])
+
     def __repr__(self):
         return f'<AnalysisResult {self.title}>'
@@ -0,0 +1,208 @@
+import base64
+import logging
+import mimetypes
+import re
+
+from flask import current_app
+
+from . import metrics, tagging
+from .log import truncated
+from .models import db, ErrorQuestion
+
+logger = logging.getLogger(__name__)
+
+# OCR全部失败时写入的默认内容
+OCR_FAILED_CONTENT = "OCR识别失败，请手动编辑内容"
+
+# OCR.space超出配额时的提示，例如 "...upto maximum 180 number of times within 3600 seconds"
+_QUOTA_PATTERN = re.compile(r'maximum\s+\d+\s+number of times within\s+(\d+)\s+seconds', re.IGNORECASE)
+
+
+class QuotaExceeded(Exception):
+    """OCR.space配额已用完，retry_after秒后可重试"""
+
+    def __init__(self, retry_after=60):
+        super().__init__(f'OCR配额已用完，{retry_after}秒后重试')
+        self.retry_after = retry_after
+
+
+def _quota_retry_after(response):
+    """响应为配额错误时返回建议的等待秒数，否则返回None"""
+    if response.status_code not in (403, 429):
+        return None
+    header = response.headers.get('Retry-After')
+    if header and header.isdigit():
+        return int(header)
+    match = _QUOTA_PATTERN.search(response.text)
+    if match:
+        return int(match.group(1))
+    return 60 if response.status_code == 429 else None
+
+
+def _parse_result(result):
+    """从OCR.space响应中取出识别文本，失败返回None"""
+    if result.get('IsErroredOnProcessing') is False and result.get('ParsedResults'):
+        return result['ParsedResults'][0]['ParsedText']
+    error_message = result.get('ErrorMessage', '未知错误')
+    logger.warning("OCR处理失败: %s", error_message)
+    metrics.UPSTREAM_ERRORS.inc(upstream='ocr', kind='processing')
+    return None
+
+
+def _save_content(question_id, parsed_text):
+    """更新数据库中的识别内容和知识点标签"""
+    question = ErrorQuestion.query.get(question_id)
+    question.content = parsed_text
+    tagging.update_tags(question)
+    with metrics.span('ocr.db_commit'):
+        db.session.commit()
+
+
+def _guess_mimetype(file_path, filename, file_type=None):
+    """
+    按错题记录的file_type判断上传类型，早期记录的文件名可能没有扩展名（如'pdf'），
+    不能只靠文件名猜测
+    """
+    if file_type == 'pdf':
+        return 'application/pdf'
+    return mimetypes.guess_type(file_path)[0] or mimetypes.guess_type(filename)[0] or 'image/jpeg'
+
+
+def recognize_file(file_path, filename, acquire=None, file_type=None):
+    """
+    调用OCR.space识别文件，返回识别文本，全部方法失败时返回None
+    acquire: 发送第二次请求前获取配额的回调，返回False时不再重试；配额用完时抛出QuotaExceeded
+    file_type: 错题记录的文件类型（image或pdf），用于确定发送的MIME类型
+    """
+    import requests
+
+    ocr_api_key = current_app.config['OCR_API_KEY']
+    ocr_api_url = current_app.config['OCR_API_URL']
+    # PDF需要按application/pdf发送，否则OCR.space按图片解析会失败
+    mimetype = _guess_mimetype(file_path, filename, file_type)
+    upload_name = filename
+    if mimetype == 'application/pdf' and not upload_name.lower().endswith('.pdf'):
+        upload_name += '.pdf'  # OCR.space按上传文件名的扩展名识别文件格式
+
+    logger.debug("OCR API URL: %s", ocr_api_url)
+
+    # 尝试方法1：使用multipart/form-data格式发送文件
+    try:
+        with open(file_path, 'rb') as f:
+            files = {'file': (upload_name, f, mimetype)}
+            data = {
+                'apikey': ocr_api_key,
+                'language': 'chs',
+                'detectOrientation': 'true',
+                'scale': 'true',
+                'OCREngine': 2
+            }
+
+            logger.debug("发送OCR请求（方法1）: %s", filename)
+            with metrics.span('ocr.request.multipart'):
+                response = requests.post(
+                    ocr_api_url,
+                    files=files,
+                    data=data,
+                    timeout=30  # 添加超时设置
+                )
+
+        logger.debug("OCR响应状态码: %s", response.status_code)
+        retry_after = _quota_retry_after(response)
+        if retry_after is not None:
+            metrics.UPSTREAM_ERRORS.inc(upstream='ocr', kind='quota')
+            raise QuotaExceeded(retry_after)
+
+        if response.status_code == 200:
+            result = response.json()
+            logger.debug("OCR响应内容: %s", truncated(result), extra={'payload': True})
+            parsed_text = _parse_result(result)
+            if parsed_text is not None:
+                logger.debug("识别到的文本: %s", truncated(parsed_text, 100))
+                return parsed_text
+        else:
+            logger.warning("OCR API调用失败: %s %s", response.status_code, truncated(response.text))
+            metrics.UPSTREAM_ERRORS.inc(upstream='ocr', kind='http_%d' % response.status_code)
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logger.warning("OCR方法1失败: %s", e)
+        metrics.UPSTREAM_ERRORS.inc(upstream='ocr', kind=type(e).__name__)
+
+    # 尝试方法2：使用base64编码发送文件
+    if acquire is not None and not acquire():
+        raise QuotaExceeded(retry_after=0)
+    try:
+        with metrics.span('ocr.base64_encode'), open(file_path, 'rb') as f:
+            file_content = f.read()
+            base64_content = base64.b64encode(file_content).decode('utf-8')
+
+        data = {
+            'apikey': ocr_api_key,
+            'language': 'chs',
+            'detectOrientation': 'true',
+            'scale': 'true',
+            'OCREngine': 2,
+            'base64Image': f'data:{mimetype};base64,{base64_content}'
+        }
+
+        logger.debug("发送OCR请求（方法2）: %s", filename)
+        with metrics.span('ocr.request.base64'):
+            response = requests.post(
+                ocr_api_url,
+                json=data,
+                timeout=30  # 添加超时设置
+            )
+
+        logger.debug("OCR响应状态码: %s", response.status_code)
+        retry_after = _quota_retry_after(response)
+        if retry_after is not None:
+            metrics.UPSTREAM_ERRORS.inc(upstream='ocr', kind='quota')
+            raise QuotaExceeded(retry_after)
+
+        if response.status_code == 200:
+            result = response.json()
+            logger.debug("OCR响应内容: %s", truncated(result), extra={'payload': True})
+            parsed_text = _parse_result(result)
+            if parsed_text is not None:
+                logger.debug("识别到的文本: %s", truncated(parsed_text, 100))
+                return parsed_text
+        else:
+            logger.warning("OCR API调用失败: %s %s", response.status_code, truncated(response.text))
+            metrics.UPSTREAM_ERRORS.inc(upstream='ocr', kind='http_%d' % response.status_code)
+    except QuotaExceeded:
+        raise
+    except Exception as e:
+        logger.warning("OCR方法2失败: %s", e)
+        metrics.UPSTREAM_ERRORS.inc(upstream='ocr', kind=type(e).__name__)
+
+    return None
+
+
+def process_ocr(app, question_id, file_path, filename, acquire=None, file_type=None):
+    """
+    后台OCR任务：识别文件并把结果写回错题记录，识别成功返回True
+    配额用完时抛出QuotaExceeded由调度器重新排队
+    """
+    try:
+        logger.info("开始OCR处理: question_id=%s", question_id)
+
+        # 创建应用上下文
+        with app.app_context():
+            with metrics.span('ocr.recognize'):
+                parsed_text = recognize_file(file_path, filename, acquire=acquire, file_type=file_type)
+            if parsed_text is not None:
+                _save_content(question_id, parsed_text)
+                logger.info("OCR识别结果已保存: question_id=%s", question_id)
+                return True
+
+            # 如果两种方法都失败，设置一个默认内容
+            logger.warning("所有OCR方法都失败，设置默认内容: question_id=%s", question_id)
+            _save_content(question_id, OCR_FAILED_CONTENT)
+            return False
+
+    except QuotaExceeded:
+        raise
+    except Exception:
+        logger.exception("OCR处理异常: question_id=%s", question_id)
+        return False
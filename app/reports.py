@@ -0,0 +1,457 @@
+import json
+import logging
+import math
+import re
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import inspect, update
+from sqlalchemy.orm import load_only
+
+from . import incremental, local_analysis, metrics, tagging
+from .breaker import deepseek_breaker
+from .log import truncated
+from .models import db, AnalysisResult, ErrorQuestion, ReportBatch
+from .selection import exam_query, question_query
+from .tasks import report_queue
+
+logger = logging.getLogger(__name__)
+
+# 报告状态
+PENDING = 'pending'  # 已保存本地分析草稿，等待DeepSeek生成
+DONE = 'done'  # DeepSeek生成的报告
+LOCAL = 'local'  # DeepSeek不可用或调用失败，本地分析作为最终报告
+FAILED = 'failed'  # DeepSeek调用失败且 DEEPSEEK_FALLBACK=error
+
+SYSTEM_PROMPT = ("你是初中生学习分析智能体 \"学析优\"，依托考试成绩与错题库，需分析成绩真实性（趋势/横纵对比）、"
+                 "学科/知识点长短板及成因，给提优建议（优势拓展/短板补漏），定分阶段训练方案，交互需可视化、语言鼓励。"
+                 "请按照用户要求的格式返回分析结果，包含结构化数据。")
+
+
+class AnalysisError(Exception):
+    """DeepSeek调用失败，异常信息会显示在报告页面"""
+
+
+def create_draft(student_id, content, selection, aggregates, title=None, batch_id=None):
+    """新建本地分析报告草稿（状态为pending），记录选择条件、匹配的记录数和最大记录ID，由调用方提交事务"""
+    analysis = AnalysisResult(
+        student_id=student_id,
+        title=title or f"学习分析报告 ({datetime.now().strftime('%Y-%m-%d %H:%M')})",
+        content=content,
+        selection=json.dumps(selection, ensure_ascii=False),
+        exam_count=len(aggregates['exams']),
+        question_count=aggregates['question_total'],
+        max_exam_id=aggregates['max_exam_id'],
+        max_question_id=aggregates['max_question_id'],
+        batch_id=batch_id,
+        status=PENDING
+    )
+    db.session.add(analysis)
+    return analysis
+
+
+def submit(app, analysis, queue=report_queue):
+    """
+    本地草稿保存后提交DeepSeek任务，完成后替换草稿
+    未配置密钥或队列已关闭（进程退出中）时本地报告即为最终报告
+    """
+    if not app.config.get('DEEPSEEK_API_KEY'):
+        finish_local(analysis, '未配置DEEPSEEK_API_KEY，当前为本地分析报告')
+    elif queue.submit(generate_llm_report, app, analysis.id) is None:
+        finish_local(analysis, '服务正在重启，当前为本地分析报告')
+    else:
+        return
+    db.session.commit()
+
+
+def finish_local(analysis, message):
+    """DeepSeek报告生成失败：保留本地报告，DEEPSEEK_FALLBACK=error 时标记为失败"""
+    if current_app.config.get('DEEPSEEK_FALLBACK', 'mock') == 'mock':
+        analysis.status = LOCAL
+        analysis.title += '（本地生成）'
+    else:
+        analysis.status = FAILED
+    analysis.status_message = message
+
+
+def stale_after(batch=None):
+    """
+    pending超过该时间的报告视为后台任务已丢失（进程被杀死、退出时队列未排空）
+    每次DeepSeek调用最长为连接超时+读取超时；批量报告还要在队列中等待前面的报告，按批次大小和并发数估算
+    """
+    config = current_app.config
+    call = config.get('DEEPSEEK_TIMEOUT', 60) + 10
+    rounds = 2
+    if batch is not None:
+        rounds += math.ceil(batch.total / max(config.get('BATCH_REPORT_CONCURRENCY', 4), 1))
+    return timedelta(seconds=call * rounds + config.get('SHUTDOWN_TIMEOUT', 30))
+
+
+def recover_stale(analysis):
+    """已超过 stale_after 仍为pending的报告改为本地报告（或失败），页面不再一直等待，返回是否修改"""
+    if analysis.status != PENDING:
+        return False
+    batch = db.session.get(ReportBatch, analysis.batch_id) if analysis.batch_id else None
+    if datetime.utcnow() - analysis.create_time < stale_after(batch):
+        return False
+    finish_local(analysis, '报告生成中断（服务重启），当前为本地分析报告')
+    if not _commit_if_pending(analysis):
+        return False
+    logger.warning("报告生成任务已丢失，保留本地报告: analysis_id=%s", analysis.id)
+    return True
+
+
+def _commit_if_pending(analysis):
+    """
+    把报告上未保存的修改写入数据库，只在数据库中仍为pending时写入，返回是否写入
+    DeepSeek调用很慢时 recover_stale 可能已经改为本地报告，后台任务随后完成也不再覆盖；反之亦然
+    """
+    state = inspect(analysis)
+    values = {attr.key: attr.value for attr in state.attrs if attr.history.has_changes()}
+    db.session.rollback()
+    result = db.session.execute(update(AnalysisResult)
+                                .where(AnalysisResult.id == analysis.id, AnalysisResult.status == PENDING)
+                                .values(**values))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def generate_llm_report(app, analysis_id):
+    """后台任务：调用DeepSeek生成报告并替换本地草稿，有可沿用的上一份报告时只更新受新增数据影响的章节"""
+    with app.app_context(), db.session.no_autoflush:
+        analysis = db.session.get(AnalysisResult, analysis_id)
+        if analysis is None or analysis.status != PENDING:
+            return
+        try:
+            max_questions = app.config.get('ANALYSIS_MAX_QUESTIONS', 200)
+            # 批量报告的“年级对比”依赖本批次的整体统计，不能沿用上一份报告的章节，总是完整生成
+            incremental_enabled = app.config.get('ANALYSIS_INCREMENTAL', True) and not analysis.batch_id
+            if not (incremental_enabled and _generate_incremental(analysis, max_questions)):
+                _generate_full(analysis, max_questions)
+            analysis.status = DONE
+            logger.info("分析报告已更新: analysis_id=%s（%d 字符）", analysis_id, len(analysis.content))
+        except AnalysisError as e:
+            logger.warning("DeepSeek报告生成失败，保留本地报告: analysis_id=%s %s", analysis_id, e)
+            finish_local(analysis, str(e))
+        except Exception:
+            logger.exception("生成分析报告异常: analysis_id=%s", analysis_id)
+            finish_local(analysis, '生成分析报告失败')
+
+        with metrics.span('analysis.db_commit'):
+            if not _commit_if_pending(analysis):
+                logger.warning("报告已改为本地报告，丢弃DeepSeek结果: analysis_id=%s", analysis_id)
+
+
+def _generate_full(analysis, max_questions):
+    """按报告保存的选择条件重新查询全部数据，由DeepSeek生成整份报告"""
+    selection = analysis.selection_filters
+    with metrics.span('analysis.query'):
+        exams = exam_query(analysis.student_id, selection).all()
+        # 提示词只放最近的max_questions道错题，只加载需要的列
+        questions = question_query(analysis.student_id, selection).options(load_only(
+            ErrorQuestion.subject, ErrorQuestion.grade, ErrorQuestion.exam,
+            ErrorQuestion.reason, ErrorQuestion.content)).limit(max_questions).all()
+        knowledge_points = tagging.knowledge_point_counts(analysis.student_id, selection)
+        # 批量生成时加入整批学生的统计（创建批次时计算一次，所有报告共用）
+        batch = db.session.get(ReportBatch, analysis.batch_id) if analysis.batch_id else None
+        cohort = batch.cohort_data if batch else None
+
+    with metrics.span('analysis.prompt'):
+        prompt = build_analysis_prompt(exams, questions, analysis.question_total, knowledge_points,
+                                       format_cohort(cohort, analysis.student_id) if cohort else None)
+    incremental.PROMPT_CHARS.observe(len(prompt), mode='full')
+
+    analysis_content = request_analysis(prompt)
+
+    with metrics.span('analysis.extract'):
+        extracted_data = extract_structured_data(analysis_content)
+        logger.debug("提取的结构化数据: %s", truncated(extracted_data))
+
+    if extracted_data['score_trend']['labels'] or extracted_data['subject_compare']['labels'] or \
+            extracted_data['error_category']['labels']:
+        analysis.content = analysis_content
+    else:
+        # DeepSeek没有按格式返回图表数据时，使用本地草稿中统计的图表数据
+        logger.info("没有提取到结构化数据，使用本地统计数据: analysis_id=%s", analysis.id)
+        analysis.content = analysis_content + "\n\n" + incremental.extract_chart_block(analysis.content)
+    analysis.status_message = None
+
+
+def _generate_incremental(analysis, max_questions):
+    """
+    沿用上一份报告（相同学生和选择条件）中不受新增数据影响的章节，只让DeepSeek更新受影响的章节
+    没有可沿用的报告时返回False
+    """
+    with metrics.span('analysis.query'):
+        previous = incremental.find_predecessor(analysis)
+        if previous is None:
+            return False
+        delta = incremental.compute_delta(previous, analysis, max_questions)
+        if delta is None:
+            return False
+    preamble, sections = incremental.split_sections(previous.content)
+    if not sections:
+        return False
+
+    affected = incremental.affected_sections(sections, delta)
+    if affected:
+        with metrics.span('analysis.prompt'):
+            aggregates = local_analysis.aggregate(analysis.student_id, analysis.selection_filters)
+            prompt = incremental.build_prompt(aggregates, delta, [s for s in sections if s[0] in affected])
+        incremental.PROMPT_CHARS.observe(len(prompt), mode='incremental')
+        body, regenerated = incremental.merge(preamble, sections, affected, request_analysis(prompt))
+    else:
+        body, regenerated = preamble + "".join(text for _, text in sections), 0
+
+    # 图表数据使用本地草稿中按全部数据统计的结果
+    analysis.content = body + incremental.extract_chart_block(analysis.content)
+    analysis.parent_id = previous.id
+    reused = len(sections) - regenerated
+    analysis.status_message = f'增量更新：重新生成 {regenerated} 个章节，沿用上一份报告的 {reused} 个章节'
+    incremental.SECTIONS.inc(regenerated, mode='regenerated')
+    incremental.SECTIONS.inc(reused, mode='reused')
+    logger.info("增量分析: analysis_id=%s 上一份报告 %s，新增考试 %d 次、错题 %d 道，重新生成章节 %s",
+                analysis.id, previous.id, len(delta['exams']), delta['question_count'], affected)
+    return True
+
+
+def request_analysis(prompt):
+    """调用DeepSeek返回分析内容，失败时抛出AnalysisError（需要在应用上下文中调用）"""
+    import requests  # 延迟导入，不在启动时加载
+
+    deepseek_api_key = current_app.config.get('DEEPSEEK_API_KEY')
+    deepseek_api_url = current_app.config.get('DEEPSEEK_API_URL', 'https://api.deepseek.com/v1/chat/completions')
+
+    # 熔断器打开时不再等待上游超时
+    if not deepseek_breaker.allow():
+        logger.warning("DeepSeek熔断中，跳过API调用")
+        raise AnalysisError('分析服务暂时不可用，当前为本地分析报告')
+
+    logger.info("调用Deepseek API: %s（提示词 %d 字符）", deepseek_api_url, len(prompt))
+    request_data = {
+        "model": "deepseek-chat",
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    }
+    logger.debug("请求数据: %s", truncated(request_data), extra={'payload': True})
+
+    started = time.perf_counter()
+    try:
+        with metrics.span('analysis.upstream'):
+            response = requests.post(
+                deepseek_api_url,
+                headers={
+                    'Content-Type': 'application/json',
+                    'Authorization': f'Bearer {deepseek_api_key}'
+                },
+                json=request_data,
+                timeout=(10, current_app.config.get('DEEPSEEK_TIMEOUT', 60))  # 连接超时、读取超时
+            )
+    except requests.exceptions.Timeout:
+        logger.warning("API请求超时")
+        metrics.UPSTREAM_ERRORS.inc(upstream='deepseek', kind='timeout')
+        deepseek_breaker.record(False, time.perf_counter() - started)
+        raise AnalysisError('API请求超时，当前为本地分析报告')
+    except requests.exceptions.RequestException as e:
+        logger.warning("API请求异常: %s", e)
+        metrics.UPSTREAM_ERRORS.inc(upstream='deepseek', kind='connection')
+        deepseek_breaker.record(False, time.perf_counter() - started)
+        raise AnalysisError('API请求异常，当前为本地分析报告')
+
+    logger.info("API响应状态: %s", response.status_code)
+    if response.status_code != 200:
+        logger.warning("API调用失败: %s %s", response.status_code, truncated(response.text))
+        metrics.UPSTREAM_ERRORS.inc(upstream='deepseek', kind='http_%d' % response.status_code)
+        # 限流和服务端错误计入熔断统计，4xx（如密钥错误）不计入
+        deepseek_breaker.record(response.status_code < 500 and response.status_code != 429,
+                                time.perf_counter() - started)
+        raise AnalysisError(f'API调用失败（{response.status_code}），当前为本地分析报告')
+
+    try:
+        result = response.json()
+        analysis_content = result['choices'][0]['message']['content']
+    except (ValueError, KeyError, IndexError, TypeError):
+        analysis_content = None
+    logger.debug("API响应内容: %s", truncated(response.text), extra={'payload': True})
+    if not isinstance(analysis_content, str) or not analysis_content.strip():
+        logger.warning("API响应格式不正确")
+        metrics.UPSTREAM_ERRORS.inc(upstream='deepseek', kind='malformed')
+        deepseek_breaker.record(False, time.perf_counter() - started)
+        raise AnalysisError('API响应格式不正确，当前为本地分析报告')
+
+    deepseek_breaker.record(True, time.perf_counter() - started)
+    return analysis_content
+
+
+def format_exams(exams):
+    """提示词中的考试成绩列表"""
+    content = ""
+    for exam in exams:
+        content += f"- {exam.grade} {exam.exam_type} ({exam.date}):\n"
+        content += f"  语文: {exam.chinese if exam.chinese else '无'}\n"
+        content += f"  数学: {exam.math if exam.math else '无'}\n"
+        content += f"  英语: {exam.english if exam.english else '无'}\n"
+        content += f"  物理: {exam.physics if exam.physics else '无'}\n"
+        content += f"  化学: {exam.chemistry if exam.chemistry else '无'}\n"
+        content += f"  历史: {exam.history if exam.history else '无'}\n"
+        content += f"  政治: {exam.politics if exam.politics else '无'}\n"
+        content += f"  地理: {exam.geography if exam.geography else '无'}\n"
+        content += f"  生物: {exam.biology if exam.biology else '无'}\n"
+    return content
+
+
+def format_questions(questions):
+    """提示词中的错题列表"""
+    content = ""
+    for question in questions:
+        content += f"- {question.subject} ({question.grade} {question.exam}):\n"
+        content += f"  内容摘要: {question.content[:100] if question.content else '无内容'}...\n"
+        content += f"  错误原因: {question.reason if question.reason else '无'}\n"
+    return content
+
+
+def format_knowledge_points(knowledge_points):
+    """提示词中的知识点统计"""
+    return "".join(f"- {point}（{subject}）: {count} 道\n" for subject, point, count in knowledge_points)
+
+
+def format_cohort(cohort, student_id):
+    """提示词中整批学生（批量报告）的统计"""
+    content = f"- 本批共 {cohort['students']} 名学生"
+    if cohort['averages']:
+        content += "，各科平均分: " + "、".join(f"{name} {score:.1f}" for name, score in cohort['averages'].items())
+    content += "\n"
+    rank = local_analysis.student_rank(student_id, cohort)
+    if rank:
+        position, count, own, average = rank
+        content += f"- 该学生平均总分 {own:.1f}，在 {count} 名学生中排名第 {position}（整体平均 {average:.1f}）\n"
+    if cohort['reasons']:
+        content += "- 整体错误原因: " + "、".join(f"{reason} {count} 道" for reason, count in cohort['reasons'].items()) + "\n"
+    if cohort['knowledge_points']:
+        content += "- 整体错题最多的知识点: " + "、".join(f"{point}（{subject}）{count} 道"
+                                                for subject, point, count in cohort['knowledge_points']) + "\n"
+    return content
+
+
+def build_analysis_prompt(exams, questions, question_total=None, knowledge_points=None, cohort=None):
+    """
+    根据考试成绩和错题构建发送给DeepSeek的提示词
+    question_total为符合条件的错题总数，knowledge_points为全部符合条件的错题按知识点统计的错题数
+    cohort为批量生成时整批学生的统计（format_cohort的结果）
+    """
+    content = "请基于以下考试成绩和错题信息进行学习分析：\n\n"
+
+    # 添加考试成绩信息
+    if exams:
+        content += "考试成绩信息：\n"
+        content += format_exams(exams)
+
+    # 添加错题信息
+    if questions:
+        content += "\n错题信息：\n"
+        if question_total and question_total > len(questions):
+            content += f"（共 {question_total} 道错题，以下为最近的 {len(questions)} 道）\n"
+        content += format_questions(questions)
+
+    if knowledge_points:
+        content += "\n错题知识点统计（全部符合条件的错题）：\n"
+        content += format_knowledge_points(knowledge_points)
+
+    if cohort:
+        content += "\n同批学生整体情况：\n"
+        content += cohort
+
+    # 添加特定指令，要求返回结构化数据
+    content += "\n\n请按照以下格式返回分析结果：\n\n"
+    content += "1. 成绩趋势分析：包含每次考试的总分和各科分数\n"
+    content += "2. 学科对比分析：包含各科目的对比分析\n"
+    content += "3. 错题类型分析：包含各类错误原因的百分比\n"
+    content += "4. 学习建议：包含具体的学习建议\n"
+    if cohort:
+        content += "5. 年级对比：与同批学生整体情况的对比\n"
+    content += "\n"
+    content += "请使用Markdown格式返回，并在分析末尾添加以下结构化数据块：\n\n"
+    content += "```\n"
+    content += "成绩趋势数据：\n"
+    content += "- 考试1名称: 总分\n"
+    content += "- 考试2名称: 总分\n"
+    content += "```\n\n"
+    content += "```\n"
+    content += "学科对比数据：\n"
+    content += "- 语文: 分数\n"
+    content += "- 数学: 分数\n"
+    content += "- 英语: 分数\n"
+    content += "```\n\n"
+    content += "```\n"
+    content += "错题类型数据：\n"
+    content += "- 概念不清: 百分比%\n"
+    content += "- 计算错误: 百分比%\n"
+    content += "- 审题失误: 百分比%\n"
+    content += "- 方法不当: 百分比%\n"
+    content += "- 知识点盲区: 百分比%\n"
+    content += "```\n\n"
+
+    return content
+
+
+
+def extract_structured_data(content):
+    """从分析内容中提取结构化数据"""
+    data = {
+        'score_trend': {
+            'labels': [],
+            'datasets': []
+        },
+        'subject_compare': {
+            'labels': [],
+            'datasets': []
+        },
+        'error_category': {
+            'labels': [],
+            'datasets': []
+        }
+    }
+
+    # 提取成绩趋势数据
+    score_trend_match = re.search(r'成绩趋势数据：[\s\S]*?(?=\n\n```|\n###|$)', content)
+    if score_trend_match:
+        score_trend_text = score_trend_match.group(0)
+
+        # 直接使用 finditer 进行匹配
+        for match in re.finditer(r'- (.*?): (\d+)', score_trend_text):
+            exam_name, score = match.groups()
+            data['score_trend']['labels'].append(exam_name)
+            data['score_trend']['datasets'].append(int(score))
+    else:
+        logger.debug("未找到成绩趋势数据")
+
+    # 提取学科对比数据
+    subject_compare_match = re.search(r'学科对比数据：[\s\S]*?(?=\n\n```|\n###|$)', content)
+    if subject_compare_match:
+        subject_compare_text = subject_compare_match.group(0)
+
+        # 直接使用 finditer 进行匹配
+        for match in re.finditer(r'- (.*?): (\d+)', subject_compare_text):
+            subject, score = match.groups()
+            data['subject_compare']['labels'].append(subject)
+            data['subject_compare']['datasets'].append(int(score))
+    else:
+        logger.debug("未找到学科对比数据")
+
+    # 提取错题类型数据
+    error_category_match = re.search(r'错题类型数据：[\s\S]*?(?=\n\n```|\n###|$)', content)
+    if error_category_match:
+        error_category_text = error_category_match.group(0)
+
+        # 直接使用 finditer 进行匹配
+        for match in re.finditer(r'- (.*?): (\d+)%', error_category_text):
+            error_type, percentage = match.groups()
+            data['error_category']['labels'].append(error_type)
+            data['error_category']['datasets'].append(int(percentage))
+    else:
+        logger.debug("未找到错题类型数据")
+
+    return data
@@ -0,0 +1,320 @@
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import date
+
+from . import metrics
+from .ocr import QuotaExceeded, process_ocr
+from .tasks import ocr_queue
+
+logger = logging.getLogger(__name__)
+
+# 优先级通道：单张上传优先于批量补识别
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+
+class TokenBucket:
+    """
+    与OCR.space密钥限额一致的令牌桶：每分钟最多per_minute次（匀速补充），每天最多per_day次
+    参数为0表示不限制
+    设置path后桶的状态保存在SQLite文件中，多个gunicorn工作进程和命令行补识别共用同一份额度，重启后当日用量不清零
+    """
+
+    def __init__(self, per_minute=0, per_day=0, clock=time.time):
+        # 状态需要跨进程共享，使用墙上时间而不是monotonic
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._conn = None
+        self.configure(per_minute, per_day)
+
+    def configure(self, per_minute, per_day, path=None):
+        with self._lock:
+            self.per_minute = per_minute
+            self.per_day = per_day
+            self._tokens = float(per_minute)
+            self._updated = self._clock()
+            self._blocked_until = 0.0
+            self._day = date.today()
+            self._used_today = 0
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            if path:
+                self._conn = _open_quota_db(path)
+
+    @contextmanager
+    def _shared(self):
+        """
+        在共享状态上执行一次读-改-写，调用方需持有self._lock
+        BEGIN IMMEDIATE 保证其他进程不会在读取和写回之间取走同一个令牌；
+        数据库不可用时退回到进程内状态，不影响识别
+        """
+        conn = self._conn
+        if conn is not None:
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute('SELECT tokens, updated, blocked_until, day, used_today '
+                                   'FROM ocr_quota WHERE id = 1').fetchone()
+            except sqlite3.Error as e:
+                logger.warning("读取OCR共享配额失败，本次使用进程内状态: %s", e)
+                _rollback(conn)
+                conn = None
+            else:
+                if row is not None:
+                    self._tokens, self._updated, self._blocked_until, day, self._used_today = row
+                    self._day = date.fromisoformat(day)
+        try:
+            yield
+        finally:
+            if conn is not None:
+                try:
+                    conn.execute('INSERT OR REPLACE INTO ocr_quota (id, tokens, updated, blocked_until, day, used_today) '
+                                 'VALUES (1, ?, ?, ?, ?, ?)',
+                                 (self._tokens, self._updated, self._blocked_until,
+                                  self._day.isoformat(), self._used_today))
+                    conn.execute('COMMIT')
+                except sqlite3.Error as e:
+                    logger.warning("保存OCR共享配额失败: %s", e)
+                    _rollback(conn)
+
+    def _refill(self, now):
+        if self.per_minute:
+            elapsed = max(now - self._updated, 0.0)
+            self._tokens = min(float(self.per_minute), self._tokens + elapsed * self.per_minute / 60.0)
+        self._updated = now
+        today = date.today()
+        if today != self._day:
+            self._day = today
+            self._used_today = 0
+
+    def _wait(self, now, reserve, daily_reserve):
+        """获取一个令牌（每分钟额度保留reserve个、当日额度保留daily_reserve个）还需等待的秒数"""
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self.per_day and self._used_today >= max(self.per_day - daily_reserve, 0):
+            # 当日额度用完，等到次日零点
+            return max(_seconds_until_midnight(), 1.0)
+        if self.per_minute and self._tokens < 1 + reserve:
+            return (1 + reserve - self._tokens) * 60.0 / self.per_minute
+        return 0.0
+
+    def wait_time(self, reserve=0, daily_reserve=0):
+        with self._lock, self._shared():
+            now = self._clock()
+            self._refill(now)
+            return self._wait(now, reserve, daily_reserve)
+
+    def try_acquire(self, reserve=0, daily_reserve=0):
+        """有令牌时取走一个并返回True"""
+        with self._lock, self._shared():
+            now = self._clock()
+            self._refill(now)
+            if self._wait(now, reserve, daily_reserve) > 0:
+                return False
+            if self.per_minute:
+                self._tokens -= 1
+            self._used_today += 1
+            return True
+
+    def block(self, seconds):
+        """上游返回配额错误时，seconds秒内不再发放令牌"""
+        with self._lock, self._shared():
+            now = self._clock()
+            self._refill(now)
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, now + seconds)
+
+    @property
+    def used_today(self):
+        with self._lock, self._shared():
+            self._refill(self._clock())
+            return self._used_today
+
+
+def _open_quota_db(path):
+    """打开（必要时创建）保存令牌桶状态的SQLite文件，失败时返回None，退回到进程内限额"""
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 自行控制事务；所有访问都在TokenBucket._lock内，可以跨线程共用一个连接
+        conn = sqlite3.connect(path, timeout=15, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS ocr_quota ('
+                     'id INTEGER PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, '
+                     'blocked_until REAL NOT NULL, day TEXT NOT NULL, used_today INTEGER NOT NULL)')
+        return conn
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("无法打开OCR共享配额文件 %s，各进程将分别计算限额: %s", path, e)
+        return None
+
+
+def _rollback(conn):
+    try:
+        conn.execute('ROLLBACK')
+    except sqlite3.Error:
+        pass
+
+
+def _seconds_until_midnight():
+    now = time.localtime()
+    return 86400 - (now.tm_hour * 3600 + now.tm_min * 60 + now.tm_sec)
+
+
+class _Job:
+    __slots__ = ('app', 'question_id', 'file_path', 'filename', 'file_type', 'lane', 'callback', 'deferrals')
+
+    def __init__(self, app, question_id, file_path, filename, lane, callback=None, file_type=None):
+        self.app = app
+        self.question_id = question_id
+        self.file_path = file_path
+        self.filename = filename
+        self.file_type = file_type
+        self.lane = lane
+        self.callback = callback
+        self.deferrals = 0
+
+
+class OCRScheduler:
+    """
+    OCR调度器：按优先级通道排队，按令牌桶限速后交给OCR队列执行
+    - 交互通道总是先于批量通道发放令牌和工作线程
+    - 批量通道不占用最后一个工作线程，并为交互通道保留一部分每分钟额度
+    - 上游返回配额错误时任务重新排到通道最前面等待，而不是写入“OCR识别失败”
+    """
+
+    def __init__(self, queue, bucket):
+        self.queue = queue
+        self.bucket = bucket
+        self.bulk_reserve = 0
+        self.bulk_daily_reserve = 0
+        self.reserve_worker = True
+        self._lanes = {lane: deque() for lane in LANES}
+        self._inflight = {lane: 0 for lane in LANES}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def configure(self, bulk_reserve=0, reserve_worker=True, bulk_daily_reserve=0):
+        """
+        bulk_reserve: 每分钟额度中为交互通道保留的令牌数
+        bulk_daily_reserve: 当日额度中为交互通道保留的次数，批量任务用到剩余这么多次时停止到次日
+        reserve_worker: 是否为交互通道保留一个工作线程（命令行批量处理时没有交互任务，可关闭）
+        """
+        with self._cond:
+            self.bulk_reserve = bulk_reserve
+            self.bulk_daily_reserve = bulk_daily_reserve
+            self.reserve_worker = reserve_worker
+
+    def depth(self, lane=None):
+        """等待调度的任务数"""
+        with self._cond:
+            if lane is not None:
+                return len(self._lanes[lane])
+            return sum(len(jobs) for jobs in self._lanes.values())
+
+    def submit(self, app, question_id, file_path, filename, lane=INTERACTIVE, callback=None, file_type=None):
+        """
+        加入调度队列，服务关闭后返回False
+        file_type: 错题记录的文件类型，决定发送给OCR服务的MIME类型
+        callback(question_id, ok): 识别完成（成功或写入失败内容）后调用，配额延后时不调用
+        """
+        if not self.queue.accepting:
+            return False
+        with self._cond:
+            self._lanes[lane].append(_Job(app, question_id, file_path, filename, lane, callback, file_type))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._dispatch, name='ocr-scheduler', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return True
+
+    def _pick(self):
+        """
+        取出下一个有空闲工作线程的任务（交互通道优先），返回 (任务, (每分钟保留数, 当日保留数))，没有时返回 (None, None)
+        只在持有self._cond时调用；令牌在释放条件变量之后再获取
+        """
+        workers = self.queue.max_workers
+        busy = sum(self._inflight.values())
+        for lane in LANES:
+            if not self._lanes[lane]:
+                continue
+            if busy >= workers or (lane == BULK and self.reserve_worker and workers > 1 and busy >= workers - 1):
+                continue
+            job = self._lanes[lane].popleft()
+            self._inflight[lane] += 1
+            return job, ((self.bulk_reserve, self.bulk_daily_reserve) if lane == BULK else (0, 0))
+        return None, None
+
+    def _requeue(self, job):
+        """任务放回通道最前面（调用方持有self._cond）"""
+        self._inflight[job.lane] -= 1
+        self._lanes[job.lane].appendleft(job)
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                if not self.queue.accepting:
+                    remaining = sum(len(jobs) for jobs in self._lanes.values())
+                    if remaining:
+                        logger.warning("服务关闭，%d 个OCR任务未执行（内容保持为空）", remaining)
+                    return
+                job, reserves = self._pick()
+                if job is None:
+                    self._cond.wait()
+                    continue
+
+            # 共享令牌桶可能要等其他进程释放额度文件的写锁，不能在持有条件变量时获取，
+            # 否则上传请求调用submit()也会被阻塞
+            if not self.bucket.try_acquire(*reserves):
+                wait = max(self.bucket.wait_time(*reserves), 0.05)
+                with self._cond:
+                    # 交互任务在等令牌时，批量任务也不能抢先：放回后等待令牌或新任务
+                    self._requeue(job)
+                    self._cond.wait(timeout=wait)
+                continue
+
+            if self.queue.submit(self._execute, job) is None:
+                with self._cond:
+                    self._requeue(job)
+
+    def _execute(self, job):
+        try:
+            ok = process_ocr(job.app, job.question_id, job.file_path, job.filename,
+                             acquire=self.bucket.try_acquire, file_type=job.file_type)
+            if job.callback is not None:
+                job.callback(job.question_id, bool(ok))
+        except QuotaExceeded as e:
+            job.deferrals += 1
+            if e.retry_after:
+                self.bucket.block(e.retry_after)
+            DEFERRALS.inc(lane=job.lane)
+            logger.warning("OCR配额已用完，question_id=%s 将在 %s 秒后重试（第%d次延后）",
+                           job.question_id, e.retry_after, job.deferrals)
+            with self._cond:
+                self._lanes[job.lane].appendleft(job)
+        finally:
+            with self._cond:
+                self._inflight[job.lane] -= 1
+                self._cond.notify_all()
+
+
+quota = TokenBucket()
+ocr_scheduler = OCRScheduler(ocr_queue, quota)
+
+DEFERRALS = metrics.Counter('ocr_quota_deferrals_total', '因OCR配额用完而延后的任务次数')
+metrics.Gauge('ocr_lane_depth', '各优先级通道中等待调度的OCR任务数',
+              lambda: {(('lane', lane),): ocr_scheduler.depth(lane) for lane in LANES})
+
+
+def init_app(app):
+    """根据配置设置OCR限额，额度状态保存在 OCR_QUOTA_FILE（默认 instance/ocr_quota.db），所有进程共用"""
+    per_minute = app.config.get('OCR_RATE_PER_MINUTE', 0)
+    path = app.config.get('OCR_QUOTA_FILE') or os.path.join(app.instance_path, 'ocr_quota.db')
+    quota.configure(per_minute, app.config.get('OCR_RATE_PER_DAY', 0), path=path)
+    ocr_scheduler.configure(bulk_reserve=math.ceil(per_minute * app.config.get('OCR_INTERACTIVE_RESERVE', 0.2)),
+                            bulk_daily_reserve=app.config.get('OCR_BULK_RESERVE_PER_DAY', 0))
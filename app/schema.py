@@ -0,0 +1,60 @@
+import logging
+
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateColumn
+
+from . import db
+
+logger = logging.getLogger(__name__)
+
+# 旧数据没有所属学生时归到这个学生名下
+DEFAULT_STUDENT_NAME = '默认学生'
+
+
+def upgrade():
+    """
+    为旧数据库补齐新增的表、列和索引（项目没有迁移脚本，每次启动时执行，可重复执行）
+    需要在应用上下文中调用
+    gunicorn每个工作进程启动时都会执行，SQLite下整个升级在一个 BEGIN IMMEDIATE 事务中完成：
+    同时启动的其他进程等待写锁（busy_timeout），拿到锁时升级已经完成，不会重复建表或重复创建默认学生
+    """
+    from .models import Student
+
+    engine = db.engine
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+        db.metadata.create_all(bind=conn)
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                try:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {ddl}'))
+                    logger.info("数据库升级: %s 新增列 %s", table.name, column.name)
+                except OperationalError as e:
+                    # 其他数据库没有写锁保护，多个工作进程同时启动时其他进程可能已经加上了这一列
+                    logger.debug("新增列 %s.%s 跳过: %s", table.name, column.name, e)
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+        # 把没有学生的旧数据归到默认学生（查找和创建在同一个事务中）
+        students = Student.__table__
+        tables = [table for table in db.metadata.sorted_tables
+                  if table is not students and 'student_id' in table.columns]
+        orphaned = any(conn.execute(text(f'SELECT 1 FROM {table.name} WHERE student_id IS NULL LIMIT 1')).first()
+                       for table in tables)
+        if orphaned:
+            student_id = conn.execute(select(students.c.id).where(students.c.name == DEFAULT_STUDENT_NAME)
+                                      .order_by(students.c.id).limit(1)).scalar()
+            if student_id is None:
+                student_id = conn.execute(students.insert().values(name=DEFAULT_STUDENT_NAME)).inserted_primary_key[0]
+            for table in tables:
+                conn.execute(text(f'UPDATE {table.name} SET student_id = :id WHERE student_id IS NULL'),
+                             {'id': student_id})
+            logger.info("数据库升级: 未归属的数据已归到学生 %s", DEFAULT_STUDENT_NAME)
+        conn.commit()
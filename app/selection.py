@@ -0,0 +1,132 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import false, or_
+
+from .models import ErrorQuestion, ExamScore
+
+# 科目名与成绩列的对应关系
+SUBJECT_COLUMNS = {
+    '语文': 'chinese', '数学': 'math', '英语': 'english', '物理': 'physics', '化学': 'chemistry',
+    '历史': 'history', '政治': 'politics', '地理': 'geography', '生物': 'biology', '体育': 'sports',
+}
+
+# 支持的筛选条件
+FILTER_KEYS = ('subject', 'grade', 'date_from', 'date_to', 'reason', 'search')
+
+
+def parse_selection(data):
+    """
+    从请求数据中解析选择条件，返回可以直接保存为JSON的字典
+    - filters: 按条件选择（科目、年级、日期范围、收录原因、搜索文字）
+    - exam_ids/question_ids: 手动勾选的记录（与条件同时存在时取交集）
+    格式错误（日期、ID不是数字、条件不是对象等）时抛出ValueError
+    """
+    if not isinstance(data, dict):
+        raise ValueError('选择条件格式错误')
+    raw_filters = data.get('filters') or {}
+    if not isinstance(raw_filters, dict):
+        raise ValueError('筛选条件格式错误')
+    filters = {}
+    for key in FILTER_KEYS:
+        value = raw_filters.get(key)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f'筛选条件格式错误: {key}')
+        if value:
+            value = value.strip()
+        if value:
+            filters[key] = value
+    for key in ('date_from', 'date_to'):
+        if key in filters:
+            try:
+                date.fromisoformat(filters[key])
+            except ValueError:
+                raise ValueError(f'日期格式错误: {filters[key]}，应为YYYY-MM-DD')
+
+    selection = {'filters': filters}
+    for key in ('exam_ids', 'question_ids'):
+        ids = data.get(key)
+        if ids:
+            if not isinstance(ids, list):
+                raise ValueError(f'{key} 应为ID列表')
+            try:
+                selection[key] = sorted({int(i) for i in ids})
+            except (TypeError, ValueError):
+                raise ValueError(f'{key} 中包含无效的ID')
+    return selection
+
+
+def is_empty_selection(selection):
+    return not selection.get('filters') and not selection.get('exam_ids') and not selection.get('question_ids')
+
+
+def student_filter(column, student_id):
+    """student_id可以是一名学生的ID，也可以是ID列表（批量报告统计整批学生）"""
+    if isinstance(student_id, (list, tuple, set)):
+        return column.in_(list(student_id))
+    return column == student_id
+
+
+def exam_query(student_id, selection):
+    """考试成绩查询，按 (student_id, date) 索引范围扫描"""
+    filters = selection.get('filters', {})
+    query = ExamScore.query.filter(student_filter(ExamScore.student_id, student_id))
+    if 'date_from' in filters:
+        query = query.filter(ExamScore.date >= date.fromisoformat(filters['date_from']))
+    if 'date_to' in filters:
+        query = query.filter(ExamScore.date <= date.fromisoformat(filters['date_to']))
+    if 'grade' in filters:
+        query = query.filter(ExamScore.grade == filters['grade'])
+    column = SUBJECT_COLUMNS.get(filters.get('subject'))
+    if column:
+        # 只选有该科成绩的考试
+        query = query.filter(getattr(ExamScore, column).isnot(None))
+    if selection.get('exam_ids'):
+        query = query.filter(ExamScore.id.in_(selection['exam_ids']))
+    elif selection.get('question_ids') and not filters:
+        # 只手动勾选了错题时不包含考试
+        query = query.filter(false())
+    return query.order_by(ExamScore.date)
+
+
+def question_query(student_id, selection):
+    """错题查询，按 (student_id, upload_time) 索引范围扫描，最近上传的在前"""
+    filters = selection.get('filters', {})
+    query = ErrorQuestion.query.filter(student_filter(ErrorQuestion.student_id, student_id))
+    if 'date_from' in filters:
+        query = query.filter(ErrorQuestion.upload_time >= datetime.fromisoformat(filters['date_from']))
+    if 'date_to' in filters:
+        # 包含结束日期当天
+        query = query.filter(ErrorQuestion.upload_time < datetime.fromisoformat(filters['date_to']) + timedelta(days=1))
+    if 'subject' in filters:
+        query = query.filter(ErrorQuestion.subject == filters['subject'])
+    if 'grade' in filters:
+        query = query.filter(ErrorQuestion.grade == filters['grade'])
+    if 'reason' in filters:
+        query = query.filter(ErrorQuestion.reason == filters['reason'])
+    if 'search' in filters:
+        # 转义LIKE通配符，搜索“_”或“%”时按字面匹配
+        term = filters['search'].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        pattern = f"%{term}%"
+        query = query.filter(or_(ErrorQuestion.content.like(pattern, escape='\\'),
+                                 ErrorQuestion.note.like(pattern, escape='\\')))
+    if selection.get('question_ids'):
+        query = query.filter(ErrorQuestion.id.in_(selection['question_ids']))
+    elif selection.get('exam_ids') and not filters:
+        query = query.filter(false())
+    return query.order_by(ErrorQuestion.upload_time.desc())
+
+
+def describe_selection(selection):
+    """选择条件的文字说明，用于报告页面"""
+    filters = selection.get('filters', {})
+    parts = []
+    for key in ('subject', 'grade', 'reason'):
+        if key in filters:
+            parts.append(filters[key])
+    if 'date_from' in filters or 'date_to' in filters:
+        parts.append(f"{filters.get('date_from', '最早')} 至 {filters.get('date_to', '今天')}")
+    if 'search' in filters:
+        parts.append(f"包含“{filters['search']}”")
+    if selection.get('exam_ids') or selection.get('question_ids'):
+        parts.append('手动选择')
+    return ' · '.join(parts) or '全部数据'
@@ -0,0 +1,216 @@
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from . import metrics
+from .models import db, ErrorQuestion, ExamScore, QuestionTag
+from .selection import SUBJECT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# 快照中的数据集，按 学年/年级 分区（Hive风格目录：school_year=2023/grade=初二/part-*.parquet）
+EXAM_SCORES = 'exam_scores'
+QUESTION_REASONS = 'question_reasons'
+QUESTION_TAGS = 'question_tags'
+DATASETS = (EXAM_SCORES, QUESTION_REASONS, QUESTION_TAGS)
+PARTITION_COLS = ['school_year', 'grade']
+
+# 记录已写入快照的最大ID，下次只追加之后的新数据
+STATE_FILE = '_snapshot.json'
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise SnapshotError('未安装pyarrow，无法生成分析快照（pip install pyarrow）')
+
+
+def snapshot_folder():
+    return current_app.config.get('ANALYTICS_FOLDER') or os.path.join(current_app.instance_path, 'analytics')
+
+
+def school_year(day):
+    """学年从9月开始：2023年9月到2024年8月为2023学年"""
+    return day.year if day.month >= 9 else day.year - 1
+
+
+def term(day):
+    """学期：1为上学期（9月到次年1月），2为下学期（2月到8月）"""
+    return 1 if day.month >= 9 or day.month == 1 else 2
+
+
+def dataset_schemas():
+    import pyarrow as pa
+
+    exam_scores = pa.schema(
+        [('id', pa.int64()), ('student_id', pa.int64()), ('exam_type', pa.string()), ('date', pa.date32()),
+         ('term', pa.int8())]
+        + [(column, pa.float64()) for column in SUBJECT_COLUMNS.values()]
+        + [('school_year', pa.int16()), ('grade', pa.string())])
+    counts = [('student_id', pa.int64()), ('subject', pa.string()), ('month', pa.int8()), ('term', pa.int8())]
+    return {
+        EXAM_SCORES: exam_scores,
+        QUESTION_REASONS: pa.schema(counts + [('reason', pa.string()), ('questions', pa.int64()),
+                                              ('school_year', pa.int16()), ('grade', pa.string())]),
+        QUESTION_TAGS: pa.schema(counts + [('knowledge_point', pa.string()), ('questions', pa.int64()),
+                                           ('school_year', pa.int16()), ('grade', pa.string())]),
+    }
+
+
+def load_state(folder):
+    path = os.path.join(folder, STATE_FILE)
+    if not os.path.exists(path):
+        return {'max_exam_id': 0, 'max_question_id': 0}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_state(folder, state):
+    """原子写入，数据文件写完后才更新，中断后重新运行会覆盖同名的数据文件而不会重复"""
+    state['updated'] = datetime.now().isoformat(timespec='seconds')
+    path = os.path.join(folder, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _write(folder, dataset, rows, schema, batch_name):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if not rows:
+        return 0
+    table = pa.Table.from_pylist(rows, schema=schema)
+    # 文件名包含本批第一条记录的ID：重新运行同一批时覆盖原文件
+    pq.write_to_dataset(table, os.path.join(folder, dataset), partition_cols=PARTITION_COLS,
+                        basename_template=f'part-{batch_name}-{{i}}.parquet',
+                        existing_data_behavior='overwrite_or_ignore')
+    return len(rows)
+
+
+def _export_exams(folder, schemas, after_id, batch_size, echo):
+    """按ID分批读取成绩（只取需要的列），返回 (写入行数, 最大ID)"""
+    columns = [getattr(ExamScore, column) for column in SUBJECT_COLUMNS.values()]
+    written = 0
+    last_id = after_id
+    while True:
+        rows = db.session.execute(
+            select(ExamScore.id, ExamScore.student_id, ExamScore.grade, ExamScore.exam_type, ExamScore.date, *columns)
+            .where(ExamScore.id > last_id).order_by(ExamScore.id).limit(batch_size)).all()
+        if not rows:
+            break
+        records = []
+        for row in rows:
+            record = dict(row._mapping)
+            record['school_year'] = school_year(row.date)
+            record['term'] = term(row.date)
+            records.append(record)
+        written += _write(folder, EXAM_SCORES, records, schemas[EXAM_SCORES], rows[0].id)
+        last_id = rows[-1].id
+        if echo:
+            echo(f'成绩：已写入 {written} 条')
+    return written, last_id
+
+
+def _count_rows(keys, extra):
+    rows = []
+    for (student_id, grade, subject, day, value), count in keys.items():
+        rows.append({'student_id': student_id, 'grade': grade or '未知', 'subject': subject or '未分类',
+                     'school_year': school_year(day), 'month': day.month, 'term': term(day),
+                     extra: value, 'questions': count})
+    return rows
+
+
+def _export_questions(folder, schemas, after_id, until_id, batch_size, echo):
+    """
+    错题只写入按 (学生, 年级, 科目, 月份, 原因/知识点) 汇总的错题数，每批的计数是增量，查询时求和
+    返回 (写入行数, 最大ID)
+    """
+    written = 0
+    last_id = after_id
+    while last_id < until_id:
+        upper = db.session.execute(
+            select(func.max(ErrorQuestion.id)).where(ErrorQuestion.id.in_(
+                select(ErrorQuestion.id).where(ErrorQuestion.id > last_id, ErrorQuestion.id <= until_id)
+                .order_by(ErrorQuestion.id).limit(batch_size)))).scalar()
+        if upper is None:
+            break
+        in_batch = (ErrorQuestion.id > last_id, ErrorQuestion.id <= upper)
+        month = func.date(ErrorQuestion.upload_time, 'start of month')
+        reasons = db.session.execute(
+            select(ErrorQuestion.student_id, ErrorQuestion.grade, ErrorQuestion.subject, month,
+                   ErrorQuestion.reason, func.count())
+            .where(*in_batch).group_by(ErrorQuestion.student_id, ErrorQuestion.grade, ErrorQuestion.subject,
+                                       month, ErrorQuestion.reason)).all()
+        tags = db.session.execute(
+            select(ErrorQuestion.student_id, ErrorQuestion.grade, QuestionTag.subject, month,
+                   QuestionTag.knowledge_point, func.count())
+            .join(QuestionTag, QuestionTag.question_id == ErrorQuestion.id)
+            .where(*in_batch).group_by(ErrorQuestion.student_id, ErrorQuestion.grade, QuestionTag.subject,
+                                       month, QuestionTag.knowledge_point)).all()
+
+        reason_counts = {}
+        for student_id, grade, subject, day, reason, count in reasons:
+            key = (student_id, grade, subject, datetime.strptime(day, '%Y-%m-%d').date(), reason or '其他原因')
+            reason_counts[key] = reason_counts.get(key, 0) + count
+        tag_counts = {(student_id, grade, subject, datetime.strptime(day, '%Y-%m-%d').date(), point): count
+                      for student_id, grade, subject, day, point, count in tags}
+
+        batch_name = last_id + 1
+        written += _write(folder, QUESTION_REASONS, _count_rows(reason_counts, 'reason'),
+                          schemas[QUESTION_REASONS], batch_name)
+        written += _write(folder, QUESTION_TAGS, _count_rows(tag_counts, 'knowledge_point'),
+                          schemas[QUESTION_TAGS], batch_name)
+        last_id = upper
+        if echo:
+            echo(f'错题：已汇总到ID {last_id}')
+    return written, last_id
+
+
+def run_snapshot(full=False, min_age=60, batch_size=5000, echo=None):
+    """
+    把成绩和错题统计写入按学年、年级分区的Parquet文件，默认只追加上次快照之后新增的记录
+    min_age: 只汇总上传超过min_age分钟的错题（等OCR识别和打标签完成）
+    full: 重新生成全部快照（成绩被修改、删除或知识点词典变化后使用），写入临时目录后整体替换
+    返回本次的状态（最大ID和写入行数）
+    """
+    require_pyarrow()
+    folder = snapshot_folder()
+    target = folder
+    if full:
+        target = folder + '.tmp'
+        shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target, exist_ok=True)
+    state = {'max_exam_id': 0, 'max_question_id': 0} if full else load_state(folder)
+    schemas = dataset_schemas()
+
+    with metrics.span('analytics.snapshot'):
+        exam_rows, state['max_exam_id'] = _export_exams(target, schemas, state['max_exam_id'], batch_size, echo)
+        # 错题ID随上传时间递增，汇总到超过min_age的最后一道错题为止
+        until_id = db.session.execute(
+            select(func.max(ErrorQuestion.id))
+            .where(ErrorQuestion.upload_time <= datetime.utcnow() - timedelta(minutes=min_age))).scalar() or 0
+        question_rows, state['max_question_id'] = _export_questions(
+            target, schemas, state['max_question_id'], until_id, batch_size, echo)
+
+    _save_state(target, state)
+    if full:
+        # 先改名再删除旧快照，查询方不会读到写了一半的目录
+        old = folder + '.old'
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(folder):
+            os.replace(folder, old)
+        os.replace(target, folder)
+        shutil.rmtree(old, ignore_errors=True)
+    logger.info("分析快照完成: 成绩 %d 行, 错题统计 %d 行, %s", exam_rows, question_rows, state)
+    return dict(state, exam_rows=exam_rows, question_rows=question_rows)
@@ -1,67 +1,21 @@
-// 全局变量存储图表实例
-let charts = {};
+// 所有页面共用的脚本（base.html 以defer方式加载，在DOMContentLoaded之前执行完毕）
+// 图表、报告渲染、分析范围选择等页面专用的脚本写在各自的模板中
 
 document.addEventListener('DOMContentLoaded', function() {
-    console.log('DOM内容已加载');
-
-    // 检查图表数据元素
-    const chartDataElement = document.getElementById('chart-data');
-    if (chartDataElement) {
-        console.log("找到图表数据元素");
-        const content = chartDataElement.getAttribute('data-content');
-        console.log("图表数据内容:", content);
-    } else {
-        console.error("找不到图表数据元素");
-    }
-
-    // 渲染Markdown内容
-    renderMarkdown();
-
-    // 初始化所有表单验证
-    console.log('初始化表单验证');
-    initFormValidation();
-
-    // 初始化所有图表
-    console.log('初始化图表');
-    initCharts();
-
-    // 初始化文件上传预览
-    console.log('初始化文件上传预览');
-    initFileUploadPreview();
-
-    // 初始化分析生成功能
-    console.log('初始化分析生成功能');
-    initAnalysisGeneration();
-
     // 为导航栏添加滚动效果
-    console.log('初始化导航栏滚动效果');
     initNavbarScrollEffect();
 
     // 初始化新窗口链接
-    console.log('初始化新窗口链接');
     initNewWindowLinks();
 
-    // 额外添加拖放支持（如果需要）
-    console.log('初始化拖放支持');
-    initDragAndDrop();
-
-    // 默认全选所有复选框
-    console.log('默认全选所有复选框');
-    document.querySelectorAll('input[type="checkbox"][name$="_ids"]').forEach(checkbox => {
-        checkbox.checked = true;
-    });
+    // 页内锚点平滑滚动
+    initSmoothScroll();
 
-    // 初始化已选项目显示
-    console.log('初始化已选项目显示');
-    updateSelectedItems('exam');
-    updateSelectedItems('question');
-
-    // 如果是分析结果页面，渲染Markdown内容
-    if (window.location.pathname.includes('/view_analysis/')) {
-        renderMarkdown();
-    }
+    // 初始化所有表单验证
+    initFormValidation();
 
-    console.log('所有初始化完成');
+    // 初始化文件上传预览和拖放
+    initFileUploadPreview();
 });
 
 // 初始化新窗口链接
@@ -70,7 +24,19 @@ function initNewWindowLinks() {
     links.forEach(link => {
         link.addEventListener('click', function(e) {
             e.preventDefault();
-            window.open(this.href, '_blank');
+            window.open(this.getAttribute('href'), '_blank');
+        });
+    });
+}
+
+// 平滑滚动到页内锚点
+function initSmoothScroll() {
+    document.querySelectorAll('a[href^="#"]').forEach(anchor => {
+        anchor.addEventListener('click', function(e) {
+            const target = document.querySelector(this.getAttribute('href'));
+            if (!target) return;
+            e.preventDefault();
+            target.scrollIntoView({ behavior: 'smooth' });
         });
     });
 }
@@ -79,16 +45,16 @@ function initNewWindowLinks() {
 function initNavbarScrollEffect() {
     const header = document.querySelector('header');
     if (!header) return;
-    
+
     window.addEventListener('scroll', function() {
         if (window.scrollY > 10) {
-            header.classList.add('shadow-md', 'bg-white/95', 'backdrop-blur-sm');
-            header.classList.remove('shadow-sm', 'bg-white');
+            header.classList.add('shadow-md', 'bg-white/95', 'backdrop-blur-xs');
+            header.classList.remove('shadow-xs', 'bg-white');
         } else {
-            header.classList.remove('shadow-md', 'bg-white/95', 'backdrop-blur-sm');
-            header.classList.add('shadow-sm', 'bg-white');
+            header.classList.remove('shadow-md', 'bg-white/95', 'backdrop-blur-xs');
+            header.classList.add('shadow-xs', 'bg-white');
         }
-    });
+    }, { passive: true });
 }
 
 // 表单验证初始化
@@ -97,14 +63,14 @@ function initFormValidation() {
     forms.forEach(form => {
         form.addEventListener('submit', function(e) {
             let isValid = true;
-            
+
             // 验证必填字段
             const requiredFields = form.querySelectorAll('[required]');
             requiredFields.forEach(field => {
                 if (!field.value.trim()) {
                     isValid = false;
                     field.classList.add('input-error');
-                    
+
                     // 添加错误消息（如果不存在）
                     let errorMsg = field.nextElementSibling;
                     if (!errorMsg || !errorMsg.classList.contains('error-message')) {
@@ -115,7 +81,7 @@ function initFormValidation() {
                     }
                 } else {
                     field.classList.remove('input-error');
-                    
+
                     // 移除错误消息
                     let errorMsg = field.nextElementSibling;
                     if (errorMsg && errorMsg.classList.contains('error-message')) {
@@ -123,7 +89,7 @@ function initFormValidation() {
                     }
                 }
             });
-            
+
             if (!isValid) {
                 e.preventDefault();
                 // 滚动到第一个错误字段
@@ -146,13 +112,16 @@ function debounce(func, wait) {
     };
 }
 
-// 优化文件上传预览
+// 文件上传预览，虚线框区域支持拖放
 function initFileUploadPreview() {
     const fileInputs = document.querySelectorAll('input[type="file"]');
 
     fileInputs.forEach(input => {
+        const form = input.closest('form');
+        if (!form) return;
+
         // 查找预览容器
-        let previewContainer = input.closest('form').querySelector('.file-preview');
+        let previewContainer = form.querySelector('.file-preview');
         if (!previewContainer) {
             // 如果找不到预览容器，创建一个
             previewContainer = document.createElement('div');
@@ -201,31 +170,36 @@ function updateFilePreview(input, previewContainer) {
         return;
     }
 
-    let html = '<div class="space-y-3">';
+    const list = document.createElement('div');
+    list.className = 'space-y-3';
 
     for (let i = 0; i < files.length; i++) {
         const file = files[i];
         const fileType = getFileTypeIcon(file);
 
-        html += `
-            <div class="flex items-center justify-between p-3 bg-gray-50 rounded-lg border">
-                <div class="flex items-center">
-                    <i class="${fileType.icon} ${fileType.color} mr-3 text-lg"></i>
-                    <div>
-                        <div class="text-sm font-medium text-gray-900">${file.name}</div>
-                        <div class="text-xs text-gray-500">${formatFileSize(file.size)}</div>
-                    </div>
+        const item = document.createElement('div');
+        item.className = 'flex items-center justify-between p-3 bg-gray-50 rounded-lg border';
+        item.innerHTML = `
+            <div class="flex items-center">
+                <i class="${fileType.icon} ${fileType.color} mr-3 text-lg"></i>
+                <div>
+                    <div class="text-sm font-medium text-gray-900"></div>
+                    <div class="text-xs text-gray-500">${formatFileSize(file.size)}</div>
                 </div>
-                <button type="button" onclick="removeFile(this, '${input.id}')"
-                        class="text-gray-400 hover:text-gray-600 transition-colors">
-                    <i class="fa fa-times"></i>
-                </button>
             </div>
+            <button type="button" class="text-gray-400 hover:text-gray-600 transition-colors">
+                <i class="fa fa-times"></i>
+            </button>
         `;
+        // 文件名可能包含HTML字符，按文本写入
+        item.querySelector('.font-medium').textContent = file.name;
+        item.querySelector('button').addEventListener('click', function() {
+            removeFile(this, input.id);
+        });
+        list.appendChild(item);
     }
 
-    html += '</div>';
-    previewContainer.innerHTML = html;
+    previewContainer.replaceChildren(list);
 }
 
 function getFileTypeIcon(file) {
@@ -246,6 +220,7 @@ function getFileTypeIcon(file) {
 
 function removeFile(button, inputId) {
     const fileItem = button.closest('.flex.items-center.justify-between');
+    const container = fileItem.parentElement;
     fileItem.remove();
 
     // 清空文件输入
@@ -255,324 +230,18 @@ function removeFile(button, inputId) {
     }
 
     // 如果没有文件了，显示提示
-    const container = fileItem.parentElement;
     if (container.children.length === 0) {
         container.innerHTML = '<div class="text-gray-500 text-sm">未选择文件</div>';
     }
 }
 
-// 初始化图表
-function initCharts() {
-    // 获取数据
-    const chartDataElement = document.getElementById('chart-data');
-    if (!chartDataElement) {
-        console.error("找不到图表数据元素");
-        return;
-    }
-
-    const content = chartDataElement.getAttribute('data-content');
-    if (!content) {
-        console.error("找不到分析内容");
-        return;
-    }
-
-    // 解析JSON内容
-    let analysisContent;
-    try {
-        analysisContent = JSON.parse(content);
-        console.log("解析后的分析内容:", analysisContent);
-    } catch (e) {
-        console.error('解析分析内容失败:', e);
-        return;
-    }
-
-    // 从内容中提取结构化数据
-    const chartData = extractStructuredData(analysisContent);
-
-    // 打印三个分析区域的数据
-    console.log("成绩趋势数据:", chartData.scoreTrend);
-    console.log("学科对比数据:", chartData.subjectCompare);
-    console.log("错题类型数据:", chartData.errorCategory);
-
-    // 成绩趋势图
-    const scoreTrendCtx = document.getElementById('score-trend-chart');
-    if (scoreTrendCtx) {
-        if (chartData.scoreTrend.labels.length > 0 && chartData.scoreTrend.datasets.length > 0) {
-            console.log("初始化成绩趋势图");
-
-            // 构建图表数据
-            const chartDataFormatted = {
-                labels: chartData.scoreTrend.labels,
-                datasets: [{
-                    label: '总分',
-                    data: chartData.scoreTrend.datasets,
-                    borderColor: '#4F46E5',
-                    backgroundColor: 'rgba(79, 70, 229, 0.1)',
-                    tension: 0.3,
-                    fill: true
-                }]
-            };
-
-            charts.scoreTrend = new Chart(scoreTrendCtx, {
-                type: 'line',
-                data: chartDataFormatted,
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    interaction: {
-                        mode: 'index',
-                        intersect: false,
-                    },
-                    plugins: {
-                        legend: {
-                            position: 'top',
-                        },
-                        tooltip: {
-                            usePointStyle: true,
-                        }
-                    },
-                    scales: {
-                        y: {
-                            beginAtZero: false,
-                            min: 0,
-                            max: 300,  // 假设总分最高为300分
-                            ticks: {
-                                stepSize: 50
-                            }
-                        }
-                    },
-                    animation: {
-                        duration: 1000,
-                        easing: 'easeOutQuart'
-                    }
-                }
-            });
-        } else {
-            console.log("成绩趋势图没有数据，显示空状态");
-            // 如果没有数据，显示空状态
-            const emptyState = document.createElement('div');
-            emptyState.className = 'text-center py-10 text-gray-500';
-            emptyState.innerHTML = '<i class="fa fa-chart-line text-4xl mb-3 opacity-30"></i><p>暂无成绩趋势数据</p>';
-            scoreTrendCtx.parentNode.appendChild(emptyState);
-        }
-    }
-
-    // 学科对比图
-    const subjectCompareCtx = document.getElementById('subject-compare-chart');
-    if (subjectCompareCtx) {
-        if (chartData.subjectCompare.labels.length > 0 && chartData.subjectCompare.datasets.length > 0) {
-            console.log("初始化学科对比图");
-
-            // 构建图表数据
-            const chartDataFormatted = {
-                labels: chartData.subjectCompare.labels,
-                datasets: chartData.subjectCompare.datasets
-            };
-
-            charts.subjectCompare = new Chart(subjectCompareCtx, {
-                type: 'line',
-                data: chartDataFormatted,
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    interaction: {
-                        mode: 'index',
-                        intersect: false,
-                    },
-                    plugins: {
-                        legend: {
-                            position: 'top',
-                        },
-                        tooltip: {
-                            usePointStyle: true,
-                        }
-                    },
-                    scales: {
-                        y: {
-                            beginAtZero: false,
-                            min: 0,
-                            max: 100,
-                            ticks: {
-                                stepSize: 20
-                            }
-                        }
-                    },
-                    animation: {
-                        duration: 1000,
-                        easing: 'easeOutQuart'
-                    }
-                }
-            });
-        } else {
-            console.log("学科对比图没有数据，显示空状态");
-            // 如果没有数据，显示空状态
-            const emptyState = document.createElement('div');
-            emptyState.className = 'text-center py-10 text-gray-500';
-            emptyState.innerHTML = '<i class="fa fa-chart-area text-4xl mb-3 opacity-30"></i><p>暂无学科对比数据</p>';
-            subjectCompareCtx.parentNode.appendChild(emptyState);
-        }
-    }
-
-    // 错题类型分析图
-    const errorCategoryCtx = document.getElementById('error-category-chart');
-    if (errorCategoryCtx) {
-        if (chartData.errorCategory.labels.length > 0 && chartData.errorCategory.datasets.length > 0) {
-            console.log("初始化错题类型分析图");
-
-            // 构建图表数据
-            const chartDataFormatted = {
-                labels: chartData.errorCategory.labels,
-                datasets: [{
-                    data: chartData.errorCategory.datasets,
-                    backgroundColor: [
-                        '#4F46E5',
-                        '#10B981',
-                        '#F59E0B',
-                        '#EF4444',
-                        '#8B5CF6'
-                    ],
-                    borderWidth: 1
-                }]
-            };
-
-            charts.errorCategory = new Chart(errorCategoryCtx, {
-                type: 'doughnut',
-                data: chartDataFormatted,
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    plugins: {
-                        legend: {
-                            position: 'right',
-                        }
-                    },
-                    animation: {
-                        animateRotate: true,
-                        animateScale: true,
-                        duration: 1000,
-                        easing: 'easeOutQuart'
-                    }
-                }
-            });
-        } else {
-            console.log("错题类型分析图没有数据，显示空状态");
-            // 如果没有数据，显示空状态
-            const emptyState = document.createElement('div');
-            emptyState.className = 'text-center py-10 text-gray-500';
-            emptyState.innerHTML = '<i class="fa fa-chart-pie text-4xl mb-3 opacity-30"></i><p>暂无错题类型数据</p>';
-            errorCategoryCtx.parentNode.appendChild(emptyState);
-        }
-    }
-}
-
-// 更新图表数据
-function updateChart(chartId, data) {
-    if (charts[chartId]) {
-        charts[chartId].data = data;
-        charts[chartId].update();
-    }
-}
-
-// 初始化分析生成功能
-function initAnalysisGeneration() {
-    const generateBtn = document.getElementById('generate-analysis-btn');
-    if (!generateBtn) {
-        console.error('找不到生成分析报告按钮');
-        return;
-    }
-
-    console.log('找到生成分析报告按钮，添加点击事件监听器');
-
-    generateBtn.addEventListener('click', function() {
-        console.log('生成分析报告按钮被点击');
-
-        // 获取选中的考试和错题
-        const selectedExams = Array.from(document.querySelectorAll('input[name="exam_ids"]:checked'))
-            .map(checkbox => checkbox.value);
-
-        const selectedQuestions = Array.from(document.querySelectorAll('input[name="question_ids"]:checked'))
-            .map(checkbox => checkbox.value);
-
-        console.log('选中的考试:', selectedExams);
-        console.log('选中的错题:', selectedQuestions);
-
-        // 验证选择
-        if (selectedExams.length === 0 && selectedQuestions.length === 0) {
-            showToast('请至少选择一项考试或错题进行分析', 'error');
-            return;
-        }
-
-        // 显示加载动画
-        showLoading('正在生成分析报告，这可能需要几分钟时间...');
-
-        // 禁用按钮防止重复点击
-        generateBtn.disabled = true;
-        const originalText = generateBtn.innerHTML;
-        generateBtn.innerHTML = '<i class="fa fa-spinner fa-spin mr-2"></i> 分析中...';
-
-        // 获取当前页面的URL路径
-        const currentPath = window.location.pathname;
-        const baseUrl = currentPath.substring(0, currentPath.lastIndexOf('/') + 1);
-
-        // 发送请求生成分析
-        fetch(baseUrl + 'generate_analysis', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-                'X-CSRFToken': getCSRFToken()
-            },
-            body: JSON.stringify({
-                exam_ids: selectedExams,
-                question_ids: selectedQuestions
-            })
-        })
-        .then(response => {
-            console.log('收到响应:', response.status);
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            return response.json();
-        })
-        .then(data => {
-            console.log('分析结果:', data);
-
-            if (data.status === 'success' && data.analysis_id) {
-                // 打开新窗口查看分析结果
-                window.open(baseUrl + 'view_analysis/' + data.analysis_id, '_blank');
-                showToast('分析报告生成成功！', 'success');
-            } else {
-                throw new Error(data.message || '生成分析报告失败');
-            }
-        })
-        .catch(error => {
-            console.error('生成分析报告错误:', error);
-            showToast('生成分析报告失败: ' + error.message, 'error');
-        })
-        .finally(() => {
-            // 隐藏加载动画
-            hideLoading();
-
-            // 恢复按钮状态
-            generateBtn.disabled = false;
-            generateBtn.innerHTML = originalText;
-        });
-    });
-}
-
-// 辅助函数：获取CSRF令牌
-function getCSRFToken() {
-    // 尝试从meta标签获取
-    const metaToken = document.querySelector('meta[name="csrf-token"]');
-    if (metaToken) {
-        return metaToken.getAttribute('content');
-    }
-
-    // 尝试从cookie获取
-    const cookieValue = document.cookie
-        .split('; ')
-        .find(row => row.startsWith('csrf_token='))
-        ?.split('=')[1];
-    return cookieValue || '';
+// 辅助函数：格式化文件大小
+function formatFileSize(bytes) {
+    if (bytes === 0) return '0 Bytes';
+    const k = 1024;
+    const sizes = ['Bytes', 'KB', 'MB', 'GB'];
+    const i = Math.floor(Math.log(bytes) / Math.log(k));
+    return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
 }
 
 // 添加Toast提示功能
@@ -597,9 +266,10 @@ function showToast(message, type = 'info') {
                 type === 'error' ? 'fa-exclamation-circle' :
                 'fa-info-circle'
             } mr-2"></i>
-            <span>${message}</span>
+            <span></span>
         </div>
     `;
+    toast.querySelector('span').textContent = message;
 
     document.body.appendChild(toast);
 
@@ -609,200 +279,18 @@ function showToast(message, type = 'info') {
     }, 5000);
 }
 
-// 显示加载动画
-function showLoading(message) {
-    // 移除已存在的加载动画
-    hideLoading();
-
-    const loadingDiv = document.createElement('div');
-    loadingDiv.id = 'loading-overlay';
-    loadingDiv.className = 'fixed inset-0 bg-black/50 backdrop-blur-sm flex items-center justify-center z-50';
-
-    const loadingContent = document.createElement('div');
-    loadingContent.className = 'bg-white p-6 rounded-lg shadow-xl flex flex-col items-center min-w-[300px]';
-
-    const spinner = document.createElement('div');
-    spinner.className = 'w-12 h-12 border-4 border-primary/30 border-t-primary rounded-full animate-spin mb-4';
-
-    const text = document.createElement('p');
-    text.className = 'text-gray-700 font-medium';
-    text.textContent = message || '加载中...';
-
-    loadingContent.appendChild(spinner);
-    loadingContent.appendChild(text);
-    loadingDiv.appendChild(loadingContent);
-    document.body.appendChild(loadingDiv);
+// 显示加载动画（base.html 中的 #loading-modal）
+function showLoading(text = '处理中...') {
+    const modal = document.getElementById('loading-modal');
+    const loadingText = document.getElementById('loading-text');
+    loadingText.textContent = text;
+    modal.classList.remove('hidden');
+    modal.classList.add('flex');
 }
 
 // 隐藏加载动画
 function hideLoading() {
-    const loadingDiv = document.getElementById('loading-overlay');
-    if (loadingDiv) {
-        loadingDiv.remove();
-    }
-}
-
-// 辅助函数：格式化文件大小
-function formatFileSize(bytes) {
-    if (bytes === 0) return '0 Bytes';
-    const k = 1024;
-    const sizes = ['Bytes', 'KB', 'MB', 'GB'];
-    const i = Math.floor(Math.log(bytes) / Math.log(k));
-    return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
-}
-
-// 辅助函数：获取CSRF令牌
-function getCSRFToken() {
-    const cookieValue = document.cookie
-        .split('; ')
-        .find(row => row.startsWith('csrf_token='))
-        ?.split('=')[1];
-    return cookieValue || '';
+    const modal = document.getElementById('loading-modal');
+    modal.classList.add('hidden');
+    modal.classList.remove('flex');
 }
-
-// 显示加载动画
-function showLoading(message) {
-    // 移除已存在的加载动画
-    hideLoading();
-    
-    const loadingDiv = document.createElement('div');
-    loadingDiv.id = 'loading-overlay';
-    loadingDiv.className = 'fixed inset-0 bg-black/50 backdrop-blur-sm flex items-center justify-center z-50';
-    
-    const loadingContent = document.createElement('div');
-    loadingContent.className = 'bg-white p-6 rounded-lg shadow-xl flex flex-col items-center';
-    
-    const spinner = document.createElement('div');
-    spinner.className = 'w-12 h-12 border-4 border-primary/30 border-t-primary rounded-full animate-spin mb-4';
-    
-    const text = document.createElement('p');
-    text.className = 'text-gray-700 font-medium';
-    text.textContent = message || '加载中...';
-    
-    loadingContent.appendChild(spinner);
-    loadingContent.appendChild(text);
-    loadingDiv.appendChild(loadingContent);
-    document.body.appendChild(loadingDiv);
-}
-
-// 隐藏加载动画
-function hideLoading() {
-    const loadingDiv = document.getElementById('loading-overlay');
-    if (loadingDiv) {
-        loadingDiv.remove();
-    }
-}
-
-function initDragAndDrop() {
-    const dropZones = document.querySelectorAll('.border-dashed');
-    dropZones.forEach(zone => {
-        const fileInput = zone.querySelector('input[type="file"]');
-
-        zone.addEventListener('dragover', (e) => {
-            e.preventDefault();
-            zone.classList.add('border-primary');
-            zone.classList.add('bg-primary/5');
-        });
-
-        zone.addEventListener('dragleave', () => {
-            zone.classList.remove('border-primary');
-            zone.classList.remove('bg-primary/5');
-        });
-
-        zone.addEventListener('drop', (e) => {
-            e.preventDefault();
-            zone.classList.remove('border-primary');
-            zone.classList.remove('bg-primary/5');
-
-            if (e.dataTransfer.files.length) {
-                fileInput.files = e.dataTransfer.files;
-                // 触发change事件以更新预览
-                const event = new Event('change');
-                fileInput.dispatchEvent(event);
-            }
-        });
-    });
-}
-
-function toggleAll(type) {
-    const checkboxes = document.querySelectorAll(`input[name="${type}_ids"]`);
-    const allChecked = Array.from(checkboxes).every(checkbox => checkbox.checked);
-
-    checkboxes.forEach(checkbox => {
-        checkbox.checked = !allChecked;
-    });
-}
-
-// 更新已选项目显示
-function updateSelectedItems(type) {
-    const checkboxes = document.querySelectorAll(`input[name="${type}_ids"]:checked`);
-    const container = document.getElementById(`selected-${type}s`);
-    const listContainer = document.getElementById(`selected-${type}s-list`);
-
-    if (!container || !listContainer) return;
-
-    if (checkboxes.length === 0) {
-        container.classList.add('hidden');
-        return;
-    }
-
-    container.classList.remove('hidden');
-    listContainer.innerHTML = '';
-
-    checkboxes.forEach(checkbox => {
-        const label = document.querySelector(`label[for="${checkbox.id}"]`);
-        if (label) {
-            const badge = document.createElement('span');
-            badge.className = 'badge bg-primary/10 text-primary text-xs';
-            badge.textContent = label.textContent.trim();
-            listContainer.appendChild(badge);
-        }
-    });
-}
-
-/ 添加Markdown渲染功能
-function renderMarkdown() {
-    const contentElement = document.getElementById('analysis-content');
-    if (!contentElement) return;
-
-    // 获取原始内容
-    const originalContent = contentElement.innerHTML;
-
-    // 简单的Markdown到HTML转换
-    let htmlContent = originalContent
-        // 标题
-        .replace(/^### (.*$)/gim, '<h3>$1</h3>')
-        .replace(/^## (.*$)/gim, '<h2>$1</h2>')
-        .replace(/^# (.*$)/gim, '<h1>$1</h1>')
-        // 粗体
-        .replace(/\*\*(.*)\*\*/g, '<strong>$1</strong>')
-        // 斜体
-        .replace(/\*(.*)\*/g, '<em>$1</em>')
-        // 无序列表
-        .replace(/^- (.*$)/gim, '<li>$1</li>')
-        // 有序列表
-        .replace(/^\d+\. (.*$)/gim, '<li>$1</li>')
-        // 链接
-        .replace(/\[([^\]]+)\]\(([^)]+)\)/g, '<a href="$2">$1</a>')
-        // 换行
-        .replace(/\n/g, '<br>');
-
-    // 包装列表项
-    htmlContent = htmlContent.replace(/(<li>.*<\/li>)/s, '<ul>$1</ul>');
-
-    contentElement.innerHTML = htmlContent;
-}
-
-// 滚动到指定区域
-function scrollToSection(sectionId) {
-    const section = document.getElementById(sectionId + '-chart').closest('.card');
-    if (section) {
-        section.scrollIntoView({ behavior: 'smooth', block: 'start' });
-
-        // 高亮效果
-        section.classList.add('ring-2', 'ring-primary', 'ring-opacity-50');
-        setTimeout(() => {
-            section.classList.remove('ring-2', 'ring-primary', 'ring-opacity-50');
-        }, 2000);
-    }
-}
\ No newline at end of file
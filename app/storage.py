@@ -0,0 +1,354 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from . import media, metrics
+from .models import db, ErrorQuestion
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'storage_maintenance.json'
+# 每批处理的错题数
+BATCH_SIZE = 500
+
+
+def orphan_folder():
+    return os.path.join(current_app.instance_path, 'orphan_uploads')
+
+
+def load_state():
+    path = os.path.join(current_app.instance_path, STATE_FILE)
+    if not os.path.exists(path):
+        return {'recompressed_id': 0, 'cold_id': 0}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_state(state):
+    state['updated'] = datetime.now().isoformat(timespec='seconds')
+    path = os.path.join(current_app.instance_path, STATE_FILE)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _old_questions(after_id, days=0):
+    """ID大于after_id、上传超过days天的错题，按ID分批返回（ID与上传时间同序，处理完的ID作为下次的起点）"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    query = ErrorQuestion.query.filter(ErrorQuestion.upload_time < cutoff).order_by(ErrorQuestion.id)
+    while True:
+        batch = query.filter(ErrorQuestion.id > after_id).limit(BATCH_SIZE).all()
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1].id
+        db.session.expunge_all()
+
+
+def stored_files():
+    """上传目录（只有一层）和冷存储目录中的全部文件: (路径, 文件名)"""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if entry.is_file():
+                yield entry.path, entry.name
+    for root, _, names in os.walk(media.cold_folder()):
+        for name in names:
+            yield os.path.join(root, name), name
+
+
+def find_orphans(grace_minutes=60):
+    """
+    没有错题记录引用的文件（按 file_path 完整匹配，与扩展名无关）
+    最近grace_minutes分钟内修改的文件跳过（上传时先写文件再提交记录）
+    """
+    referenced = set(db.session.scalars(select(ErrorQuestion.file_path)))
+    cutoff = time.time() - grace_minutes * 60
+    orphans = []
+    for path, name in stored_files():
+        if name not in referenced and os.path.getmtime(path) < cutoff:
+            orphans.append(path)
+    return orphans
+
+
+def _quarantine_path(path):
+    """
+    孤立文件在隔离目录中的位置：保留相对上传目录或冷存储的路径（uploads/文件名、cold/年份/文件名），
+    之前隔离过同名文件时加序号，不覆盖
+    """
+    roots = (('uploads', current_app.config['UPLOAD_FOLDER']), ('cold', media.cold_folder()))
+    for prefix, root in roots:
+        try:
+            relative = os.path.relpath(path, root)
+        except ValueError:
+            # Windows下不在同一个盘
+            continue
+        if not relative.startswith(os.pardir):
+            break
+    else:
+        prefix, relative = 'other', os.path.basename(path)
+    target = os.path.join(orphan_folder(), prefix, relative)
+    base, ext = os.path.splitext(target)
+    counter = 1
+    while os.path.exists(target):
+        target = f"{base}.{counter}{ext}"
+        counter += 1
+    return target
+
+
+def quarantine(paths):
+    """把孤立文件移到 instance/orphan_uploads（确认无用后再手动删除），返回移动的字节数"""
+    moved = 0
+    for path in paths:
+        target = _quarantine_path(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        moved += os.path.getsize(path)
+        shutil.move(path, target)
+        logger.info("孤立文件已移到隔离目录: %s -> %s", path, target)
+    return moved
+
+
+def find_missing():
+    """热存储和冷存储中都找不到文件的错题ID"""
+    missing = []
+    for batch in _old_questions(0):
+        missing.extend(question.id for question in batch if not os.path.exists(media.original_path(question)))
+    return missing
+
+
+def find_duplicates():
+    """内容相同的文件分组（先按大小分组，大小相同的再计算SHA-1），已是硬链接的不算重复"""
+    by_size = {}
+    for path, _ in stored_files():
+        stat = os.stat(path)
+        by_size.setdefault(stat.st_size, {}).setdefault((stat.st_dev, stat.st_ino), path)
+    groups = []
+    for size, inodes in by_size.items():
+        if len(inodes) < 2:
+            continue
+        by_digest = {}
+        for path in inodes.values():
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    sha1.update(chunk)
+            by_digest.setdefault(sha1.hexdigest(), []).append(path)
+        groups.extend(sorted(paths) for paths in by_digest.values() if len(paths) > 1)
+    return groups
+
+
+def dedupe(groups):
+    """把重复文件替换为第一个文件的硬链接（错题记录和文件名不变），返回释放的字节数"""
+    saved = 0
+    for first, *others in groups:
+        for path in others:
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.link(first, tmp)
+            except OSError as e:
+                # 不同文件系统（热存储和冷存储分开挂载）或不支持硬链接
+                logger.warning("无法创建硬链接，保留重复文件: %s %s", path, e)
+                continue
+            saved += os.path.getsize(path)
+            os.replace(tmp, path)
+    return saved
+
+
+def _recompress_file(path, quality, min_saving):
+    """
+    重新压缩一个原图，节省不到min_saving比例时保留原文件，返回节省的字节数
+    - PNG：Pillow optimize，无损
+    - JPEG：quality为0（默认）时只用jpegtran做无损优化（未安装时跳过）；
+      quality>0时按该质量有损重新编码（保留EXIF和色彩配置），需要在配置中明确开启
+    """
+    from PIL import Image
+
+    size = os.path.getsize(path)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with Image.open(path) as image:
+            fmt = image.format
+            if fmt == 'PNG':
+                image.save(tmp, 'PNG', optimize=True)
+            elif fmt == 'JPEG' and quality:
+                options = {key: image.info[key] for key in ('exif', 'icc_profile') if image.info.get(key)}
+                image.save(tmp, 'JPEG', quality=quality, optimize=True, progressive=True, **options)
+            elif fmt == 'JPEG' and shutil.which('jpegtran'):
+                subprocess.run(['jpegtran', '-copy', 'all', '-optimize', '-progressive', '-outfile', tmp, path],
+                               check=True, capture_output=True, timeout=60)
+            else:
+                return 0
+        # 确认新文件可以正常打开
+        with Image.open(tmp) as image:
+            image.verify()
+        saved = size - os.path.getsize(tmp)
+        if saved < size * min_saving:
+            return 0
+        old_digest = media.file_digest(path)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    # 内容变化后缩略图地址中的摘要也会变化，删除旧的缩略图缓存
+    for thumbnail in glob.glob(os.path.join(current_app.config['THUMBNAIL_FOLDER'], f"{old_digest}_*")):
+        os.remove(thumbnail)
+    return saved
+
+
+def recompress(state, days, quality, min_saving=0.1, echo=None):
+    """重新压缩上传超过days天的图片原图（每张只处理一次，进度保存在状态文件中），返回 (处理数, 节省字节数)"""
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        logger.warning("未安装Pillow，跳过原图重新压缩")
+        return 0, 0
+
+    processed = saved = 0
+    with metrics.span('storage.recompress'):
+        for batch in _old_questions(state.get('recompressed_id', 0), days):
+            for question in batch:
+                path = media.original_path(question)
+                if question.file_type != 'image' or not os.path.exists(path):
+                    continue
+                try:
+                    saved += _recompress_file(path, quality, min_saving)
+                except Exception as e:
+                    logger.warning("重新压缩失败，保留原文件: question_id=%s %s", question.id, e)
+                processed += 1
+            state['recompressed_id'] = batch[-1].id
+            _save_state(state)
+            if echo:
+                echo(f"已重新压缩到错题 {state['recompressed_id']}，节省 {saved / 1024 / 1024:.1f} MB")
+    return processed, saved
+
+
+def move_to_cold(state, days, echo=None):
+    """把上传超过days天的原图移到冷存储（view_question等通过 media.original_path 仍能找到），返回 (文件数, 字节数)"""
+    moved = size = 0
+    with metrics.span('storage.cold'):
+        for batch in _old_questions(state.get('cold_id', 0), days):
+            for question in batch:
+                source = os.path.join(current_app.config['UPLOAD_FOLDER'], question.file_path)
+                if not os.path.exists(source):
+                    continue
+                target = media.cold_path(question)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                size += os.path.getsize(source)
+                # 同一文件系统时直接改名，否则复制后删除
+                shutil.move(source, target)
+                moved += 1
+            state['cold_id'] = batch[-1].id
+            _save_state(state)
+            if echo:
+                echo(f"已移到冷存储到错题 {state['cold_id']}，共 {moved} 个文件")
+    return moved, size
+
+
+def database_stats():
+    """数据库文件大小和空闲页比例"""
+    with db.engine.connect() as conn:
+        page_size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+        pages = conn.exec_driver_sql('PRAGMA page_count').scalar()
+        free = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+    return {'size': page_size * pages, 'free_ratio': free / pages if pages else 0.0}
+
+
+def compact_database(vacuum_free_ratio=0.2, force_vacuum=False):
+    """
+    更新查询优化器统计（ANALYZE，限制每个索引的采样行数，耗时与数据量无关）；
+    空闲页比例达到vacuum_free_ratio或force_vacuum时执行VACUUM重建数据库文件并截断WAL
+    VACUUM期间写入会等待（busy_timeout），应在夜间等无人使用时执行
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return {}
+    before = database_stats()
+    vacuumed = force_vacuum or before['free_ratio'] >= vacuum_free_ratio
+    db.session.remove()
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        with metrics.span('storage.analyze'):
+            conn.exec_driver_sql('PRAGMA analysis_limit=1000')
+            conn.exec_driver_sql('ANALYZE')
+        if vacuumed:
+            with metrics.span('storage.vacuum'):
+                conn.exec_driver_sql('VACUUM')
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    after = database_stats()
+    return {'before': before['size'], 'after': after['size'], 'free_ratio': before['free_ratio'], 'vacuumed': vacuumed}
+
+
+def folder_size(folder):
+    """目录占用的字节数，硬链接只计算一次"""
+    seen = set()
+    total = 0
+    for root, _, names in os.walk(folder):
+        for name in names:
+            stat = os.stat(os.path.join(root, name))
+            if (stat.st_dev, stat.st_ino) not in seen:
+                seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+    return total
+
+
+def usage():
+    """各存储位置占用的字节数和错题数"""
+    return {
+        'uploads': folder_size(current_app.config['UPLOAD_FOLDER']),
+        'cold': folder_size(media.cold_folder()),
+        'thumbnails': folder_size(current_app.config['THUMBNAIL_FOLDER']),
+        'orphans': folder_size(orphan_folder()),
+        'questions': db.session.scalar(select(func.count(ErrorQuestion.id))),
+    }
+
+
+def run_maintenance(dry_run=False, remove_orphans=False, dedupe_files=False, force_vacuum=False, full=False,
+                    echo=print):
+    """
+    存储维护（命令行 storage-maintenance，可每天定时执行）：
+    孤立文件和缺失文件检查、重复文件、旧原图重新压缩、移到冷存储、数据库ANALYZE/VACUUM
+    重新压缩和移到冷存储按状态文件中的错题ID增量处理，每次只处理新满足条件的错题；full时从头检查
+    """
+    config = current_app.config
+    state = {'recompressed_id': 0, 'cold_id': 0} if full else load_state()
+    report = {}
+
+    with metrics.span('storage.orphans'):
+        orphans = find_orphans()
+        missing = find_missing()
+    report['orphans'] = (len(orphans), sum(os.path.getsize(path) for path in orphans))
+    report['missing'] = missing
+    for path in orphans[:20]:
+        echo(f"孤立文件: {path}")
+    if missing:
+        echo(f"找不到文件的错题: {', '.join(map(str, missing[:20]))}")
+
+    groups = find_duplicates() if dedupe_files or dry_run else []
+    report['duplicates'] = (sum(len(group) - 1 for group in groups),
+                            sum(os.path.getsize(group[0]) * (len(group) - 1) for group in groups))
+
+    if dry_run:
+        report['database'] = database_stats() if db.engine.dialect.name == 'sqlite' else {}
+        return report
+
+    if remove_orphans and orphans:
+        quarantine(orphans)
+    if groups:
+        report['deduped'] = dedupe(groups)
+    if config.get('STORAGE_RECOMPRESS_AFTER_DAYS', 30):
+        report['recompressed'] = recompress(state, config.get('STORAGE_RECOMPRESS_AFTER_DAYS', 30),
+                                            config.get('STORAGE_JPEG_QUALITY', 0), echo=echo)
+    if config.get('STORAGE_COLD_AFTER_DAYS', 365):
+        report['cold'] = move_to_cold(state, config['STORAGE_COLD_AFTER_DAYS'], echo=echo)
+    _save_state(state)
+    report['database'] = compact_database(config.get('STORAGE_VACUUM_FREE_RATIO', 0.2), force_vacuum)
+    return report
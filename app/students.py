@@ -0,0 +1,45 @@
+from flask import g, session
+
+from .models import db, Student
+from .schema import DEFAULT_STUDENT_NAME
+
+
+def current_student():
+    """当前选择的学生（保存在session中），还没有学生时创建默认学生"""
+    if 'student' in g:
+        return g.student
+
+    student_id = session.get('student_id')
+    student = db.session.get(Student, student_id) if student_id else None
+    if student is None:
+        student = Student.query.order_by(Student.id).first()
+        if student is None:
+            student = Student(name=DEFAULT_STUDENT_NAME)
+            db.session.add(student)
+            db.session.commit()
+        session['student_id'] = student.id
+    g.student = student
+    return student
+
+
+def current_student_id():
+    return current_student().id
+
+
+def get_or_create(name, grade=None):
+    """按姓名查找学生，不存在时创建（导入成绩时使用）"""
+    student = Student.query.filter_by(name=name).first()
+    if student is None:
+        student = Student(name=name, grade=grade)
+        db.session.add(student)
+        db.session.flush()
+    return student
+
+
+def init_app(app):
+    """模板中可以使用 current_student 和 students（导航栏切换学生）"""
+
+    @app.context_processor
+    def inject_students():
+        return dict(current_student=current_student(),
+                    students=Student.query.order_by(Student.name).all())
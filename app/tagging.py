@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import load_only
+
+from . import metrics
+from .models import db, ErrorQuestion, QuestionTag
+from .selection import question_query, student_filter
+
+logger = logging.getLogger(__name__)
+
+# 默认知识点词典：{科目: {知识点: [关键词, ...]}}，可用 KNOWLEDGE_POINTS_FILE 指定其他文件
+DEFAULT_DICTIONARY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_points.json')
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick多模式匹配：所有关键词构建成一个自动机，对文本只扫描一遍找出全部关键词
+    英文关键词（如 sin、which）要求前后不是字母或数字，避免匹配到单词的一部分
+    """
+
+    def __init__(self, keywords):
+        """keywords: [(关键词, 值)]，匹配到关键词时返回对应的值"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for keyword, value in keywords:
+            keyword = keyword.strip().lower()
+            if keyword:
+                self._add(keyword, value)
+        self._build()
+
+    def _add(self, keyword, value):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(keyword), keyword.isascii(), value))
+
+    def _build(self):
+        """按广度优先计算失败指针，并合并失败指针所指状态的输出"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def search(self, text):
+        """返回文本中匹配到的值（每次出现返回一次）"""
+        text = text.lower()
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for length, ascii_keyword, value in self._output[state]:
+                if ascii_keyword and not _word_boundary(text, end - length, end):
+                    continue
+                yield value
+
+
+def _word_boundary(text, start, end):
+    before = text[start - 1] if start > 0 else ' '
+    after = text[end] if end < len(text) else ' '
+    return not (before.isascii() and before.isalnum()) and not (after.isascii() and after.isalnum())
+
+
+class Tagger:
+    """按知识点词典给错题内容打标签：科目已知时只保留该科目的知识点"""
+
+    def __init__(self, dictionary):
+        self.subjects = set(dictionary)
+        keywords = []
+        for subject, points in dictionary.items():
+            for point, words in points.items():
+                for word in {point, *words}:
+                    keywords.append((word, (subject, point)))
+        self.automaton = KeywordAutomaton(keywords)
+
+    def tag(self, text, subject=None):
+        """返回 {(科目, 知识点): 匹配次数}"""
+        tags = {}
+        if not text:
+            return tags
+        for key in self.automaton.search(text):
+            if subject in self.subjects and key[0] != subject:
+                continue
+            tags[key] = tags.get(key, 0) + 1
+        return tags
+
+
+_tagger = None
+_tagger_source = None
+_lock = threading.Lock()
+
+
+def get_tagger():
+    """当前进程的Tagger，词典文件修改后自动重新构建（需要在应用上下文中调用）"""
+    global _tagger, _tagger_source
+    path = current_app.config.get('KNOWLEDGE_POINTS_FILE') or DEFAULT_DICTIONARY
+    source = (path, os.path.getmtime(path))
+    with _lock:
+        if _tagger is None or _tagger_source != source:
+            with open(path, encoding='utf-8') as f:
+                dictionary = json.load(f)
+            _tagger = Tagger(dictionary)
+            _tagger_source = source
+            logger.info("知识点词典已加载: %s（%d 个知识点）", path, sum(len(points) for points in dictionary.values()))
+        return _tagger
+
+
+def update_tags(question):
+    """重新生成一道错题的标签（识别完成、编辑后调用），由调用方提交事务"""
+    with metrics.span('tagging.update'):
+        tags = get_tagger().tag(question.content, question.subject)
+        db.session.execute(delete(QuestionTag).where(QuestionTag.question_id == question.id))
+        if tags:
+            db.session.execute(insert(QuestionTag), [
+                {'question_id': question.id, 'student_id': question.student_id, 'subject': subject,
+                 'knowledge_point': point, 'hits': hits}
+                for (subject, point), hits in tags.items()])
+    return tags
+
+
+def rebuild(student_id=None, batch_size=500, echo=None):
+    """批量重建标签：按ID分批读取错题（只加载需要的列），每批一个事务，返回处理的错题数"""
+    tagger = get_tagger()
+    last_id = 0
+    processed = 0
+    while True:
+        query = ErrorQuestion.query.options(load_only(ErrorQuestion.id, ErrorQuestion.student_id,
+                                                      ErrorQuestion.subject, ErrorQuestion.content)) \
+            .filter(ErrorQuestion.id > last_id)
+        if student_id:
+            query = query.filter(ErrorQuestion.student_id == student_id)
+        questions = query.order_by(ErrorQuestion.id).limit(batch_size).all()
+        if not questions:
+            break
+        ids = [question.id for question in questions]
+        rows = [{'question_id': question.id, 'student_id': question.student_id, 'subject': subject,
+                 'knowledge_point': point, 'hits': hits}
+                for question in questions
+                for (subject, point), hits in tagger.tag(question.content, question.subject).items()]
+        db.session.execute(delete(QuestionTag).where(QuestionTag.question_id.in_(ids)))
+        if rows:
+            db.session.execute(insert(QuestionTag), rows)
+        db.session.commit()
+        processed += len(questions)
+        last_id = ids[-1]
+        if echo:
+            echo(f'已处理 {processed} 道错题（本批 {len(rows)} 个标签）')
+        db.session.expunge_all()
+    return processed
+
+
+def knowledge_point_counts(student_id, selection, limit=10):
+    """符合选择条件的错题中各知识点的错题数，返回 [(科目, 知识点, 错题数)]，按错题数从多到少"""
+    question_ids = select(question_query(student_id, selection).order_by(None)
+                          .with_entities(ErrorQuestion.id).subquery().c.id)
+    count = func.count(QuestionTag.question_id)
+    return db.session.query(QuestionTag.subject, QuestionTag.knowledge_point, count) \
+        .filter(student_filter(QuestionTag.student_id, student_id), QuestionTag.question_id.in_(question_ids)) \
+        .group_by(QuestionTag.knowledge_point, QuestionTag.subject) \
+        .order_by(count.desc(), QuestionTag.knowledge_point) \
+        .limit(limit).all()
+
+
+def question_tags(question_id):
+    """一道错题的知识点，匹配次数多的在前"""
+    return [tag.knowledge_point for tag in QuestionTag.query.filter_by(question_id=question_id)
+            .order_by(QuestionTag.hits.desc(), QuestionTag.knowledge_point)]
@@ -0,0 +1,109 @@
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class TaskQueue:
+    """后台任务队列（线程池），支持统计排队深度和退出前排空"""
+
+    def __init__(self, name, max_workers=2):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+        self._accepting = True
+
+    def configure(self, max_workers):
+        """调整工作线程数（仅在线程池创建前生效）"""
+        with self._lock:
+            if self._executor is None:
+                self.max_workers = max_workers
+
+    @property
+    def depth(self):
+        """排队中和执行中的任务数"""
+        with self._lock:
+            return self._pending
+
+    @property
+    def accepting(self):
+        with self._lock:
+            return self._accepting
+
+    def submit(self, fn, *args, **kwargs):
+        """提交任务，队列关闭后返回None"""
+        with self._lock:
+            if not self._accepting:
+                return None
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=f'{self.name}-worker')
+            self._pending += 1
+            executor = self._executor
+
+        def run():
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+                    if self._pending == 0:
+                        self._idle.notify_all()
+
+        return executor.submit(run)
+
+    def drain(self, timeout=None):
+        """停止接收新任务，并等待已提交的任务完成，返回是否全部完成"""
+        with self._lock:
+            self._accepting = False
+            finished = self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=finished)
+        return finished
+
+
+# OCR识别队列
+ocr_queue = TaskQueue('ocr', max_workers=2)
+# 分析报告队列
+report_queue = TaskQueue('report', max_workers=2)
+# 批量报告队列（单独限制同时调用DeepSeek的数量，不占用单份报告的队列）
+batch_queue = TaskQueue('batch', max_workers=4)
+
+_drain_timeout = 30
+
+
+def queues():
+    """所有后台队列"""
+    return [ocr_queue, report_queue, batch_queue]
+
+
+def drain_all(timeout=None):
+    """排空所有后台队列，用于优雅退出"""
+    timeout = _drain_timeout if timeout is None else timeout
+    results = {}
+    for queue in queues():
+        pending = queue.depth
+        results[queue.name] = queue.drain(timeout=timeout)
+        if pending:
+            logger.info("后台队列 %s 已排空: %s（剩余任务 %d）", queue.name, results[queue.name], queue.depth)
+    return results
+
+
+def init_app(app):
+    """根据配置设置队列的工作线程数，并在进程退出时排空队列"""
+    global _drain_timeout
+    ocr_queue.configure(app.config.get('OCR_WORKERS', 2))
+    report_queue.configure(app.config.get('REPORT_WORKERS', 2))
+    batch_queue.configure(app.config.get('BATCH_REPORT_CONCURRENCY', 4))
+    _drain_timeout = app.config.get('SHUTDOWN_TIMEOUT', 30)
+    app.extensions['task_queues'] = queues()
+
+
+atexit.register(drain_all)
@@ -0,0 +1,92 @@
+"""
+容量压测：对运行中的服务并发发送GET请求，统计吞吐量和延迟分位数
+
+用法:
+    python benchmarks/capacity.py --url http://127.0.0.1:8000 --paths / /error_questions --concurrency 32 --duration 20
+"""
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(values, pct):
+    """计算分位数（最近秩法）"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def worker(host, port, paths, deadline, latencies, errors, lock):
+    """单个压测线程：复用长连接循环请求"""
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    local_latencies = []
+    local_errors = 0
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 500:
+                local_errors += 1
+            else:
+                local_latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+
+
+def run(url, paths, concurrency, duration):
+    """执行压测并返回统计结果"""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    latencies, errors, lock = [], [], threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=worker, args=(host, port, paths, deadline, latencies, errors, lock))
+               for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务容量压测')
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--paths', nargs='+', default=['/', '/error_questions', '/analysis_results'])
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+
+    stats = run(args.url, args.paths, args.concurrency, args.duration)
+    print(f"并发 {args.concurrency}，持续 {args.duration:.0f} 秒，路径 {' '.join(args.paths)}")
+    print(f"成功请求 {stats['requests']}，错误 {stats['errors']}")
+    print(f"吞吐量 {stats['rps']:.1f} req/s")
+    print(f"延迟 p50 {stats['p50_ms']:.1f}ms  p95 {stats['p95_ms']:.1f}ms  p99 {stats['p99_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""
+本地模拟的OCR.space和DeepSeek（chat completions）服务，用于压测和离线开发
+
+用法:
+    python benchmarks/fake_servers.py --ocr-port 9001 --llm-port 9002 --latency 0.8 --error-rate 0.05
+
+然后设置环境变量让应用使用模拟服务:
+    OCR_API_URL=http://127.0.0.1:9001/parse/image
+    DEEPSEEK_API_URL=http://127.0.0.1:9002/v1/chat/completions
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_OCR_TEXT = "15.（1）已知m、n是自然数，a、b、c均不为0，若\n(ab)^m = a^2b^n，求m+n的值。\n"
+
+SAMPLE_REPORT = """# 学习分析报告
+
+## 成绩趋势分析
+
+整体成绩保持稳定，数学提升明显。
+
+## 学科对比分析
+
+语文、英语表现平稳，数学为优势学科。
+
+## 错题类型分析
+
+计算错误和审题失误占比较高。
+
+## 学习建议
+
+1. 每天安排15分钟计算专项练习。
+2. 审题时圈出关键词。
+
+```
+成绩趋势数据：
+- 期中考试: 620
+- 期末考试: 645
+```
+
+```
+学科对比数据：
+- 语文: 105
+- 数学: 118
+- 英语: 110
+```
+
+```
+错题类型数据：
+- 概念不清: 20%
+- 计算错误: 35%
+- 审题失误: 25%
+- 方法不当: 10%
+- 知识点盲区: 10%
+```
+"""
+
+
+class FakeBehavior:
+    """模拟服务的延迟与故障配置，运行中可修改"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500,
+                 quota_rate=0.0, stream_chunk_delay=0.02):
+        self.latency = latency  # 平均响应延迟（秒）
+        self.jitter = jitter  # 延迟抖动（秒，均匀分布）
+        self.error_rate = error_rate  # 返回HTTP错误的比例
+        self.error_status = error_status
+        self.quota_rate = quota_rate  # 返回配额耗尽错误的比例
+        self.stream_chunk_delay = stream_chunk_delay  # 流式响应每个分片的间隔
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def wait(self):
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def roll(self, rate):
+        return rate > 0 and random.random() < rate
+
+    def count(self, error=False):
+        with self.lock:
+            self.requests += 1
+            if error:
+                self.errors += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    behavior = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OCRHandler(_Handler):
+    """模拟 OCR.space /parse/image"""
+
+    def do_POST(self):
+        self._read_body()
+        behavior = self.behavior
+        behavior.wait()
+
+        if behavior.roll(behavior.error_rate):
+            behavior.count(error=True)
+            self._send_json(behavior.error_status, {'ErrorMessage': ['模拟服务错误']})
+            return
+        if behavior.roll(behavior.quota_rate):
+            behavior.count(error=True)
+            # OCR.space超出配额时返回403并给出提示
+            self._send_json(403, {'IsErroredOnProcessing': True,
+                                  'ErrorMessage': ['You may only perform this action upto maximum 180 number of times within 60 seconds']})
+            return
+
+        behavior.count()
+        self._send_json(200, {
+            'ParsedResults': [{'ParsedText': SAMPLE_OCR_TEXT, 'FileParseExitCode': 1}],
+            'OCRExitCode': 1,
+            'IsErroredOnProcessing': False,
+            'ProcessingTimeInMilliseconds': str(int(behavior.latency * 1000)),
+        })
+
+
+class ChatHandler(_Handler):
+    """模拟 DeepSeek /v1/chat/completions，支持 stream=true 的SSE流式响应"""
+
+    def do_POST(self):
+        try:
+            request_data = json.loads(self._read_body() or b'{}')
+        except ValueError:
+            request_data = {}
+        behavior = self.behavior
+        behavior.wait()
+
+        if behavior.roll(behavior.error_rate):
+            behavior.count(error=True)
+            self._send_json(behavior.error_status, {'error': {'message': '模拟服务错误'}})
+            return
+        if behavior.roll(behavior.quota_rate):
+            behavior.count(error=True)
+            self._send_json(429, {'error': {'message': 'Rate limit reached'}})
+            return
+
+        behavior.count()
+        if request_data.get('stream'):
+            self._stream(behavior)
+            return
+
+        self._send_json(200, {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'model': request_data.get('model', 'deepseek-chat'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': SAMPLE_REPORT},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': len(json.dumps(request_data, ensure_ascii=False)) // 2,
+                      'completion_tokens': len(SAMPLE_REPORT) // 2},
+        })
+
+    def _stream(self, behavior):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for line in SAMPLE_REPORT.splitlines(keepends=True):
+            chunk = {'choices': [{'index': 0, 'delta': {'content': line}}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            if behavior.stream_chunk_delay:
+                time.sleep(behavior.stream_chunk_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class FakeServer:
+    """在后台线程中运行的模拟服务"""
+
+    def __init__(self, handler, behavior=None, host='127.0.0.1', port=0):
+        self.behavior = behavior or FakeBehavior()
+        handler_class = type(handler.__name__, (handler,), {'behavior': self.behavior})
+        self.httpd = ThreadingHTTPServer((host, port), handler_class)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.port}{path}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def start_ocr_server(port=0, **behavior):
+    return FakeServer(OCRHandler, FakeBehavior(**behavior), port=port).start()
+
+
+def start_chat_server(port=0, **behavior):
+    return FakeServer(ChatHandler, FakeBehavior(**behavior), port=port).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟OCR.space与DeepSeek服务')
+    parser.add_argument('--ocr-port', type=int, default=9001)
+    parser.add_argument('--llm-port', type=int, default=9002)
+    parser.add_argument('--latency', type=float, default=0.5, help='平均延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.1, help='延迟抖动（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='HTTP错误比例')
+    parser.add_argument('--quota-rate', type=float, default=0.0, help='配额耗尽错误比例')
+    args = parser.parse_args()
+
+    behavior = dict(latency=args.latency, jitter=args.jitter,
+                    error_rate=args.error_rate, quota_rate=args.quota_rate)
+    ocr = start_ocr_server(args.ocr_port, **behavior)
+    chat = start_chat_server(args.llm_port, **behavior)
+    print(f"OCR_API_URL={ocr.url('/parse/image')}")
+    print(f"DEEPSEEK_API_URL={chat.url('/v1/chat/completions')}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        ocr.stop()
+        chat.stop()
+
+
+if __name__ == '__main__':
+    main()
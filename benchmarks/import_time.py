@@ -0,0 +1,90 @@
+"""
+冷启动检查：在全新子进程中创建应用，统计耗时和常驻内存，
+并确认重量级模块没有在启动阶段被加载。启动变慢或重新引入顶层重量级导入时以非0状态退出。
+
+用法:
+    python benchmarks/import_time.py [--runs 5] [--budget-ms 800]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只应在具体功能中按需加载的模块
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'alembic', 'flask_migrate', 'requests']
+
+# 数据库和额度、指标等状态文件都放在临时目录，不升级仓库中的数据库，也不写入 instance/
+PROBE = r"""
+import json, os, sys, time
+workdir = sys.argv[1]
+start = time.perf_counter()
+from app import create_app
+create_app({
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'probe.db'),
+    'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+    'THUMBNAIL_FOLDER': os.path.join(workdir, 'thumbs'),
+    'OCR_QUOTA_FILE': os.path.join(workdir, 'ocr_quota.db'),
+    'METRICS_FILE': os.path.join(workdir, 'metrics.db'),
+})
+elapsed = time.perf_counter() - start
+try:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError:
+    rss_kb = None
+print('@@' + json.dumps({
+    'ms': elapsed * 1000,
+    'rss_kb': rss_kb,
+    'loaded': [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure():
+    """在新进程中执行一次冷启动探测"""
+    env = dict(os.environ)
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    workdir = tempfile.mkdtemp(prefix='import_time_')
+    try:
+        output = subprocess.run([sys.executable, '-c', PROBE, workdir], cwd=BASE_DIR, env=env,
+                                capture_output=True, text=True, check=True).stdout
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    line = next(line for line in output.splitlines() if line.startswith('@@'))
+    return json.loads(line[2:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='应用冷启动耗时检查')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=800, help='create_app耗时上限（取多次最小值）')
+    args = parser.parse_args()
+
+    results = [measure() for _ in range(args.runs)]
+    best = min(r['ms'] for r in results)
+    rss = [r['rss_kb'] for r in results if r['rss_kb']]
+    loaded = sorted({m for r in results for m in r['loaded']})
+
+    print(f"create_app 冷启动耗时: 最小 {best:.0f}ms，最大 {max(r['ms'] for r in results):.0f}ms（{args.runs} 次）")
+    if rss:
+        print(f"启动后峰值常驻内存: {min(rss) / 1024:.1f}MB")
+
+    failed = False
+    if loaded:
+        print(f"失败：启动阶段加载了重量级模块 {', '.join(loaded)}")
+        failed = True
+    if best > args.budget_ms:
+        print(f"失败：冷启动耗时超过预算 {args.budget_ms:.0f}ms")
+        failed = True
+    if not failed:
+        print("通过")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
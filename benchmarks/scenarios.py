@@ -0,0 +1,331 @@
+"""
+端到端性能场景：使用临时数据库、临时上传目录和本地模拟的OCR/DeepSeek服务，
+统计每个场景的 p50/p95/p99 延迟和吞吐量。
+
+用法:
+    python benchmarks/scenarios.py                       # 运行全部场景
+    python benchmarks/scenarios.py --only upload list    # 只运行部分场景
+    python benchmarks/scenarios.py --json result.json    # 保存结果
+    python benchmarks/scenarios.py --baseline base.json  # 与基线比较，退化超过阈值时以非0状态退出
+
+场景:
+    upload    并发上传错题图片（upload_question），并统计上传到OCR完成的端到端延迟
+    import    导入10万行成绩CSV（import_scores）
+    analysis  并发生成分析报告（generate_analysis），并统计到DeepSeek报告替换本地草稿的端到端延迟
+    list      列表页加载（/、/error_questions、/grade_analysis、/analysis_results）
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from capacity import percentile  # noqa: E402
+from fake_servers import start_chat_server, start_ocr_server  # noqa: E402
+
+SUBJECTS = ['语文', '数学', '英语', '物理', '化学']
+REASONS = ['概念不清', '计算错误', '审题失误', '方法不当', '知识点盲区']
+# 各科错题内容样例（包含知识点词典中的关键词）
+TOPICS = {
+    '语文': ['文言文翻译：解释加点实词的含义', '指出这句话运用的修辞手法（比喻、拟人）', '修改病句'],
+    '数学': ['解一元二次方程，先求判别式', '求二次函数抛物线的顶点坐标和对称轴', '用勾股定理求直角三角形斜边'],
+    '英语': ['用现在完成时填空', '定语从句中关系代词 which 与 that 的选择', '完形填空'],
+    '物理': ['根据欧姆定律求电阻', '凸透镜成像规律，求焦距', '计算浮力和排开液体的体积'],
+    '化学': ['配平化学方程式并说明质量守恒', '判断金属活动性顺序', '酸和碱的中和反应，溶液pH变化'],
+}
+
+
+def summarize(name, latencies, errors, elapsed, items=None):
+    """汇总单个场景的统计结果"""
+    count = items if items is not None else len(latencies)
+    return {
+        'scenario': name,
+        'count': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'throughput': count / elapsed if elapsed else 0.0,
+        'elapsed_s': elapsed,
+    }
+
+
+def run_concurrently(app, total, concurrency, task):
+    """用concurrency个线程（各自持有测试客户端）执行total次task(client, i)，返回 (延迟列表, 错误数, 总耗时)"""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            ok = task(client, i)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - started
+
+
+def seed(app, exams=30, questions=300):
+    """写入压测用的考试和错题数据"""
+    from app import db, tagging
+    from app.models import ErrorQuestion, ExamScore, Student
+
+    sample = _sample_image()
+    with app.app_context():
+        db.create_all()
+        student = Student(name='压测学生', grade='初二')
+        db.session.add(student)
+        db.session.flush()
+        start = date(2024, 9, 1)
+        for i in range(exams):
+            db.session.add(ExamScore(student_id=student.id, grade='初二', exam_type=f'第{i + 1}次月考', date=start + timedelta(days=14 * i),
+                                     chinese=90 + i % 10, math=100 + i % 15, english=95 + i % 12,
+                                     physics=80 + i % 9, chemistry=75 + i % 8))
+        for i in range(questions):
+            name = f'seed_{i}.jpg'
+            subject = SUBJECTS[i % len(SUBJECTS)]
+            shutil.copyfile(sample, os.path.join(app.config['UPLOAD_FOLDER'], name))
+            db.session.add(ErrorQuestion(student_id=student.id, filename=name, file_path=name, file_type='image',
+                                         content=f'第{i}题：{TOPICS[subject][i % 3]}。已知a、b均不为0，求a+b的值。',
+                                         subject=subject, grade='初二',
+                                         exam=f'第{i % exams + 1}次月考', reason=REASONS[i % len(REASONS)]))
+        db.session.commit()
+        tagging.rebuild()
+
+
+def _sample_image():
+    uploads = os.path.join(BASE_DIR, 'app', 'static', 'uploads')
+    return os.path.join(uploads, sorted(f for f in os.listdir(uploads) if f.endswith('.jpg'))[0])
+
+
+def scenario_upload(app, total=50, concurrency=10, timeout=120):
+    """并发上传，随后轮询数据库统计从上传开始到OCR结果写入的延迟"""
+    from app import db
+    from app.models import ErrorQuestion
+
+    with open(_sample_image(), 'rb') as f:
+        image = f.read()
+    started_at = {}
+    lock = threading.Lock()
+
+    def task(client, i):
+        start = time.perf_counter()
+        response = client.post('/upload_question', data={'file': (io.BytesIO(image), f'burst_{i}.jpg')})
+        location = response.headers.get('Location', '')
+        if response.status_code != 302 or '/edit_question/' not in location:
+            return False
+        with lock:
+            started_at[int(location.rsplit('/', 1)[1])] = start
+        return True
+
+    latencies, errors, elapsed = run_concurrently(app, total, concurrency, task)
+    results = [summarize('upload', latencies, errors, elapsed)]
+
+    # 轮询OCR完成情况
+    ocr_latencies = {}
+    deadline = time.perf_counter() + timeout
+    with app.app_context():
+        while len(ocr_latencies) < len(started_at) and time.perf_counter() < deadline:
+            pending = [qid for qid in started_at if qid not in ocr_latencies]
+            done = ErrorQuestion.query.with_entities(ErrorQuestion.id).filter(
+                ErrorQuestion.id.in_(pending), ErrorQuestion.content.isnot(None)).all()
+            now = time.perf_counter()
+            for (qid,) in done:
+                ocr_latencies[qid] = now - started_at[qid]
+            db.session.remove()
+            time.sleep(0.02)
+    ocr_elapsed = max(ocr_latencies.values()) if ocr_latencies else 0.0
+    results.append(summarize('upload_to_ocr', list(ocr_latencies.values()),
+                             len(started_at) - len(ocr_latencies), ocr_elapsed))
+    return results
+
+
+def scenario_import(app, rows=100000):
+    """单次导入大批量成绩CSV"""
+    lines = ['grade,examType,date,chinese,math,english,physics,chemistry']
+    start = date(2020, 1, 1)
+    for i in range(rows):
+        lines.append(f'初二,第{i % 50}次练习,{start + timedelta(days=i % 1500)},{80 + i % 40},{90 + i % 30},'
+                     f'{85 + i % 35},{70 + i % 30},{60 + i % 40}')
+    payload = '\n'.join(lines).encode('utf-8')
+
+    def task(client, i):
+        response = client.post('/import_scores', data={'file': (io.BytesIO(payload), 'scores.csv')})
+        return response.status_code == 302 and '/grade_analysis' in response.headers.get('Location', '')
+
+    latencies, errors, elapsed = run_concurrently(app, 1, 1, task)
+    return [summarize('import', latencies, errors, elapsed, items=rows if not errors else 0)]
+
+
+def scenario_analysis(app, total=40, concurrency=8, timeout=120):
+    """并发生成分析报告：统计本地草稿返回的延迟，以及到DeepSeek报告替换草稿的端到端延迟"""
+    from app.models import ErrorQuestion, ExamScore
+
+    with app.app_context():
+        exam_ids = [e.id for e in ExamScore.query.order_by(ExamScore.id).limit(10)]
+        question_ids = [q.id for q in ErrorQuestion.query.order_by(ErrorQuestion.id).limit(30)]
+    started_at = {}
+    lock = threading.Lock()
+
+    def task(client, i):
+        start = time.perf_counter()
+        response = client.post('/generate_analysis', json={'exam_ids': exam_ids, 'question_ids': question_ids})
+        data = response.get_json() if response.status_code == 200 else {}
+        if data.get('status') != 'success':
+            return False
+        with lock:
+            started_at[data['analysis_id']] = start
+        return True
+
+    latencies, errors, elapsed = run_concurrently(app, total, concurrency, task)
+    results = [summarize('analysis', latencies, errors, elapsed)]
+
+    # 轮询DeepSeek报告完成情况
+    final_latencies = {}
+    client = app.test_client()
+    deadline = time.perf_counter() + timeout
+    while len(final_latencies) < len(started_at) and time.perf_counter() < deadline:
+        for analysis_id in [a for a in started_at if a not in final_latencies]:
+            if client.get(f'/analysis_status/{analysis_id}').get_json()['status'] == 'done':
+                final_latencies[analysis_id] = time.perf_counter() - started_at[analysis_id]
+        time.sleep(0.02)
+    final_elapsed = max(final_latencies.values()) if final_latencies else 0.0
+    results.append(summarize('analysis_final', list(final_latencies.values()),
+                             len(started_at) - len(final_latencies), final_elapsed))
+    return results
+
+
+def scenario_list(app, total=400, concurrency=8):
+    """列表页加载"""
+    paths = ['/', '/error_questions', '/grade_analysis', '/analysis_results']
+
+    def task(client, i):
+        return client.get(paths[i % len(paths)]).status_code == 200
+
+    latencies, errors, elapsed = run_concurrently(app, total, concurrency, task)
+    return [summarize('list', latencies, errors, elapsed)]
+
+
+SCENARIOS = {
+    'upload': scenario_upload,
+    'import': scenario_import,
+    'analysis': scenario_analysis,
+    'list': scenario_list,
+}
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较：p95变慢或吞吐量下降超过tolerance视为退化"""
+    regressions = []
+    previous = {r['scenario']: r for r in baseline}
+    for result in results:
+        base = previous.get(result['scenario'])
+        if not base:
+            continue
+        if base['p95_ms'] and result['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{result['scenario']}: p95 {base['p95_ms']:.1f}ms -> {result['p95_ms']:.1f}ms")
+        if base['throughput'] and result['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(f"{result['scenario']}: 吞吐量 {base['throughput']:.1f} -> {result['throughput']:.1f}/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端性能场景压测')
+    parser.add_argument('--only', nargs='+', choices=list(SCENARIOS), help='只运行指定场景')
+    parser.add_argument('--ocr-latency', type=float, default=0.3, help='模拟OCR延迟（秒）')
+    parser.add_argument('--llm-latency', type=float, default=1.0, help='模拟DeepSeek延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟服务的错误比例')
+    parser.add_argument('--uploads', type=int, default=50)
+    parser.add_argument('--rows', type=int, default=100000, help='import场景的成绩行数')
+    parser.add_argument('--analyses', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--json', help='把结果写入JSON文件')
+    parser.add_argument('--baseline', help='基线结果JSON文件')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='允许的退化比例')
+    args = parser.parse_args()
+
+    ocr = start_ocr_server(latency=args.ocr_latency, jitter=args.ocr_latency / 5, error_rate=args.error_rate)
+    chat = start_chat_server(latency=args.llm_latency, jitter=args.llm_latency / 5, error_rate=args.error_rate)
+    workdir = tempfile.mkdtemp(prefix='bench_')
+
+    from app import create_app, tasks
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'bench.db'),
+        'UPLOAD_FOLDER': os.path.join(workdir, 'uploads'),
+        'THUMBNAIL_FOLDER': os.path.join(workdir, 'thumbs'),
+        'OCR_API_URL': ocr.url('/parse/image'),
+        'DEEPSEEK_API_URL': chat.url('/v1/chat/completions'),
+        'DEEPSEEK_API_KEY': 'bench-key',
+        # 本地假服务没有配额：不限速，额度状态也不写入生产的 instance/ocr_quota.db
+        'OCR_QUOTA_FILE': os.path.join(workdir, 'ocr_quota.db'),
+        'OCR_RATE_PER_MINUTE': 0,
+        'OCR_RATE_PER_DAY': 0,
+        'METRICS_FILE': os.path.join(workdir, 'metrics.db'),
+    })
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    results = []
+    try:
+        seed(app)
+        for name in args.only or list(SCENARIOS):
+            if name == 'upload':
+                results += scenario_upload(app, total=args.uploads, concurrency=args.concurrency)
+            elif name == 'import':
+                results += scenario_import(app, rows=args.rows)
+            elif name == 'analysis':
+                results += scenario_analysis(app, total=args.analyses, concurrency=args.concurrency)
+            else:
+                results += SCENARIOS[name](app, concurrency=args.concurrency)
+    finally:
+        tasks.drain_all(timeout=10)
+        ocr.stop()
+        chat.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'场景':<16}{'次数':>8}{'错误':>6}{'p50(ms)':>12}{'p95(ms)':>12}{'p99(ms)':>12}{'吞吐量(/s)':>14}")
+    for r in results:
+        print(f"{r['scenario']:<16}{r['count']:>8}{r['errors']:>6}{r['p50_ms']:>12.1f}{r['p95_ms']:>12.1f}"
+              f"{r['p99_ms']:>12.1f}{r['throughput']:>14.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("性能退化:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("与基线相比无明显退化")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,6 +11,9 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app/static/uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)  # 确保目录存在
 
+# 缩略图缓存路径（可随时删除，按需重新生成）
+THUMBNAIL_FOLDER = os.path.join(BASE_DIR, 'app/static/thumbs')
+
 # 允许上传的文件类型
 UPLOAD_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.pdf']
 SCORE_EXTENSIONS = ['.xlsx', '.xls', '.csv', '.json']  # 成绩文件支持的格式
@@ -25,10 +28,63 @@ DEEPSEEK_API_URL = os.getenv('DEEPSEEK_API_URL', 'https://api.deepseek.com/v1/ch
 
 # OCR API
 OCR_API_KEY = os.getenv('OCR_API_KEY', 'K86116371588957')
-OCR_API_URL = 'https://api.ocr.space/parse/image'
+OCR_API_URL = os.getenv('OCR_API_URL', 'https://api.ocr.space/parse/image')
 
 # 应用密钥
 SECRET_KEY = os.getenv('SECRET_KEY', '8080')
 
 # 最大上传文件大小 (10MB)
-MAX_CONTENT_LENGTH = 10 * 1024 * 1024
\ No newline at end of file
+MAX_CONTENT_LENGTH = 10 * 1024 * 1024
+
+# 生产部署配置（wsgi.py / gunicorn.conf.py 使用）
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8000'))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', '0'))  # 进程数，0表示按CPU核数自动计算
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', '8'))  # 每个进程的线程数
+
+# 后台任务队列
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '2'))  # OCR识别并发数
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '2'))  # 报告生成并发数
+BATCH_REPORT_CONCURRENCY = int(os.getenv('BATCH_REPORT_CONCURRENCY', '4'))  # 批量生成报告时同时调用DeepSeek的数量
+SHUTDOWN_TIMEOUT = int(os.getenv('SHUTDOWN_TIMEOUT', '30'))  # 退出时等待队列排空的秒数
+
+# OCR.space密钥限额（0表示不限制），超出后任务延后重试而不是判为识别失败
+OCR_RATE_PER_MINUTE = int(os.getenv('OCR_RATE_PER_MINUTE', '60'))
+OCR_RATE_PER_DAY = int(os.getenv('OCR_RATE_PER_DAY', '500'))
+OCR_INTERACTIVE_RESERVE = float(os.getenv('OCR_INTERACTIVE_RESERVE', '0.2'))  # 每分钟额度中为单张上传保留的比例
+OCR_BULK_RESERVE_PER_DAY = int(os.getenv('OCR_BULK_RESERVE_PER_DAY', '50'))  # 每日额度中为单张上传保留的次数，批量补识别不会用掉
+OCR_QUOTA_FILE = os.getenv('OCR_QUOTA_FILE', '')  # 各进程共用的额度状态文件（SQLite），为空时保存到 instance/ocr_quota.db
+
+# DeepSeek超时与熔断：最近WINDOW秒内至少MIN_REQUESTS次调用，错误率或慢调用比例超过阈值时熔断OPEN_SECONDS秒
+DEEPSEEK_TIMEOUT = int(os.getenv('DEEPSEEK_TIMEOUT', '60'))  # 读取超时（秒）
+DEEPSEEK_BREAKER_WINDOW = int(os.getenv('DEEPSEEK_BREAKER_WINDOW', '60'))
+DEEPSEEK_BREAKER_MIN_REQUESTS = int(os.getenv('DEEPSEEK_BREAKER_MIN_REQUESTS', '5'))
+DEEPSEEK_BREAKER_ERROR_RATE = float(os.getenv('DEEPSEEK_BREAKER_ERROR_RATE', '0.5'))
+DEEPSEEK_BREAKER_SLOW_SECONDS = float(os.getenv('DEEPSEEK_BREAKER_SLOW_SECONDS', '30'))
+DEEPSEEK_BREAKER_SLOW_RATE = float(os.getenv('DEEPSEEK_BREAKER_SLOW_RATE', '0.5'))
+DEEPSEEK_BREAKER_OPEN_SECONDS = int(os.getenv('DEEPSEEK_BREAKER_OPEN_SECONDS', '30'))
+DEEPSEEK_FALLBACK = os.getenv('DEEPSEEK_FALLBACK', 'mock')  # 熔断时的处理：mock返回本地生成的报告，error直接报错
+ANALYSIS_MAX_QUESTIONS = int(os.getenv('ANALYSIS_MAX_QUESTIONS', '200'))  # 提示词中最多包含的错题数（按条件选择时）
+ANALYSIS_INCREMENTAL = os.getenv('ANALYSIS_INCREMENTAL', 'true').lower() in ('1', 'true', 'yes')  # 只更新受新增数据影响的报告章节
+KNOWLEDGE_POINTS_FILE = os.getenv('KNOWLEDGE_POINTS_FILE')  # 知识点词典（JSON），默认 app/knowledge_points.json
+ANALYTICS_FOLDER = os.getenv('ANALYTICS_FOLDER', '')  # 分析快照（Parquet）目录，为空时保存到 instance/analytics
+
+# 存储维护（flask storage-maintenance），天数为0表示不执行该步骤
+COLD_STORAGE_FOLDER = os.getenv('COLD_STORAGE_FOLDER', '')  # 冷存储目录，为空时保存到 instance/cold_uploads
+STORAGE_RECOMPRESS_AFTER_DAYS = int(os.getenv('STORAGE_RECOMPRESS_AFTER_DAYS', '30'))  # 上传超过N天的原图重新压缩
+STORAGE_JPEG_QUALITY = int(os.getenv('STORAGE_JPEG_QUALITY', '0'))  # 0表示JPEG只做无损优化（需要jpegtran），大于0时按该质量有损重新编码
+STORAGE_COLD_AFTER_DAYS = int(os.getenv('STORAGE_COLD_AFTER_DAYS', '365'))  # 上传超过N天的原图移到冷存储
+STORAGE_VACUUM_FREE_RATIO = float(os.getenv('STORAGE_VACUUM_FREE_RATIO', '0.2'))  # 数据库空闲页达到该比例时VACUUM
+
+# 指标
+METRICS_FILE = os.getenv('METRICS_FILE', '')  # 各进程共用的指标文件（SQLite），为空时保存到 instance/metrics.db
+
+# 日志
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')  # DEBUG时输出API请求/响应内容
+LOG_FILE = os.getenv('LOG_FILE', '')  # 为空时只输出到终端
+LOG_PAYLOAD_LIMIT = int(os.getenv('LOG_PAYLOAD_LIMIT', '500'))  # 大段内容最多输出的字符数
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.1'))  # 完整请求/响应内容的采样比例
+
+# 性能分析
+PROFILE_REQUESTS = os.getenv('PROFILE_REQUESTS', 'false').lower() == 'true'  # 开启后带 ?_profile=1 的请求输出cProfile结果
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')  # 为空时保存到 instance/profiles
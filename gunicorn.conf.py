@@ -0,0 +1,34 @@
+"""
+gunicorn配置：gunicorn -c gunicorn.conf.py wsgi:app
+
+所有参数都可以通过环境变量覆盖，含义与 config.py 中的 SERVER_* 一致。
+"""
+import multiprocessing
+import os
+
+bind = f"{os.getenv('SERVER_HOST', '0.0.0.0')}:{os.getenv('SERVER_PORT', '8000')}"
+
+# 进程数：默认 CPU核数*2+1
+workers = int(os.getenv('SERVER_WORKERS', '0')) or multiprocessing.cpu_count() * 2 + 1
+# 每个进程的线程数，OCR/报告等待上游时不会占满进程
+threads = int(os.getenv('SERVER_THREADS', '8'))
+worker_class = 'gthread'
+
+# 报告生成会等待DeepSeek，超时需大于上游超时(60秒)
+timeout = 90
+# 收到SIGTERM后给正在处理的请求和后台队列留出的时间
+graceful_timeout = int(os.getenv('SHUTDOWN_TIMEOUT', '30')) + 5
+keepalive = 5
+
+# 每个进程各自创建应用，避免fork后共享数据库连接
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    """工作进程退出前排空OCR/报告队列"""
+    from app import tasks
+    results = tasks.drain_all()
+    server.log.info("worker %s 后台队列排空结果: %s", worker.pid, results)
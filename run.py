@@ -1,6 +1,8 @@
 import os
 import webbrowser
+from datetime import datetime
 from threading import Timer
+import click
 from app import create_app, db
 import sys
 from dotenv import load_dotenv
@@ -8,13 +10,6 @@ from dotenv import load_dotenv
 # 加载环境变量
 load_dotenv()
 
-# 打印环境变量，用于调试
-print("环境变量:")
-print(f"DEEPSEEK_API_KEY: {os.environ.get('DEEPSEEK_API_KEY')}")
-print(f"DEEPSEEK_API_URL: {os.environ.get('DEEPSEEK_API_URL')}")
-print(f"OCR_API_KEY: {os.environ.get('OCR_API_KEY')}")
-print(f"SECRET_KEY: {os.environ.get('SECRET_KEY')}")
-
 app = create_app()
 
 def open_browser():
@@ -24,10 +19,269 @@ def open_browser():
 
 @app.cli.command("init-db")
 def init_db():
-    """初始化数据库"""
-    db.create_all()
+    """初始化数据库（已有数据库时补齐新增的表、列和索引）"""
+    from app import schema
+    schema.upgrade()
     print('数据库初始化完成')
 
+@app.cli.command("build-assets")
+def build_assets():
+    """压缩前端资源并生成带哈希的文件名和gzip/brotli预压缩版本"""
+    from app import assets
+    manifest = assets.build(app)
+    for name, output in manifest.items():
+        print(f'{name} -> {output}')
+    print(f'前端资源打包完成，共 {len(manifest)} 个文件')
+
+@app.cli.command("build-tailwind")
+@click.option('--cli', 'executable', default=None,
+              help='Tailwind独立CLI（v4）路径，默认使用PATH中的 tailwindcss（pip install tailwindcss-bin）')
+def build_tailwind(executable):
+    """预编译Tailwind样式表，模板中用到新的class后执行，然后再执行 build-assets"""
+    import shutil
+    from app import assets
+    executable = executable or shutil.which('tailwindcss')
+    if not executable:
+        print('找不到Tailwind CLI，请先执行 pip install tailwindcss-bin，或用 --cli 指定独立CLI的路径')
+        return
+    output = assets.build_tailwind(app, executable)
+    print(f'Tailwind样式表已生成: {output}（{os.path.getsize(output) / 1024:.1f} KB）')
+
+@app.cli.command("backfill-ocr")
+@click.option('--state', type=click.Choice(['failed', 'empty', 'all']), default='all',
+              help='failed: 识别失败的记录；empty: 内容为空的记录（如PDF）；all: 两者')
+@click.option('--student', help='只处理该学生（姓名）')
+@click.option('--subject', help='只处理该科目')
+@click.option('--grade', help='只处理该年级')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), help='只处理该日期之后上传的记录')
+@click.option('--ids', help='只处理指定ID，逗号分隔')
+@click.option('--min-age', type=int, default=10, show_default=True, help='跳过最近N分钟内上传的记录')
+@click.option('--concurrency', type=int, default=4, show_default=True, help='同时识别的数量')
+@click.option('--checkpoint', default=None, help='检查点文件，默认 instance/backfill_ocr.json')
+@click.option('--restart', is_flag=True, help='忽略已有检查点，从头开始')
+@click.option('--dry-run', is_flag=True, help='只列出需要处理的记录数')
+def backfill_ocr(state, student, subject, grade, since, ids, min_age, concurrency, checkpoint, restart, dry_run):
+    """批量重新OCR识别失败或内容为空的错题，可中断后继续"""
+    from app.backfill import run_backfill, select_questions
+    from app.models import Student
+
+    student_id = None
+    if student:
+        record = Student.query.filter_by(name=student).first()
+        if record is None:
+            print(f'学生不存在: {student}')
+            return
+        student_id = record.id
+
+    id_list = [int(i) for i in ids.split(',') if i.strip()] if ids else None
+    questions = select_questions(state, student_id=student_id, subject=subject, grade=grade, since=since, ids=id_list, min_age=min_age)
+    print(f'找到 {len(questions)} 条需要识别的记录')
+    if dry_run or not questions:
+        return
+
+    checkpoint = checkpoint or os.path.join(app.instance_path, 'backfill_ocr.json')
+    if restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    print(f'开始识别（并发 {concurrency}，检查点 {checkpoint}，开始于 {datetime.now():%H:%M:%S}）')
+    progress = run_backfill(app, questions, concurrency=concurrency, checkpoint_path=checkpoint)
+    if progress.finished >= progress.total:
+        print('补识别完成')
+
+@app.cli.command("rebuild-tags")
+@click.option('--student', help='只处理该学生（姓名）')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='每批处理的错题数')
+def rebuild_tags(student, batch_size):
+    """按知识点词典重新匹配全部错题的知识点标签（升级后或修改词典后执行）"""
+    from app import tagging
+    from app.models import Student
+
+    student_id = None
+    if student:
+        record = Student.query.filter_by(name=student).first()
+        if record is None:
+            print(f'学生不存在: {student}')
+            return
+        student_id = record.id
+
+    started = datetime.now()
+    processed = tagging.rebuild(student_id=student_id, batch_size=batch_size, echo=print)
+    print(f'知识点标签重建完成，共 {processed} 道错题，用时 {(datetime.now() - started).total_seconds():.1f} 秒')
+
+@app.cli.command("batch-reports")
+@click.option('--grade', help='为该年级的全部学生生成报告')
+@click.option('--student', 'students', multiple=True, help='为指定学生（姓名）生成报告，可重复')
+@click.option('--subject', help='只分析该科目')
+@click.option('--date-from', help='开始日期（YYYY-MM-DD）')
+@click.option('--date-to', help='结束日期（YYYY-MM-DD）')
+@click.option('--concurrency', type=int, default=None, help='同时调用DeepSeek的数量，默认 BATCH_REPORT_CONCURRENCY')
+@click.option('--resume', 'resume_id', type=int, help='继续生成该批次中未完成的报告')
+def batch_reports(grade, students, subject, date_from, date_to, concurrency, resume_id):
+    """批量生成一个年级（或多名学生）的分析报告，每份报告完成后立即保存"""
+    from app import batch
+    from app.models import ReportBatch, Student
+    from app.selection import parse_selection
+    from app.tasks import batch_queue
+
+    if concurrency:
+        batch_queue.configure(concurrency)
+    try:
+        if resume_id:
+            report_batch = db.session.get(ReportBatch, resume_id)
+            if report_batch is None:
+                print(f'批次不存在: {resume_id}')
+                return
+            print(f'重新提交 {batch.resume(app, report_batch)} 份未完成的报告')
+        else:
+            student_ids = []
+            for name in students:
+                record = Student.query.filter_by(name=name).first()
+                if record is None:
+                    print(f'学生不存在: {name}')
+                    return
+                student_ids.append(record.id)
+            selection = parse_selection({'filters': {'subject': subject, 'date_from': date_from, 'date_to': date_to}})
+            report_batch = batch.create_batch(app, selection, grade=grade, student_ids=student_ids)
+            print(f'已创建批次 {report_batch.id}：{report_batch.title}，共 {report_batch.total} 份报告')
+    except ValueError as e:
+        print(e)
+        return
+
+    try:
+        batch.wait(report_batch, echo=print)
+    except KeyboardInterrupt:
+        print('已中断，等待进行中的报告完成...')
+        batch_queue.drain(timeout=app.config.get('SHUTDOWN_TIMEOUT', 30))
+        print(f'使用 --resume {report_batch.id} 继续生成未完成的报告')
+
+@app.cli.command("analytics-snapshot")
+@click.option('--full', is_flag=True, help='重新生成全部快照（成绩被修改或删除、知识点词典变化后使用）')
+@click.option('--min-age', type=int, default=60, show_default=True, help='只汇总上传超过N分钟的错题（等识别和打标签完成）')
+@click.option('--batch-size', type=int, default=5000, show_default=True, help='每批读取的记录数')
+def analytics_snapshot(full, min_age, batch_size):
+    """把成绩和错题统计追加到按学年、年级分区的Parquet快照（可定时执行）"""
+    from app.snapshot import SnapshotError, run_snapshot
+
+    started = datetime.now()
+    try:
+        state = run_snapshot(full=full, min_age=min_age, batch_size=batch_size, echo=print)
+    except SnapshotError as e:
+        print(e)
+        return
+    print(f'分析快照完成：成绩 {state["exam_rows"]} 行，错题统计 {state["question_rows"]} 行，'
+          f'用时 {(datetime.now() - started).total_seconds():.1f} 秒')
+
+@app.cli.command("analytics-report")
+@click.argument('report', type=click.Choice(['scores', 'reasons', 'knowledge-points']))
+@click.option('--subject', help='科目（scores必填）')
+@click.option('--by', default='grade,school_year', show_default=True,
+              help='分组维度，逗号分隔：school_year、grade、term、student_id、exam_type、subject、month')
+@click.option('--year', 'years', type=int, multiple=True, help='只统计该学年（9月开始），可重复')
+@click.option('--grade', 'grades', multiple=True, help='只统计该年级，可重复')
+@click.option('--limit', type=int, default=10, show_default=True, help='错题统计每组显示的条数')
+def analytics_report(report, subject, by, years, grades, limit):
+    """基于分析快照的跨学期统计（不查询业务数据库）"""
+    from app import analytics
+    from app.snapshot import SnapshotError
+
+    by = [item.strip() for item in by.split(',') if item.strip()]
+    try:
+        if report == 'scores':
+            if not subject:
+                print('scores 需要指定 --subject')
+                return
+            rows = analytics.score_averages(subject, by=by, school_years=years, grades=grades)
+        elif report == 'reasons':
+            rows = analytics.reason_counts(by=by, school_years=years, grades=grades, subject=subject, limit=limit)
+        else:
+            rows = analytics.knowledge_point_counts(by=by, school_years=years, grades=grades, subject=subject,
+                                                    limit=limit)
+    except (SnapshotError, ValueError) as e:
+        print(e)
+        return
+    for row in rows:
+        print('  '.join(f'{key}={value:.1f}' if isinstance(value, float) else f'{key}={value}'
+                        for key, value in row.items()))
+    print(f'共 {len(rows)} 行')
+
+@app.cli.command("export-zip")
+@click.argument('output')
+@click.option('--student', required=True, help='学生姓名')
+@click.option('--subject', help='只导出该科目')
+@click.option('--grade', help='只导出该年级')
+@click.option('--date-from', help='开始日期（YYYY-MM-DD）')
+@click.option('--date-to', help='结束日期（YYYY-MM-DD）')
+@click.option('--images', type=click.Choice(['original', 'sm', 'md', 'none']), default='original', show_default=True,
+              help='original: 原图；sm/md: 缩略图；none: 只导出清单和报告')
+@click.option('--manifest', type=click.Choice(['csv', 'json']), default='csv', show_default=True, help='错题清单格式')
+@click.option('--no-reports', is_flag=True, help='不导出分析报告')
+def export_zip(output, student, subject, grade, date_from, date_to, images, manifest, no_reports):
+    """把错题（文件和识别内容）和分析报告导出为zip压缩包，OUTPUT为 - 时写到标准输出"""
+    from app import export
+    from app.models import Student
+    from app.selection import parse_selection
+
+    record = Student.query.filter_by(name=student).first()
+    if record is None:
+        print(f'学生不存在: {student}', file=sys.stderr)
+        return
+    try:
+        filters = parse_selection({'filters': {'subject': subject, 'grade': grade,
+                                               'date_from': date_from, 'date_to': date_to}})['filters']
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return
+
+    started = datetime.now()
+    target = sys.stdout.buffer if output == '-' else open(output, 'wb')
+    size = 0
+    try:
+        for chunk in export.stream_archive(record.id, filters, images=images, manifest=manifest,
+                                           include_reports=not no_reports):
+            target.write(chunk)
+            size += len(chunk)
+    finally:
+        if target is not sys.stdout.buffer:
+            target.close()
+    print(f'导出完成：{size / 1024 / 1024:.1f} MB，用时 {(datetime.now() - started).total_seconds():.1f} 秒',
+          file=sys.stderr)
+
+@app.cli.command("storage-maintenance")
+@click.option('--dry-run', is_flag=True, help='只检查（孤立文件、缺失文件、重复文件、数据库空闲页），不做任何修改')
+@click.option('--remove-orphans', is_flag=True, help='把孤立文件移到 instance/orphan_uploads')
+@click.option('--dedupe', is_flag=True, help='把内容相同的文件替换为硬链接')
+@click.option('--vacuum', is_flag=True, help='无论空闲页比例都执行VACUUM')
+@click.option('--full', is_flag=True, help='从头检查全部错题是否需要重新压缩、移到冷存储（修改相关配置后使用）')
+def storage_maintenance(dry_run, remove_orphans, dedupe, vacuum, full):
+    """上传文件和数据库维护：孤立文件检查、旧原图重新压缩、移到冷存储、ANALYZE/VACUUM（可每天定时执行）"""
+    from app import storage
+
+    def mb(size):
+        return f'{size / 1024 / 1024:.1f} MB'
+
+    started = datetime.now()
+    before = storage.usage()
+    report = storage.run_maintenance(dry_run=dry_run, remove_orphans=remove_orphans, dedupe_files=dedupe,
+                                     force_vacuum=vacuum, full=full, echo=print)
+    count, size = report['orphans']
+    print(f'孤立文件 {count} 个（{mb(size)}）' + ('，已移到隔离目录' if remove_orphans and count and not dry_run else ''))
+    print(f'找不到文件的错题 {len(report["missing"])} 道')
+    count, size = report['duplicates']
+    if dry_run or dedupe:
+        print(f'重复文件 {count} 个（{mb(size)}）' + ('，已替换为硬链接' if dedupe and not dry_run else ''))
+    if 'recompressed' in report:
+        print(f'重新压缩 {report["recompressed"][0]} 张原图，节省 {mb(report["recompressed"][1])}')
+    if 'cold' in report:
+        print(f'移到冷存储 {report["cold"][0]} 个文件（{mb(report["cold"][1])}）')
+    database = report['database']
+    if dry_run and database:
+        print(f'数据库 {mb(database["size"])}，空闲页 {database["free_ratio"]:.0%}')
+    elif database:
+        print('数据库已ANALYZE' + (f'，VACUUM {mb(database["before"])} -> {mb(database["after"])}'
+                                   if database['vacuumed'] else f'（空闲页 {database["free_ratio"]:.0%}，未VACUUM）'))
+    after = storage.usage()
+    print('存储占用：' + '，'.join(f'{name} {mb(after[name])}' for name in ('uploads', 'cold', 'thumbnails', 'orphans')) +
+          f'（维护前上传目录 {mb(before["uploads"])}），用时 {(datetime.now() - started).total_seconds():.1f} 秒')
+
 if __name__ == '__main__':
     # 只在第一次启动时打开浏览器，避免debug模式下重启导致多窗口
     Timer(1, open_browser).start()
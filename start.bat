@@ -43,7 +43,7 @@ if %errorlevel% neq 0 (
 
 REM Install required packages
 echo Installing required packages...
-pip install flask flask-sqlalchemy pandas openpyxl requests python-dotenv
+pip install -r requirements.txt
 if %errorlevel% neq 0 (
     echo Packages installed successfully.
 ) else (
@@ -63,6 +63,10 @@ if %errorlevel% neq 0 (
     exit /b 1
 )
 
+REM Build front-end assets
+echo Building front-end assets...
+python -m flask --app run.py build-assets
+
 REM Start the application
 echo Starting application...
 start http://127.0.0.1:5000
@@ -0,0 +1,50 @@
+"""
+生产环境WSGI入口
+
+Linux:   gunicorn -c gunicorn.conf.py wsgi:app
+Windows: python wsgi.py   （使用waitress多线程服务）
+"""
+import os
+import signal
+import sys
+
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+from app import create_app, tasks
+
+app = create_app()
+
+
+def serve():
+    """使用waitress启动多线程服务，收到退出信号后排空后台队列"""
+    from waitress.server import create_server
+
+    host = app.config.get('SERVER_HOST', '0.0.0.0')
+    port = app.config.get('SERVER_PORT', 8000)
+    threads = app.config.get('SERVER_THREADS', 8)
+    server = create_server(app, host=host, port=port, threads=threads)
+
+    def shutdown(signum, frame):
+        app.logger.info("收到退出信号 %s，停止接收新请求", signum)
+        server.close()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    app.logger.info("服务已启动: http://%s:%s/ （线程数 %s，进程 %s）", host, port, threads, os.getpid())
+    try:
+        server.run()
+    except OSError:
+        # server.close() 之后select可能抛出“bad file descriptor”
+        pass
+    finally:
+        app.logger.info("正在等待后台任务完成...")
+        tasks.drain_all()
+        app.logger.info("服务已停止")
+
+
+if __name__ == '__main__':
+    sys.exit(serve())